@@ -0,0 +1,222 @@
+"""
+Deterministic synthetic billing data for benchmarks. The same arguments always generate the same data.
+"""
+import csv
+import datetime
+import io
+import itertools
+import random
+from typing import (
+    Mapping,
+    Sequence,
+)
+
+CUR_COLUMNS = [
+    'identity/LineItemId',
+    'lineItem/LineItemType',
+    'lineItem/UsageAccountId',
+    'lineItem/UsageStartDate',
+    'lineItem/UsageType',
+    'lineItem/BlendedCost',
+    'lineItem/LineItemDescription',
+    'lineItem/ResourceId',
+    'product/ProductName',
+    'product/region',
+    'resourceTags/user:Owner',
+    'resourceTags/user:owner',
+]
+
+SERVICES = [
+    'Amazon Elastic Compute Cloud',
+    'Amazon Simple Storage Service',
+    'Amazon Elasticsearch Service',
+    'Amazon Relational Database Service',
+    'AWS Lambda',
+    'Amazon CloudWatch',
+]
+
+REGIONS = ['us-east-1', 'us-east-2', 'us-west-1', 'us-west-2']
+
+LINE_ITEM_TYPES = ['Usage'] * 16 + ['DiscountedUsage', 'Fee', 'Tax', 'Credit']
+
+
+def account_ids(accounts: int) -> Sequence[str]:
+    """
+    >>> account_ids(2)
+    ['100000000000', '100000000001']
+    """
+    return [str(100000000000 + i) for i in range(accounts)]
+
+
+def owners(tags: int) -> Sequence[str]:
+    """
+    >>> owners(2)
+    ['user0@ucsc.edu', 'user1@ucsc.edu']
+    """
+    return [f'user{i}@ucsc.edu' for i in range(tags)]
+
+
+def usage_types(service: str, count: int = 4) -> Sequence[str]:
+    """
+    >>> usage_types('AWS Lambda', 2)
+    ['AWSLambda-Usage0', 'AWSLambda-Usage1']
+    """
+    prefix = ''.join(word for word in service.split() if word not in ('Amazon', 'Service'))
+    return [f'{prefix}-Usage{i}' for i in range(count)]
+
+
+def cur_csv_lines(month: datetime.date,
+                  rows: int,
+                  resources: int,
+                  accounts: int,
+                  tags: int,
+                  extra_columns: int = 0,
+                  seed: int = 0) -> Sequence[str]:
+    """
+    Return the lines of a CUR CSV for the given month, as returned by AWSReport.usage_csv. About one row in ten has
+    no resource id and one resource in three is untagged. Extra columns pad each row to a more realistic width.
+
+    >>> lines = cur_csv_lines(datetime.date(2020, 10, 1), rows=3, resources=2, accounts=1, tags=1)
+    >>> len(lines)
+    4
+    >>> lines == cur_csv_lines(datetime.date(2020, 10, 1), rows=3, resources=2, accounts=1, tags=1)
+    True
+    >>> row = next(csv.DictReader(lines))
+    >>> row['lineItem/UsageAccountId'], row['lineItem/UsageStartDate'][:8]
+    ('100000000000', '2020-10-')
+    """
+    rng = random.Random(seed)
+    ids = account_ids(accounts)
+    people = owners(tags)
+    days = ((month.replace(day=28) + datetime.timedelta(days=4)).replace(day=1) - month).days
+    catalog = []
+    for i in range(resources):
+        service = SERVICES[i % len(SERVICES)]
+        catalog.append((f'r-{i:08x}', service, rng.choice(ids), rng.choice(REGIONS), rng.choice(people) if i % 3 and people else ''))
+
+    columns = CUR_COLUMNS + [f'extra/Column{i}' for i in range(extra_columns)]
+    padding = ['x'] * extra_columns
+    with io.StringIO() as file:
+        writer = csv.writer(file, lineterminator='\n')
+        writer.writerow(columns)
+        for i in range(rows):
+            resourceId, service, account, region, owner = catalog[rng.randrange(resources)]
+            usage_type = rng.choice(usage_types(service))
+            if i % 10 == 9:
+                resourceId = ''
+            day = month + datetime.timedelta(days=rng.randrange(days))
+            writer.writerow([
+                f'{i:012x}',
+                rng.choice(LINE_ITEM_TYPES),
+                account,
+                f'{day.isoformat()}T00:00:00Z',
+                usage_type,
+                f'{rng.expovariate(1 / 3):.10f}',
+                f'{usage_type} in {region}',
+                resourceId,
+                service,
+                region,
+                owner if i % 2 else '',
+                '' if i % 2 else owner,
+                *padding
+            ])
+        return file.getvalue().splitlines()
+
+
+def cost_and_usage_response(request: Mapping,
+                            accounts: int,
+                            services: int = len(SERVICES),
+                            seed: int = 0) -> Mapping:
+    """
+    Return a fake response of the Cost Explorer get_cost_and_usage call for the given request, with one result per day
+    of the requested period and one group per combination of the requested dimensions.
+
+    >>> request = {
+    ...     'TimePeriod': {'Start': '2020-10-01', 'End': '2020-10-03'},
+    ...     'Granularity': 'DAILY',
+    ...     'Metrics': ['BlendedCost'],
+    ...     'GroupBy': [{'Type': 'DIMENSION', 'Key': 'LINKED_ACCOUNT'}, {'Type': 'DIMENSION', 'Key': 'SERVICE'}]
+    ... }
+    >>> response = cost_and_usage_response(request, accounts=2, services=3)
+    >>> [(r['TimePeriod']['Start'], len(r['Groups'])) for r in response['ResultsByTime']]
+    [('2020-10-01', 6), ('2020-10-02', 6)]
+    >>> response == cost_and_usage_response(request, accounts=2, services=3)
+    True
+    """
+    dimensions = {
+        'LINKED_ACCOUNT': account_ids(accounts),
+        'SERVICE': SERVICES[:services],
+        'USAGE_TYPE': [usage_type for service in SERVICES[:services] for usage_type in usage_types(service)],
+    }
+    start = datetime.date.fromisoformat(request['TimePeriod']['Start'])
+    end = datetime.date.fromisoformat(request['TimePeriod']['End'])
+    keys = [dimensions[group['Key']] for group in request.get('GroupBy', [])]
+    resultsByTime = []
+    day = start
+    while day < end:
+        rng = random.Random(f'{seed}-{day}')
+        groups = []
+        for combination in itertools.product(*keys):
+            metrics = {}
+            for metric in request['Metrics']:
+                if metric == 'UsageQuantity':
+                    metrics[metric] = {'Amount': f'{rng.uniform(0, 1000):.6f}', 'Unit': 'GB-Month'}
+                else:
+                    metrics[metric] = {'Amount': f'{rng.expovariate(1 / 20):.10f}', 'Unit': 'USD'}
+            groups.append({'Keys': list(combination), 'Metrics': metrics})
+        resultsByTime.append({
+            'TimePeriod': {'Start': day.isoformat(), 'End': (day + datetime.timedelta(days=1)).isoformat()},
+            'Groups': groups,
+            'Estimated': False
+        })
+        day += datetime.timedelta(days=1)
+    return {'ResultsByTime': resultsByTime}
+
+
+def bigquery_rows(month: datetime.date,
+                  projects: int,
+                  services: int = 20,
+                  density: float = 0.5,
+                  seed: int = 0) -> Sequence[Mapping]:
+    """
+    Return fake rows of GCPReport.queryDailyRows for the given invoice month. Each project uses about `density` of the
+    services on any given day.
+
+    >>> rows = bigquery_rows(datetime.date(2020, 10, 1), projects=2, services=2, density=1.0)
+    >>> len(rows)
+    124
+    >>> sorted(rows[0])
+    ['cost', 'description', 'id', 'name', 'raw_cost', 'usage_date']
+    """
+    rng = random.Random(seed)
+    days = ((month.replace(day=28) + datetime.timedelta(days=4)).replace(day=1) - month).days
+    rows = []
+    for day in range(days):
+        usage_date = month + datetime.timedelta(days=day)
+        for project in range(projects):
+            for service in range(services):
+                if rng.random() < density:
+                    raw_cost = rng.expovariate(1 / 5)
+                    rows.append({
+                        'name': f'Project {project}',
+                        'description': f'Service {service}',
+                        'usage_date': usage_date,
+                        'cost': raw_cost * rng.uniform(0.8, 1.0),
+                        'raw_cost': raw_cost,
+                        'id': f'project-{project}'
+                    })
+    return rows
+
+
+def terra_workspaces(projects: int, tags: int) -> Sequence[Mapping]:
+    """
+    Return fake Terra workspaces owning every other project.
+
+    >>> terra_workspaces(3, 1)
+    [{'workspace': {'googleProject': 'project-0', 'createdBy': 'user0@ucsc.edu'}}, {'workspace': {'googleProject': 'project-2', 'createdBy': 'user0@ucsc.edu'}}]
+    """
+    people = owners(tags)
+    return [
+        {'workspace': {'googleProject': f'project-{project}', 'createdBy': people[project % len(people)]}}
+        for project in range(0, projects, 2)
+    ]
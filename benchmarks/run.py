@@ -0,0 +1,187 @@
+"""
+Times the aggregation and rendering hot paths of the reports against synthetic data and stores the results, so that
+regressions between commits are visible. Run from the repository root:
+
+    python -m benchmarks.run
+"""
+import argparse
+import datetime
+import json
+from pathlib import (
+    Path,
+)
+import statistics
+import subprocess
+import tempfile
+import time
+from typing import (
+    Any,
+    Callable,
+    Mapping,
+    Optional,
+)
+
+from benchmarks import (
+    generators,
+)
+import report
+from src import (
+    anomaly,
+    cost_rollup,
+    money,
+)
+
+MONTH = datetime.date(2020, 10, 1)
+REPORT_DATE = datetime.date(2020, 10, 20)
+
+
+def measure(function: Callable[[], Any], repeat: int) -> Mapping[str, float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return {'min': min(timings), 'median': statistics.median(timings)}
+
+
+def write_config(directory: str, accounts: int) -> str:
+    account_names = {account_id: f'account-{i}' for i, account_id in enumerate(generators.account_ids(accounts))}
+    path = Path(directory) / 'config.json'
+    path.write_text(json.dumps({
+        'aws': {
+            'accounts': account_names,
+            'compliance': {'accounts': account_names, 'regions': generators.REGIONS},
+            'access_key': 'benchmark',
+            'bucket': 'benchmark',
+            'prefix': 'benchmark',
+            'report_name': 'benchmark',
+            'from': 'from@example.com',
+            'recipients': ['to@example.com']
+        },
+        'gcp': {
+            'bigquery_table': 'benchmark',
+            'from': 'from@example.com',
+            'recipients': ['to@example.com']
+        }
+    }))
+    return str(path)
+
+
+def aws_report(config_path: str, arguments: argparse.Namespace) -> report.AWSReport:
+    """Return an AWS report whose CUR is cached and whose Cost Explorer requests are answered by the generator."""
+    aws = report.AWSReport(config_path, REPORT_DATE)
+    aws.cache[('cur', aws.cur_source, MONTH)] = generators.cur_csv_lines(MONTH,
+                                                                         rows=arguments.rows,
+                                                                         resources=arguments.resources,
+                                                                         accounts=arguments.accounts,
+                                                                         tags=arguments.tags,
+                                                                         extra_columns=arguments.extra_columns)
+    aws.getDailyCostAndUsage = lambda query, month: generators.cost_and_usage_response(
+        dict(query, TimePeriod={'Start': month.isoformat(), 'End': report.next_month(month).isoformat()}),
+        accounts=arguments.accounts
+    )['ResultsByTime']
+    return aws
+
+
+def gcp_report(config_path: str, arguments: argparse.Namespace) -> report.GCPReport:
+    gcp = report.GCPReport(config_path, REPORT_DATE)
+    gcp.cache[('terra', gcp.terra_workspaces_path)] = generators.terra_workspaces(arguments.projects, arguments.tags)
+    gcp.cache[('bigquery', gcp.bigquery_table, MONTH)] = generators.bigquery_rows(MONTH, projects=arguments.projects)
+    # BigQuery's rollup of the generated rows, in dollars like the query returns it
+    gcp.queryCostRollup = lambda date, cutoff: [
+        dict(row, cost_month=row['cost_month'] / money.DOLLAR, cost_today=row['cost_today'] / money.DOLLAR)
+        for rows in cost_rollup.rollup(gcp.doQuery(date), cutoff).levels.values()
+        for row in rows
+    ]
+    return gcp
+
+
+def run(arguments: argparse.Namespace) -> Mapping[str, Mapping[str, float]]:
+    with tempfile.TemporaryDirectory() as directory:
+        config_path = write_config(directory, arguments.accounts)
+        aws = aws_report(config_path, arguments)
+        accounts = aws.compliance['accounts']
+        resources = aws.generateResourceSummary(accounts)
+        gcp = gcp_report(config_path, arguments)
+        rows = gcp.doQuery(REPORT_DATE)
+        daily_costs = {}
+        for row in gcp.dailyRows(MONTH):
+            daily_costs.setdefault((row['id'], row['description']), {})[row['usage_date']] = money.from_dollars(row['cost'])
+
+        benchmarks = {
+            'aws.generateResourceSummary': lambda: aws.generateResourceSummary(accounts),
+            'aws.generateUserCostSummary': lambda: aws.generateUserCostSummary(resources, accounts),
+            'aws.render': lambda: aws.generateBetterReport(side_effects=False),
+            'gcp.doQuery': lambda: gcp.doQuery(REPORT_DATE),
+            'gcp.group_by': lambda: list(report.group_by(rows, 'id', 'cost_month', 'cost_today', 'name', 'created_by')),
+            'gcp.filter_by': lambda: list(report.filter_by(rows, id='project-0')),
+            'gcp.sort_by': lambda: report.sort_by(rows, 'cost_month'),
+            'gcp.render': lambda: gcp.generateBetterReport(side_effects=False),
+            'anomaly.detect': lambda: anomaly.detect(daily_costs, REPORT_DATE),
+        }
+        return {
+            name: measure(function, arguments.repeat)
+            for name, function in benchmarks.items()
+            if arguments.only is None or name in arguments.only
+        }
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              check=True,
+                              stdout=subprocess.PIPE,
+                              universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def previous_results(results_dir: Path, commit: str) -> Optional[Mapping]:
+    paths = sorted((path for path in results_dir.glob('*.json') if path.stem != commit), key=lambda path: path.stat().st_mtime)
+    return json.loads(paths[-1].read_text()) if paths else None
+
+
+def change(current: float, previous: float) -> str:
+    """
+    >>> change(1.5, 1.0)
+    '+50.0%'
+    >>> change(0.9, 1.0)
+    '-10.0%'
+    """
+    return f'{(current - previous) / previous:+.1%}'
+
+
+def main(arguments: argparse.Namespace) -> None:
+    results_dir = Path(arguments.results_dir)
+    results_dir.mkdir(parents=True, exist_ok=True)
+    commit = current_commit()
+    baseline = json.loads(Path(arguments.compare).read_text()) if arguments.compare else previous_results(results_dir, commit)
+    results = {
+        'commit': commit,
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'parameters': {key: getattr(arguments, key) for key in ('rows', 'resources', 'accounts', 'tags', 'extra_columns', 'projects', 'repeat')},
+        'timings': run(arguments)
+    }
+    for name, timing in results['timings'].items():
+        line = f'{name:32} {timing["min"] * 1000:10.2f} ms'
+        if baseline is not None and baseline['parameters'] == results['parameters'] and name in baseline['timings']:
+            line += f'  {change(timing["min"], baseline["timings"][name]["min"]):>8} vs {baseline["commit"]}'
+        print(line)
+    (results_dir / f'{commit}.json').write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    # noinspection PyTypeChecker
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000, help='Number of CUR rows.')
+    parser.add_argument('--resources', type=int, default=20000, help='Number of distinct resources in the CUR.')
+    parser.add_argument('--accounts', type=int, default=20, help='Number of AWS accounts.')
+    parser.add_argument('--tags', type=int, default=50, help='Number of distinct owner tags.')
+    parser.add_argument('--extra-columns', type=int, default=0, help='Number of unused columns padding each CUR row.')
+    parser.add_argument('--projects', type=int, default=200, help='Number of GCP projects.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of times each benchmark is timed.')
+    parser.add_argument('--only', nargs='*', default=None, help='Names of the benchmarks to run. Defaults to all.')
+    parser.add_argument('--results-dir', default='benchmarks/results', help='Directory results are stored in, one file per commit.')
+    parser.add_argument('--compare', default=None, help='Results file to compare against. Defaults to the latest from another commit.')
+    main(parser.parse_args())
@@ -3,6 +3,7 @@ Summarizes given billing data for a cloud platform as a .eml printed to stdout.
 """
 import argparse
 import collections
+import concurrent.futures
 import csv
 import datetime
 from decimal import (
@@ -11,73 +12,192 @@ from decimal import (
 from email.message import (
     EmailMessage,
 )
+import functools
 import gzip
+import hashlib
+import heapq
 import io
 import itertools
 import json
 import numbers
 import operator
+import os
 from pathlib import (
     Path,
 )
 import re
 import tempfile
+import threading
 from typing import (
     Any,
+    Callable,
+    Collection,
     Iterable,
     Iterator,
     Mapping,
+    MutableMapping,
+    Optional,
     Sequence,
+    Set,
+    Tuple,
     Union,
 )
 import uuid
 
-import boto3
-from dateutil.relativedelta import (
-    relativedelta,
-)
-from google.cloud import (
-    bigquery,
-)
-import jinja2
+# The cloud SDKs and jinja2 are slow to import, so they are imported where they are first used. That way each platform
+# only loads its own SDK, see scripts/check-import-time.py.
 
-from src.Boto3_STS_Service import (
-    Boto3_STS_Service,
+from src import (
+    anomaly,
+    clients,
+    cost_rollup,
+    cur_parquet,
+    exports,
+    money,
 )
 from src.compliance_report import (
+    SCANNED_PRODUCTS,
     compliance_report,
 )
+from src.compliance_snapshot import (
+    ComplianceSnapshot,
+)
+from src.cost_explorer import (
+    CostExplorerClient,
+    rate_limiter,
+)
+from src.fetch_cache import (
+    FetchCache,
+)
+from src.history_store import (
+    HistoryStore,
+)
+from src.persistence import (
+    Uploader,
+)
 from src.report_resource import (
+    normalized_resource_id,
     report_resource,
 )
+from src.resource_aggregator import (
+    ResourceAggregator,
+)
+from src.run_profile import (
+    RunProfile,
+)
+from src.run_store import (
+    ReportRun,
+    RunStore,
+)
+
+
+# The Jinja environment shared by the reports of this process, see Report.jinja_env
+shared_jinja_env = None
+shared_jinja_env_lock = threading.Lock()
+
+
+def create_jinja_env():
+    import jinja2
+    jinja_env = jinja2.Environment(loader=jinja2.FileSystemLoader('templates/'))
+    jinja_env.globals['DOLLAR'] = money.DOLLAR
+    jinja_env.filters.update({
+        'print_amount': print_amount,
+        'ymd': lambda d: d.strftime('%Y/%m/%d'),
+        'ym': lambda d: d.strftime('%Y/%m'),
+        'nested_sum_values': lambda m: sum(sum(k.values()) for k in m.values()),
+        'sum_values': lambda m: sum(m.values()),
+        'sum_key': lambda rows, key: sum(row[key] for row in rows),
+        'group_by': group_by,
+        'filter_by': filter_by,
+        'sort_by': sort_by,
+        'to_project_id': lambda value: 'project-' + to_id(value),
+        'to_service_id': lambda value: 'service-' + to_id(value),
+        'print_diff': jinja2.contextfilter(lambda context, a: print_diff(a, context['warning_threshold'])),
+    })
+    return jinja_env
 
 
 class Report:
     UNTAGGED = '(untagged)'
-
-    def __init__(self, *, platform: str, date: datetime.date, config_path: str):
+    # Billing data of the last few days is still being restated, so their history partitions are rewritten every run
+    HISTORY_RESTATEMENT_DAYS = 3
+    # Number of days before the report date that daily costs are compared against
+    ANOMALY_WINDOW = 28
+    # Number of days until the billing data of a day has usually landed, see Timing in README.md
+    DATA_DELAY_DAYS = 1
+
+    def __init__(self,
+                 *,
+                 platform: str,
+                 date: datetime.date,
+                 config_path: str,
+                 cache: Optional[MutableMapping] = None,
+                 profile: Optional[RunProfile] = None,
+                 export_dir: Optional[str] = None,
+                 export_formats: Sequence[str] = ('csv', 'jsonl')):
         self.platform = platform
         self.date = date
+        # Timings and counters of this run
+        self.profile = RunProfile() if profile is None else profile
+        # Source data fetched from the cloud, keyed by query and billing month. Reports for different dates can
+        # share one cache so that a range of dates fetches each source only once.
+        self.cache = {} if cache is None else cache
+        # Where to write the tables the report is rendered from, if anywhere, see src/exports.py
+        self.export_dir = export_dir
+        self.export_formats = export_formats
 
         with open(config_path, 'r') as config_json:
             self._config_global = json.load(config_json)
             self._config_platform = self._config_global[platform]
 
-        self.jinja_env = jinja2.Environment(loader=jinja2.FileSystemLoader('templates/'))
-        self.jinja_env.filters.update({
-            'print_amount': print_amount,
-            'ymd': lambda d: d.strftime('%Y/%m/%d'),
-            'ym': lambda d: d.strftime('%Y/%m'),
-            'nested_sum_values': lambda m: sum(sum(k.values()) for k in m.values()),
-            'sum_values': lambda m: sum(m.values()),
-            'sum_key': lambda rows, key: sum(row[key] for row in rows),
-            'group_by': group_by,
-            'filter_by': filter_by,
-            'sort_by': sort_by,
-            'to_project_id': lambda value: 'project-' + to_id(value),
-            'to_service_id': lambda value: 'service-' + to_id(value),
-            'print_diff': lambda a: print_diff(a, self.warning_threshold),
-        })
+        self._history_store = None
+        self._uploader = None
+        # Whether the uploader is shared with other reports, see useUploader()
+        self._shared_uploader = False
+        self._cost_explorer = None
+        # The record of this run, if it is resumable, see generate_resumable()
+        self.report_run: Optional[ReportRun] = None
+
+    @classmethod
+    def default_date(cls, today: datetime.date) -> datetime.date:
+        """
+        Return the date of the report that is due on the given day.
+
+        >>> AWSReport.default_date(datetime.date(2020, 10, 3)), GCPReport.default_date(datetime.date(2020, 10, 3))
+        (datetime.date(2020, 10, 2), datetime.date(2020, 10, 1))
+        """
+        return today - datetime.timedelta(cls.DATA_DELAY_DAYS)
+
+    @property
+    def jinja_env(self):
+        """
+        Return the Jinja environment of the report templates.
+
+        >>> import tempfile
+        >>> reports = []
+        >>> for threshold in (100, 1000):
+        ...     config = tempfile.NamedTemporaryFile('w', suffix='.json')
+        ...     json.dump({'aws': {'warning_threshold': threshold}}, config)
+        ...     config.flush()
+        ...     reports.append(AWSReport(config.name, datetime.date(2020, 10, 2)))
+        >>> reports[0].jinja_env is reports[1].jinja_env
+        True
+        >>> template = reports[0].jinja_env.from_string('{{ amount|print_diff }}')
+        >>> [template.render(warning_threshold=report.warning_threshold, amount=500 * money.DOLLAR) for report in reports]
+        ['<span class="unusual">$500.00</span>', '$500.00']
+        """
+        # Environments keep their compiled templates, so all reports of a process share one. Anything that differs
+        # between reports is passed in the render context rather than held by the environment, so that the environment
+        # keeps no report alive.
+        global shared_jinja_env
+        with shared_jinja_env_lock:
+            if shared_jinja_env is None:
+                shared_jinja_env = create_jinja_env()
+            return shared_jinja_env
+
+    def render_template(self, name: str, **template_vars) -> str:
+        """Render the template of the given name with this report's settings."""
+        return self.jinja_env.get_template(name).render(warning_threshold=self.warning_threshold, **template_vars)
 
     @property
     def bucket(self) -> str:
@@ -128,16 +248,70 @@ class Report:
         assert self.platform == 'aws'
         return self._config_platform['compliance']
 
+    @property
+    def ce_request_budget(self) -> Optional[int]:
+        assert self.platform == 'aws'
+        return self._config_platform.get('ce_request_budget')
+
+    @property
+    def cost_explorer(self) -> CostExplorerClient:
+        if self._cost_explorer is None:
+            self._cost_explorer = CostExplorerClient(clients.aws_client('ce', self.access_key, self.secret_key),
+                                                     rate_limiter(('ce', self.ce_source)),
+                                                     max_requests=self.ce_request_budget,
+                                                     profile=self.profile)
+        return self._cost_explorer
+
+    @property
+    def max_resources_in_memory(self) -> Optional[int]:
+        assert self.platform == 'aws'
+        return self._config_platform.get('max_resources_in_memory')
+
+    @property
+    def compliance_snapshot_path(self) -> Optional[str]:
+        return self.compliance.get('snapshot_path')
+
+    @property
+    def compliance_delta_only(self) -> bool:
+        return self.compliance.get('delta_only', False)
+
+    @property
+    def compliance_cost_change_threshold(self) -> int:
+        return money.from_dollars(self.compliance.get('cost_change_threshold', 0))
+
+    @property
+    def compliance_full_scan_interval_days(self) -> int:
+        return self.compliance.get('full_scan_interval_days', 7)
+
     @property
     def bigquery_table(self) -> str:
         assert self.platform == 'gcp'
         return self._config_platform['bigquery_table']
 
+    @property
+    def bigquery_tables(self) -> Sequence[str]:
+        """The billing export tables of all billing accounts in the report, `bigquery_tables` or `bigquery_table`."""
+        assert self.platform == 'gcp'
+        try:
+            return self._config_platform['bigquery_tables']
+        except KeyError:
+            return [self.bigquery_table]
+
     @property
     def terra_workspaces_path(self) -> str:
         assert self.platform == 'gcp'
         return self._config_platform.get('terra_workspaces_path')
 
+    @property
+    def cur_source(self) -> tuple:
+        """Identifies the CUR of this report in cache keys, so that reports for different configs can share a cache."""
+        return self.bucket, self.report_prefix, self.report_name
+
+    @property
+    def ce_source(self) -> str:
+        """Identifies the payer account whose Cost Explorer this report queries, without revealing the credentials."""
+        return hashlib.sha256(self.access_key.encode()).hexdigest()[:16]
+
     @property
     def persist_access_key(self) -> str:
         return self._config_global['persist']['access_key']
@@ -150,10 +324,38 @@ class Report:
     def persist_bucket(self) -> str:
         return self._config_global['persist']['bucket']
 
+    @property
+    def persist_endpoint_url(self) -> Optional[str]:
+        return self._config_global['persist'].get('endpoint_url')
+
     @property
     def has_persist_config(self) -> bool:
         return 'persist' in self._config_global
 
+    @property
+    def uploader(self) -> Uploader:
+        if self._uploader is None:
+            self._uploader = Uploader.for_bucket(self.persist_bucket,
+                                                 self.persist_access_key,
+                                                 self.persist_secret_key,
+                                                 endpoint_url=self.persist_endpoint_url,
+                                                 profile=self.profile)
+        return self._uploader
+
+    @property
+    def history_path(self) -> str:
+        return self._config_global['history']['path']
+
+    @property
+    def has_history_config(self) -> bool:
+        return 'history' in self._config_global
+
+    @property
+    def history_store(self) -> HistoryStore:
+        if self._history_store is None:
+            self._history_store = HistoryStore(self.history_path)
+        return self._history_store
+
     def render_email(self,
                      report_date: datetime.date,
                      recipients: Union[str, Sequence[str]],
@@ -164,8 +366,7 @@ class Report:
         msg['Subject'] = subject
         msg['From'] = self.email_from
         msg['To'] = recipients
-        tmpl = self.jinja_env.get_template(f'{self.platform}_report.html')
-        body = tmpl.render(report_date=report_date, **template_vars)
+        body = self.render_template(f'{self.platform}_report.html', report_date=report_date, **template_vars)
         msg.set_content(body, subtype='html')
         return msg.as_string()
 
@@ -179,8 +380,7 @@ class Report:
         msg['Subject'] = subject
         msg['From'] = self.email_from
         msg['To'] = recipient
-        template = self.jinja_env.get_template('personalized_report.html')
-        body = template.render(report_date=report_date, resource_list=resources)
+        body = self.render_template('personalized_report.html', report_date=report_date, resource_list=resources)
         msg.set_content(body, subtype='html')
         return msg.as_string()
 
@@ -197,11 +397,104 @@ class Report:
         first_day_of_month = self.first_day_of_month(date)
         return [first_day_of_month + datetime.timedelta(days=offset) for offset in range((date - first_day_of_month).days + 1)]
 
-    def save_file(self, fileName: str, content: str) -> None:
-        utf8 = bytes(content, 'UTF-8')
-        s3 = boto3.client('s3', aws_access_key_id=self.persist_access_key, aws_secret_access_key=self.persist_secret_key)
-        s3.put_object(Bucket=self.persist_bucket, Key=fileName, Body=utf8)
-        s3.close()
+    def months_between(self, startDate: datetime.date, endDate: datetime.date) -> Sequence[datetime.date]:
+        """Return the first day of every month overlapping the half-open period [startDate, endDate)."""
+        months = []
+        month = self.first_day_of_month(startDate)
+        while month < endDate:
+            months.append(month)
+            month = next_month(month)
+        return months
+
+    def cached(self, key: tuple, fetch: Callable[[], Any]) -> Any:
+        if isinstance(self.cache, FetchCache):
+            return self.cache.get_or_fetch(key, fetch)
+        try:
+            return self.cache[key]
+        except KeyError:
+            value = self.cache[key] = fetch()
+            return value
+
+    def fetchPlan(self, dates: Sequence[datetime.date]) -> Mapping[tuple, Callable[[], Any]]:
+        """
+        Return the fetches that load the source data needed to report on each of the given dates into the cache, by
+        a key identifying the data they fetch. Fetches with equal keys are interchangeable, even those of reports for
+        different configs, so only one of them needs to run. Reports that don't cache their sources fetch them when
+        rendering instead, so by default there are none.
+        """
+        return {}
+
+    def prefetch(self, dates: Sequence[datetime.date]) -> None:
+        for fetch in self.fetchPlan(dates).values():
+            fetch()
+
+    def save_file(self, fileName: str, content: Union[str, bytes]) -> None:
+        """Upload the content to the persist bucket in the background, see waitForUploads()."""
+        self.uploader.upload(fileName, content)
+
+    def runSideEffect(self, phase: str, function: Callable, *args) -> None:
+        """Call the function in the given phase, unless an earlier attempt at this run already completed it."""
+        if self.report_run is not None and self.report_run.is_done(phase):
+            self.profile.count_call(f'resumed_{phase}')
+            return
+        with self.profile.phase(phase):
+            function(*args)
+        if self.report_run is not None:
+            # The phase is only complete once what it saved is uploaded
+            self.waitForUploads()
+            self.report_run.done(phase)
+
+    def useUploader(self, uploader: Uploader) -> None:
+        """Upload with the given uploader, which is shared with other reports and closed by their caller."""
+        self._uploader = uploader
+        self._shared_uploader = True
+
+    def waitForUploads(self) -> None:
+        if self._shared_uploader:
+            with self.profile.phase('wait_uploads'):
+                self._uploader.wait()
+        elif self._uploader is not None:
+            uploader, self._uploader = self._uploader, None
+            with self.profile.phase('wait_uploads'):
+                uploader.close()
+
+    def historyRows(self, day: datetime.date) -> Sequence[Mapping[str, Any]]:
+        raise NotImplementedError
+
+    def saveHistory(self, date: datetime.date) -> Sequence[datetime.date]:
+        """
+        Write the history partition of each day of the month up to the given date that is missing from the store or
+        may still be restated, and mirror the written partitions to the persist bucket. Return the days written.
+        """
+        store = self.history_store
+        days = [
+            day for day in self.days_of_month_up_to_and_including(date)
+            if (date - day).days < self.HISTORY_RESTATEMENT_DAYS or not store.has_partition(self.platform, day)
+        ]
+        for day in days:
+            self.saveHistoryPartition(day)
+        return days
+
+    def saveHistoryPartition(self, day: datetime.date) -> None:
+        store = self.history_store
+        content = store.write_partition(self.platform, day, self.historyRows(day))
+        if self.has_persist_config:
+            self.save_file('history/' + store.partition_key(self.platform, day), content)
+
+    def detectAnomalies(self, *keys: Sequence[str]) -> Mapping[tuple, anomaly.Anomaly]:
+        """
+        Return the anomalous costs on the report date of each combination of the given history columns, keyed by
+        their values. Nothing is flagged without a history store.
+        """
+        if not self.has_history_config:
+            return {}
+        start = self.date - datetime.timedelta(self.ANOMALY_WINDOW)
+        end = self.date + datetime.timedelta(1)
+        anomalies = {}
+        for key in keys:
+            daily_costs = self.history_store.daily_sums(self.platform, start, end, keys=key, value='cost')
+            anomalies.update(anomaly.detect(daily_costs, self.date, window=self.ANOMALY_WINDOW))
+        return anomalies
 
     def generate_file_name(self, root: str, dateComponents: Iterable[str], base: str, extension: str) -> str:
         slash_date = '/'.join(dateComponents)
@@ -222,6 +515,14 @@ class Report:
                 csv_writer.writerow(row)
             return file.getvalue()
 
+    def exportTables(self, tables: Mapping[str, Tuple[Sequence[str], Iterable[Mapping[str, Any]]]]) -> None:
+        """
+        Write each of the given tables, its columns and rows by name, to the export directory as
+        <platform>-<date>-<name>.<format>.
+        """
+        for name, (columns, rows) in tables.items():
+            exports.export(self.export_dir, f'{self.platform}-{self.iso_date(self.date)}-{name}', columns, rows, self.export_formats)
+
     def to_json(self, parsed_json) -> str:
         return json.dumps(parsed_json, indent=2)
 
@@ -235,41 +536,82 @@ class AWSReport(Report):
                           "Amazon Simple Storage Service": "AWS S3 Bucket",
                           "Amazon Elastic Block Store": "AWS EBS"}
 
-    def __init__(self, config_path: str, date: datetime.date):
-        super().__init__(platform='aws', config_path=config_path, date=date)
-
-    def usage_csv(self) -> Iterator[str]:
-        """Return the lines of the latest billing CSV for the given month."""
-        s3 = boto3.client('s3',
-                          aws_access_key_id=self.access_key,
-                          aws_secret_access_key=self.secret_key)
-        this_month = self.date.strftime('%Y%m01')
-        next_month = (self.date + relativedelta(months=1)).strftime('%Y%m01')
+    def __init__(self, config_path: str, date: datetime.date, **kwargs):
+        super().__init__(platform='aws', config_path=config_path, date=date, **kwargs)
+
+    def usage_rows(self,
+                   month: datetime.date = None,
+                   account_ids: Optional[Collection[str]] = None) -> Iterable[Mapping[str, str]]:
+        """
+        Return the line items of the latest CUR for the given month, defaulting to that of the report date, keyed by
+        CSV column name. Rows of a Parquet CUR are read already filtered to the line items that incur a cost and, if
+        account_ids is given, to those of the given accounts. Rows of a CSV CUR are not.
+        """
+        month = self.first_day_of_month(self.date if month is None else month)
+        if ('cur', self.cur_source, month) not in self.cache and cur_parquet.is_parquet_manifest(self.usage_manifest(month)):
+            key = ('cur_parquet', self.cur_source, month, None if account_ids is None else tuple(sorted(account_ids)))
+            return self.cached(key, lambda: self.download_usage_parquet(month, account_ids))
+        else:
+            return csv.DictReader(self.usage_csv(month))
+
+    def usage_manifest(self, month: datetime.date) -> Mapping[str, Any]:
+        return self.cached(('cur_manifest', self.cur_source, month), lambda: self.download_usage_manifest(month))
+
+    def usage_csv(self, month: datetime.date = None) -> Iterator[str]:
+        """Return the lines of the latest billing CSV for the given month, defaulting to that of the report date."""
+        month = self.first_day_of_month(self.date if month is None else month)
+        return self.cached(('cur', self.cur_source, month), lambda: self.download_usage_csv(month))
+
+    def download_usage_manifest(self, month: datetime.date) -> Mapping[str, Any]:
+        this_month = month.strftime('%Y%m01')
+        following_month = next_month(month).strftime('%Y%m01')
         manifest_path = Path(self.report_prefix)
         manifest_path /= self.report_name
-        manifest_path /= f'{this_month}-{next_month}'
+        manifest_path /= f'{this_month}-{following_month}'
         manifest_path /= f'{self.report_name}-Manifest.json'
-        # Get the list of S3 report object keys
         with tempfile.TemporaryFile() as tmp:
-            s3.download_fileobj(self.bucket, manifest_path.as_posix(), tmp)
-            # Reports that are sufficiently large can be split into multiple files
-            # but we'll ignore that for now
+            self.download_report_file(manifest_path.as_posix(), tmp)
             tmp.seek(0)
-            reportKeys = json.load(tmp)['reportKeys']
+            return json.load(tmp)
+
+    def download_report_file(self, key: str, fileobj) -> None:
+        s3 = clients.aws_client('s3', self.access_key, self.secret_key)
+        s3.download_fileobj(self.bucket, key, fileobj)
+        self.profile.count_call('s3')
+        self.profile.add_bytes(fileobj.tell())
+
+    def download_usage_csv(self, month: datetime.date) -> Sequence[str]:
+        # Get the list of S3 report object keys
+        reportKeys = self.usage_manifest(month)['reportKeys']
         # Create a list of the lines from each of the report object files
         allLines = []
         for s3_report_archive_path in reportKeys:
             with tempfile.NamedTemporaryFile() as tmp:
-                s3.download_fileobj(self.bucket, s3_report_archive_path, tmp)
+                self.download_report_file(s3_report_archive_path, tmp)
                 tmp.flush()
                 with gzip.open(tmp.name, 'r') as report_fp:
                     fileLines = report_fp.read().decode().splitlines()
                     allLines.extend(fileLines)
         return allLines
 
-    def generate_compliance_list(self) -> list:
+    def download_usage_parquet(self,
+                               month: datetime.date,
+                               account_ids: Optional[Collection[str]] = None) -> Sequence[Mapping[str, str]]:
+        with tempfile.TemporaryDirectory() as directory:
+            paths = []
+            for i, key in enumerate(self.usage_manifest(month)['reportKeys']):
+                path = Path(directory) / f'{i}.parquet'
+                with open(path, 'wb') as file:
+                    self.download_report_file(key, file)
+                paths.append(str(path))
+            return cur_parquet.read_rows(paths, account_ids)
+
+    def generate_compliance_list(self, active_regions: Optional[Set[Tuple[str, str]]] = None) -> list:
 
         # start service
+        from src.Boto3_STS_Service import (
+            Boto3_STS_Service,
+        )
         bss = Boto3_STS_Service()
 
         # get compliance dict from the config file
@@ -285,198 +627,329 @@ class AWSReport(Report):
             account_name_list.append(compliance_config["accounts"][k])
             arn_list.append(f"arn:aws:iam::{k}:role/{compliance_config['iam_role_name']}")
 
-        cr = compliance_report()
+        cr = compliance_report(self.profile)
         compliance_list = cr.generate_full_compliance_report(bss, account_id_list, account_name_list, arn_list,
-                                                             region_list)
+                                                             region_list, active_regions)
 
         return compliance_list
 
+    # Receives the personalized emails about noncompliant resources
+    NONCOMPLIANCE_RECIPIENT = "righanse@ucsc.edu"
+
+    def complianceRecipient(self, status: str, email: Optional[str]) -> Optional[str]:
+        return self.NONCOMPLIANCE_RECIPIENT if status == "NON_COMPLIANT" else email
+
     def generatePersonalizedComplianceReports(self,
                                               reportDate: datetime.date,
                                               compliant_resources: list,
                                               noncompliant_resources: list,
-                                              report_dir="/tmp/personalizedEmails/") -> str:
-        # TODO Most billing reports are showing $0.00 for the S3 costs... may need to rethink
+                                              report_dir="/tmp/personalizedEmails/",
+                                              recipients: Optional[Set[str]] = None) -> str:
         # Create a dictionary, where the key is the email address and the value is the list of resources
         account_resource_dict = {}
-        for resource in compliant_resources:
-
+        for resource in compliant_resources + noncompliant_resources:
+            email = self.complianceRecipient(resource.get_compliance_status(), resource.get_email())
             # The email address can be none if the tag included 'shared'
-            if resource.get_email() is not None:
-                if resource.get_email() in account_resource_dict:
-                    account_resource_dict[resource.get_email()].append(resource)
-                else:
-                    account_resource_dict[resource.get_email()] = [resource]
-
-        for resource in noncompliant_resources:
-            if "righanse@ucsc.edu" in account_resource_dict:
-                account_resource_dict["righanse@ucsc.edu"].append(resource)
-            else:
-                account_resource_dict["righanse@ucsc.edu"] = [resource]
+            if email is not None:
+                account_resource_dict.setdefault(email, []).append(resource)
 
         # For every email in our dictionary, generate an email report, make sure the nested directory exists
         Path(report_dir).mkdir(parents=True, exist_ok=True)
         for email in account_resource_dict:
+            # Only write to the given recipients, if any
+            if recipients is not None and email not in recipients:
+                continue
             eml_text = self.render_personalized_email(
                 reportDate,
                 email,
-                account_resource_dict[email]
+                sorted(account_resource_dict[email], key=lambda r: r.monthly_cost, reverse=True)
             )
             with open(f"{report_dir}{email[0:email.find('@')]}-{uuid.uuid4().hex}.eml", "w") as eml_file:
                 eml_file.write(eml_text)
 
-    def generateComplianceSummary(self, reportDate: datetime.date):
+    def joinResourceCosts(self, resources: Iterable[report_resource], resourceSummary: Mapping[Any, report_resource]) -> None:
+        """
+        Set the month-to-date cost of each of the given tagged resources to that of the same resource in the CUR
+        resource summary. The tagged resources are indexed by account name and normalized resource ID, and the
+        summary, which may be much larger and on disk, is read once and looked up in that index.
+
+        >>> import tempfile
+        >>> config = tempfile.NamedTemporaryFile('w', suffix='.json')
+        >>> json.dump({'aws': {'accounts': {'1': 'one'}}}, config)
+        >>> config.flush()
+        >>> report = AWSReport(config.name, datetime.date(2020, 10, 2))
+        >>> billed = report_resource('i-0123', 'Amazon Elastic Compute Cloud', '', 'one', 'us-west-2')
+        >>> billed.add_to_monthly_cost(5 * money.DOLLAR)
+        >>> tagged = report_resource('arn:aws:ec2:us-west-2:1:instance/i-0123', 'ec2:instance', '1', 'one', 'us-west-2')
+        >>> untagged = report_resource('arn:aws:s3:::bucket', 's3', '1', 'one', 'us-west-2')
+        >>> report.joinResourceCosts([tagged, untagged], {'i-0123': billed})
+        >>> tagged.monthly_cost, untagged.monthly_cost
+        (5000000, 0)
+        """
+        tagged = {}
+        for resource in resources:
+            tagged.setdefault((resource.account_name, normalized_resource_id(resource.resource_arn)), []).append(resource)
+        # Line items without a resource are keyed by a tuple and can't match
+        for key, billed in resourceSummary.items():
+            if isinstance(key, str):
+                for resource in tagged.get((billed.account_name, normalized_resource_id(key)), ()):
+                    resource.monthly_cost = billed.monthly_cost
+
+    def generateComplianceSummary(self,
+                                  reportDate: datetime.date,
+                                  ownerCosts: Optional[Mapping[str, int]] = None,
+                                  resourceSummary: Optional[Mapping[Any, report_resource]] = None,
+                                  activeRegions: Optional[Set[Tuple[str, str]]] = None):
+        """
+        Write the personalized compliance emails, with the month-to-date cost of each resource in resourceSummary.
+        With a compliance.snapshot_path in the config, the scan is saved there, and with compliance.delta_only, emails
+        are only written to the owners of resources that were added, removed or retagged since the last scan, or whose
+        month-to-date cost, given in ownerCosts, changed by more than compliance.cost_change_threshold dollars.
+
+        With a snapshot, only the accounts and regions in activeRegions, those the CUR bills the scanned products in,
+        are scanned, and the resources of all others are carried forward from the snapshot. All of them are scanned
+        again once compliance.full_scan_interval_days days passed since the last full scan.
+
+        >>> import tempfile
+        >>> snapshot_path = Path(tempfile.mkdtemp()) / 'snapshot.json.gz'
+        >>> config = tempfile.NamedTemporaryFile('w', suffix='.json')
+        >>> json.dump({'aws': {'accounts': {'1': 'one'}, 'compliance': {'accounts': {'1': 'one'}, 'regions': ['us-east-1', 'us-west-2'],
+        ...                                                             'snapshot_path': str(snapshot_path)}}}, config)
+        >>> config.flush()
+        >>> report = AWSReport(config.name, datetime.date(2020, 10, 2))
+        >>> def scan(active_regions=None):
+        ...     print('Scanning', 'all regions' if active_regions is None else sorted(active_regions))
+        ...     regions = ['us-east-1', 'us-west-2'] if active_regions is None else [region for _, region in active_regions]
+        ...     resources = [report_resource(f'arn:aws:s3:::{region}', 's3:bucket', '1', 'one', region) for region in regions]
+        ...     for resource in resources:
+        ...         resource.add_tag_value('Owner', 'someone@ucsc.edu'); resource.set_compliance_status()
+        ...     return resources
+        >>> report.generate_compliance_list = scan
+        >>> report.generatePersonalizedComplianceReports = lambda date, compliant, noncompliant, recipients: print(
+        ...     sorted(r.resource_arn for r in compliant))
+        >>> report.generateComplianceSummary(datetime.date(2020, 10, 1), activeRegions={('1', 'us-west-2')})
+        Scanning all regions
+        ['arn:aws:s3:::us-east-1', 'arn:aws:s3:::us-west-2']
+        >>> report.generateComplianceSummary(datetime.date(2020, 10, 2), activeRegions={('1', 'us-west-2')})
+        Scanning [('1', 'us-west-2')]
+        ['arn:aws:s3:::us-east-1', 'arn:aws:s3:::us-west-2']
+        >>> report.generateComplianceSummary(datetime.date(2020, 10, 8), activeRegions={('1', 'us-west-2')})
+        Scanning all regions
+        ['arn:aws:s3:::us-east-1', 'arn:aws:s3:::us-west-2']
+        """
+        snapshot_path = self.compliance_snapshot_path
+        previous = None if snapshot_path is None else ComplianceSnapshot.load(snapshot_path)
+        full_scan_date = None if previous is None else previous.full_scan_date
+        if (activeRegions is None
+                or full_scan_date is None
+                or not 0 <= (reportDate - full_scan_date).days < self.compliance_full_scan_interval_days):
+            compliance_list = self.generate_compliance_list()
+            full_scan_date = reportDate
+        else:
+            compliance_list = self.generate_compliance_list(activeRegions)
+            for account_id in self.compliance["accounts"]:
+                for region in self.compliance["regions"]:
+                    if (account_id, region) not in activeRegions:
+                        compliance_list += previous.resources(account_id, region)
+
         # Create a list of resource objects based on their compliance status
-        compliance_list = self.generate_compliance_list()
         compliant_resources = [r for r in compliance_list if r.get_compliance_status() == "COMPLIANT"]
         noncompliant_resources = [r for r in compliance_list if r.get_compliance_status() == "NON_COMPLIANT"]
+        if resourceSummary is not None:
+            self.joinResourceCosts(compliance_list, resourceSummary)
+
+        recipients = None
+        if snapshot_path is not None:
+            snapshot = ComplianceSnapshot.from_resources(compliance_list, ownerCosts, full_scan_date)
+            if self.compliance_delta_only and previous is not None:
+                recipients = snapshot.changed_owners(previous,
+                                                     self.compliance_cost_change_threshold,
+                                                     lambda record: self.complianceRecipient(record['status'], record['email']))
 
         # *** Currently set to run everyday ***
         # For Monday only reports: 'if datetime.strptime(today, "%Y-%m-%d").today().weekday() == 0'
-        self.generatePersonalizedComplianceReports(reportDate, compliant_resources, noncompliant_resources)
-
-    def generateAccountSummary(self, accounts, startDate: datetime.date, endDate: datetime.date):
-
-        accountIds = list(accounts.keys())
-
-        billingClient = boto3.client('ce',
-                                     aws_access_key_id=self.access_key,
-                                     aws_secret_access_key=self.secret_key)
-
-        # Make the request
-        result = billingClient.get_cost_and_usage(
-            TimePeriod={
-                'Start': self.iso_date(startDate),
-                'End': self.iso_date(endDate)
-            },
-            Granularity="MONTHLY",
-            Filter={
-                "And": [
+        self.generatePersonalizedComplianceReports(reportDate, compliant_resources, noncompliant_resources,
+                                                   recipients=recipients)
+        # Only save the snapshot once the emails about its changes are written
+        if snapshot_path is not None:
+            snapshot.save(snapshot_path)
+
+    def costAndUsageQuery(self, groupBy: Sequence[str], metrics: Sequence[str], filters: Sequence[Mapping]) -> Mapping:
+        return {
+            'Filter': {
+                'And': [
                     {
-                        "Not": {
-                            "Dimensions": {
-                                "Key": "RECORD_TYPE",
-                                "Values": ["Credit", "Refund"]
+                        'Not': {
+                            'Dimensions': {
+                                'Key': 'RECORD_TYPE',
+                                'Values': ['Credit', 'Refund']
                             }
                         }
-                    }, {
-                        "Dimensions": {
-                            "Key": "LINKED_ACCOUNT",
-                            "Values": accountIds
-                        }
-                    }]
+                    },
+                    *filters
+                ]
             },
-            Metrics=["BlendedCost"],
-            GroupBy=[
-                {
-                    'Type': 'DIMENSION',
-                    'Key': "LINKED_ACCOUNT"
-                }, {
-                    'Type': 'DIMENSION',
-                    'Key': "SERVICE"
-                }
-            ]
+            'Metrics': list(metrics),
+            'GroupBy': [{'Type': 'DIMENSION', 'Key': key} for key in groupBy]
+        }
+
+    def dailyCostAndUsage(self, query: Mapping, startDate: datetime.date, endDate: datetime.date) -> Iterator[Mapping]:
+        """
+        Yield the Cost Explorer groups of every day in [startDate, endDate). Results are requested a whole month at a time
+        with daily granularity and cached, so any other period within the same months is answered without a request.
+
+        >>> import tempfile
+        >>> config = tempfile.NamedTemporaryFile('w', suffix='.json')
+        >>> json.dump({'aws': {'accounts': {'1': 'one'}, 'access_key': 'key'}}, config); config.flush()
+        >>> report = AWSReport(config.name, datetime.date(2020, 10, 2))
+        >>> query = report.accountSummaryQuery({'1': 'one'})
+        >>> def group(day, amount):
+        ...     return {'TimePeriod': {'Start': day}, 'Groups': [{'Keys': ['1', 'S3'], 'Metrics': {'BlendedCost': {'Amount': amount}}}]}
+        >>> october = [group('2020-10-01', '1.5'), group('2020-10-02', '2'), group('2020-10-03', '4')]
+        >>> report.cache[report.costAndUsageKey(query, datetime.date(2020, 10, 1))] = october
+        >>> [g['Metrics']['BlendedCost']['Amount'] for g in report.dailyCostAndUsage(query, datetime.date(2020, 10, 2), datetime.date(2020, 10, 4))]
+        ['2', '4']
+
+        Summaries add up the days, so month-to-date totals match those of a single MONTHLY request for the same period.
+
+        >>> report.generateAccountSummary({'1': 'one'}, datetime.date(2020, 10, 1), datetime.date(2020, 10, 3))
+        {'one': {'S3': 3500000}}
+        """
+        for month in self.months_between(startDate, endDate):
+            for timeRange in self.monthlyCostAndUsage(query, month):
+                day = datetime.date.fromisoformat(timeRange['TimePeriod']['Start'])
+                if startDate <= day < endDate:
+                    yield from timeRange['Groups']
+
+    def costAndUsageKey(self, query: Mapping, month: datetime.date) -> tuple:
+        return 'ce', self.ce_source, json.dumps(query, sort_keys=True), month
+
+    def monthlyCostAndUsage(self, query: Mapping, month: datetime.date) -> Sequence[Mapping]:
+        """
+        Return the daily Cost Explorer results of the given month. Requests answered from the cache are counted as
+        avoided in the run profile, next to the requests made.
+        """
+        fetched = []
+
+        def fetch():
+            fetched.append(True)
+            return self.getDailyCostAndUsage(query, month)
+
+        results = self.cached(self.costAndUsageKey(query, month), fetch)
+        if not fetched:
+            self.profile.count_call('ce_avoided')
+        return results
+
+    def getDailyCostAndUsage(self, query: Mapping, month: datetime.date) -> Sequence[Mapping]:
+        # Daily results for a month are usually split across several pages
+        return self.cost_explorer.get_cost_and_usage(**dict(query,
+                                                            TimePeriod={
+                                                                'Start': self.iso_date(month),
+                                                                'End': self.iso_date(next_month(month))
+                                                            },
+                                                            Granularity='DAILY'))
+
+    def accountSummaryQuery(self, accounts) -> Mapping:
+        return self.costAndUsageQuery(
+            groupBy=['LINKED_ACCOUNT', 'SERVICE'],
+            metrics=['BlendedCost'],
+            filters=[{'Dimensions': {'Key': 'LINKED_ACCOUNT', 'Values': list(accounts.keys())}}]
         )
 
+    def generateAccountSummary(self, accounts, startDate: datetime.date, endDate: datetime.date):
+
+        query = self.accountSummaryQuery(accounts)
+
         # The dictionary we are returning
         returnDict = {}
 
-        assert len(result["ResultsByTime"]) == 1
-        timeRange = result["ResultsByTime"][0]
-
-        for group in timeRange["Groups"]:
+        for group in self.dailyCostAndUsage(query, startDate, endDate):
             # Parse out values
             accountId = group["Keys"][0]
             accountName = accounts[accountId]
             serviceName = group["Keys"][1]
-            blendedCost = float(group["Metrics"]["BlendedCost"]["Amount"])
-
-            # Populate the account in the dictionary if it isn't already there, do the same for the service
-            returnDict.setdefault(accountName, {})
+            blendedCost = money.parse(group["Metrics"]["BlendedCost"]["Amount"])
 
-            # The service should only appear once per account
-            assert serviceName not in returnDict[accountName]
-            returnDict[accountName][serviceName] = blendedCost
+            # Populate the account in the dictionary if it isn't already there, then add the day's cost of the service
+            services = returnDict.setdefault(accountName, {})
+            services[serviceName] = services.get(serviceName, 0) + blendedCost
 
         return returnDict
 
-    def generateUsageTypeSummary(self, accounts, startDate: datetime.date, endDate: datetime.date):
+    def usageTypeSummaryQuery(self, accounts) -> Mapping:
+        return self.costAndUsageQuery(
+            groupBy=['SERVICE', 'USAGE_TYPE'],
+            metrics=['BlendedCost'],
+            filters=[{'Dimensions': {'Key': 'LINKED_ACCOUNT', 'Values': list(accounts.keys())}}]
+        )
 
-        accountIds = list(accounts.keys())
+    def generateUsageTypeSummary(self, accounts, startDate: datetime.date, endDate: datetime.date):
 
-        billingClient = boto3.client('ce',
-                                     aws_access_key_id=self.access_key,
-                                     aws_secret_access_key=self.secret_key)
-
-        # Make the request
-        result = billingClient.get_cost_and_usage(
-            TimePeriod={
-                'Start': self.iso_date(startDate),
-                'End': self.iso_date(endDate)
-            },
-            Granularity="MONTHLY",
-            Filter={
-                "And": [
-                    {
-                        "Not": {
-                            "Dimensions": {
-                                "Key": "RECORD_TYPE",
-                                "Values": ["Credit", "Refund"]
-                            }
-                        }
-                    }, {
-                        "Dimensions": {
-                            "Key": "LINKED_ACCOUNT",
-                            "Values": accountIds
-                        }
-                    }]
-            },
-            Metrics=["BlendedCost"],
-            GroupBy=[
-                {
-                    'Type': 'DIMENSION',
-                    'Key': "SERVICE"
-                }, {
-                    'Type': 'DIMENSION',
-                    'Key': "USAGE_TYPE"
-                }
-            ]
-        )
+        query = self.usageTypeSummaryQuery(accounts)
 
         # The dictionary we are returning
         returnDict = {}
 
-        assert len(result["ResultsByTime"]) == 1
-        timeRange = result["ResultsByTime"][0]
-
-        for group in timeRange["Groups"]:
+        for group in self.dailyCostAndUsage(query, startDate, endDate):
             # Parse out values
             serviceName = group["Keys"][0]
             UsageType = group["Keys"][1]
-            blendedCost = float(group["Metrics"]["BlendedCost"]["Amount"])
-
-            # Populate the account in the dictionary if it isn't already there, do the same for the service
-            returnDict.setdefault(serviceName, {})
+            blendedCost = money.parse(group["Metrics"]["BlendedCost"]["Amount"])
 
-            # The service should only appear once per account
-            assert UsageType not in returnDict[serviceName]
-            returnDict[serviceName][UsageType] = blendedCost
+            # Populate the service in the dictionary if it isn't already there, then add the day's cost of the usage type
+            usageTypes = returnDict.setdefault(serviceName, {})
+            usageTypes[UsageType] = usageTypes.get(UsageType, 0) + blendedCost
 
         return returnDict
 
-    def generateResourceSummary(self, accounts):
-        reportCsvLines = self.usage_csv()
-        reportCsv = csv.DictReader(reportCsvLines)
-
-        resources = {}
-
-        for row in reportCsv:
+    def resourceAccountIds(self, accounts) -> Collection[str]:
+        """Return the IDs of the accounts whose line items are summarized by generateResourceSummary."""
+        return [id for id, name in self.accounts.items() if name in accounts.values()]
+
+    def generateResourceSummary(self, accounts, activeRegions: Optional[Set[Tuple[str, str]]] = None) -> ResourceAggregator:
+        """
+        Return the month-to-date cost of each resource in the given accounts, keyed by resource ID. With
+        max_resources_in_memory in the config, resources beyond that many are spilled to disk while aggregating.
+        The (account ID, region) pairs with line items of the products the compliance scan queries for are added to
+        activeRegions, if given.
+
+        >>> import tempfile
+        >>> config = tempfile.NamedTemporaryFile('w', suffix='.json')
+        >>> json.dump({'aws': {'accounts': {'1': 'one'}, 'bucket': 'cur', 'prefix': 'reports', 'report_name': 'cur'}}, config)
+        >>> config.flush()
+        >>> report = AWSReport(config.name, datetime.date(2020, 10, 2))
+        >>> columns = ['lineItem/LineItemType', 'lineItem/UsageAccountId', 'lineItem/UsageStartDate', 'lineItem/UsageType',
+        ...            'lineItem/BlendedCost', 'lineItem/LineItemDescription', 'lineItem/ResourceId', 'product/ProductName',
+        ...            'product/region', 'resourceTags/user:Owner', 'resourceTags/user:owner']
+        >>> def line(cost, resource_id=''):
+        ...     return ','.join(['Usage', '1', '2020-10-01T00:00:00Z', 'DataTransfer-Out-Bytes', cost, '$0.09 per GB', resource_id,
+        ...                      'Amazon Simple Storage Service', 'us-west-2', '', ''])
+        >>> report.cache[('cur', report.cur_source, datetime.date(2020, 10, 1))] = [','.join(columns), line('1'), line('2'), line('4', 'bucket')]
+
+        Line items without a resource ID are summed under the same pseudo-resource every run:
+
+        >>> activeRegions = set()
+        >>> {key: resource.monthly_cost for key, resource in report.generateResourceSummary({'1': 'one'}, activeRegions).items()}
+        {('one', 'Amazon Simple Storage Service', 'DataTransfer-Out-Bytes', '$0.09 per GB'): 3000000, 'bucket': 4000000}
+        >>> activeRegions
+        {('1', 'us-west-2')}
+        """
+        resources = ResourceAggregator(self.max_resources_in_memory, profile=self.profile)
+        reportDate = self.iso_date(self.date)
+        rowCount = 0
+
+        for row in self.usage_rows(account_ids=self.resourceAccountIds(accounts)):
+            rowCount += 1
 
             # skip rows that don't involve a cost, typicall those that refer to a discount, credit, or refund
             itemType = row['lineItem/LineItemType']
             if not (itemType.endswith('Usage') or itemType.endswith('Fee') or itemType.endswith('Tax')):
                 continue
 
+            # skip usage after the report date, so the month's CUR can be sliced for any day within it
+            if row['lineItem/UsageStartDate'][:10] > reportDate:
+                continue
+
             account = self.accounts.get(row['lineItem/UsageAccountId'], '(unknown)')  # account for resource
 
             # Skip this line item if the resource is not in a compliance account
@@ -485,89 +958,70 @@ class AWSReport(Report):
 
             service = row['product/ProductName']  # which type of product this is
             usage_type = row['lineItem/UsageType']
-            amount = Decimal(row['lineItem/BlendedCost'])  # the cost associated with this
+            amount = money.parse(row['lineItem/BlendedCost'])  # the cost associated with this, in micro-dollars
             description = row['lineItem/LineItemDescription']
-            resourceId = row['lineItem/ResourceId'] if len(row['lineItem/ResourceId']) > 0 else \
-                uuid.uuid4().hex[0:7] + " (" + description + ")"  # resource id, not necessarily the arn
+            resourceId = row['lineItem/ResourceId']  # resource id, not necessarily the arn
             region = row['product/region']  # The region the product was billed from
+            if activeRegions is not None and service in SCANNED_PRODUCTS:
+                activeRegions.add((row['lineItem/UsageAccountId'], region))
+            if resourceId:
+                key = resourceId
+            else:
+                # Line items without a resource, like data transfer or support fees, are summed per account, product,
+                # usage type and description, so that they form a small set of pseudo-resources that is the same
+                # every run
+                key = (account, service, usage_type, description)
+                resourceId = f'{usage_type} ({description})'
 
             # monthly cost summary of the resource
-            resources.setdefault(resourceId, report_resource(resourceId, service, '', account, region))
-
-            if len(row['lineItem/ResourceId']) > 0:
-                resources[resourceId].set_resource_url()
+            resource = resources.get_or_create(key, functools.partial(self.createResource, key, resourceId, service, account, region))
 
             if row['resourceTags/user:Owner']:
-                resources[resourceId].add_tag_value("Owner", row['resourceTags/user:Owner'])
+                resource.add_tag_value("Owner", row['resourceTags/user:Owner'])
             elif row['resourceTags/user:owner']:
-                resources[resourceId].add_tag_value("owner", row['resourceTags/user:owner'])
-            resources[resourceId].add_to_monthly_cost(amount)
-            resources[resourceId].add_usage_type(usage_type, amount)
+                resource.add_tag_value("owner", row['resourceTags/user:owner'])
+            resource.add_to_monthly_cost(amount)
+            resource.add_usage_type(usage_type, amount)
 
+        self.profile.add_rows('cur', rowCount)
         return resources
 
-    def generateS3StorageSummary(self, accounts, startDate: datetime.date, endDate: datetime.date):
-
-        accountIds = list(accounts.keys())
-
-        billingClient = boto3.client('ce',
-                                     aws_access_key_id=self.access_key,
-                                     aws_secret_access_key=self.secret_key)
-
-        # Make the request
-        result = billingClient.get_cost_and_usage(
-            TimePeriod={
-                'Start': self.iso_date(startDate),
-                'End': self.iso_date(endDate)
-            },
-            Granularity="MONTHLY",
-            Filter={
-                "And": [
-                    {
-                        "Not": {
-                            "Dimensions": {
-                                "Key": "RECORD_TYPE",
-                                "Values": ["Credit", "Refund"]
-                            }
-                        }
-                    }, {
-                        "Dimensions": {
-                            "Key": "SERVICE",
-                            "Values": ["Amazon Simple Storage Service"]
-                        }
-                    }, {
-                        "Dimensions": {
-                            "Key": "LINKED_ACCOUNT",
-                            "Values": accountIds
-                        }
-                    }]
-            },
-            Metrics=["UsageQuantity", "BlendedCost"],
-            GroupBy=[
-                {
-                    'Type': 'DIMENSION',
-                    'Key': "USAGE_TYPE"
-                }
+    def createResource(self, key, resourceId: str, service: str, account: str, region: str) -> report_resource:
+        resource = report_resource(resourceId, service, '', account, region)
+        # Line items without a resource are keyed by a tuple, and their pseudo-resources have no console URL
+        if isinstance(key, str):
+            resource.set_resource_url()
+        return resource
+
+    def s3StorageSummaryQuery(self, accounts) -> Mapping:
+        return self.costAndUsageQuery(
+            groupBy=['USAGE_TYPE'],
+            metrics=['UsageQuantity', 'BlendedCost'],
+            filters=[
+                {'Dimensions': {'Key': 'SERVICE', 'Values': ['Amazon Simple Storage Service']}},
+                {'Dimensions': {'Key': 'LINKED_ACCOUNT', 'Values': list(accounts.keys())}}
             ]
         )
 
+    def generateS3StorageSummary(self, accounts, startDate: datetime.date, endDate: datetime.date):
+
+        query = self.s3StorageSummaryQuery(accounts)
+
         # The dictionary we are returning
         returnDict = {}
 
-        assert len(result["ResultsByTime"]) == 1
-        timeRange = result["ResultsByTime"][-1]
-
-        for group in timeRange["Groups"]:
+        for group in self.dailyCostAndUsage(query, startDate, endDate):
             # Parse out values
             usageType = group["Keys"][0]
             usageUnit = group["Metrics"]["UsageQuantity"]["Unit"]
             usageAmount = float(group["Metrics"]["UsageQuantity"]["Amount"])
-            usageCost = float(group["Metrics"]["BlendedCost"]["Amount"])
+            usageCost = money.parse(group["Metrics"]["BlendedCost"]["Amount"])
 
             # We only care about how GBs are flowing in/out and stored in S3 buckets
             if "GB-Month" in usageUnit:
-                assert usageType not in returnDict
-                returnDict[usageType] = {"usageCost": usageCost, "usageAmount": usageAmount, "usageUnit": usageUnit}
+                metrics = returnDict.setdefault(usageType, {"usageCost": 0, "usageAmount": 0.0, "usageUnit": usageUnit})
+                metrics["usageCost"] += usageCost
+                metrics["usageAmount"] += usageAmount
 
         return returnDict
 
@@ -593,7 +1047,7 @@ class AWSReport(Report):
             userServices = list(userCostSummary[user])
             for service in userServices:
                 # Remove all services that the user paid less than $1 for
-                if userCostSummary[user][service] < 1:
+                if userCostSummary[user][service] < money.DOLLAR:
                     userCostSummary[user].pop(service, None)
 
             # If the user has no remaining services, remove the user from the list
@@ -602,8 +1056,7 @@ class AWSReport(Report):
 
         # Get up to the top 10 services for each user
         for user in userCostSummary:
-            n = min(len(userCostSummary[user].items()), 10)
-            cost_list = sorted(userCostSummary[user].items(), key=lambda x: x[1], reverse=True)[:n]
+            cost_list = heapq.nlargest(10, userCostSummary[user].items(), key=operator.itemgetter(1))
             total_cost = sum([cost for (service, cost) in cost_list])
             cost_list.append(("Total", total_cost))
             userCostSummary[user] = dict(cost_list)
@@ -616,46 +1069,87 @@ class AWSReport(Report):
         for day in self.days_of_month_up_to_and_including(date):
             result = self.generateAccountSummary(self.accounts, day, day + datetime.timedelta(1))
             rows += [
-                {"date": self.iso_date(day), "amount_billed": sum(result[name].values()), "account_id": account_name_to_id[name], "account_name": name}
+                {"date": self.iso_date(day),
+                 "amount_billed": money.to_decimal_string(sum(result[name].values())),
+                 "account_id": account_name_to_id[name],
+                 "account_name": name}
                 for name in result.keys()
             ]
         self.save_file(self.generate_billing_csv_file_name(date), self.to_csv(rows))
 
-    def generateBetterReport(self) -> str:
-        # Get date variables. We will be making the report for the previous day.
-        yesterday = datetime.date.today() - datetime.timedelta(1)
-        firstDayOfMonth = self.first_day_of_month(yesterday)
-        lastDayOfMonth = self.last_day_of_month(yesterday)
-
-        # Save usage data
-        if self.has_persist_config:
-            self.saveUsageData(yesterday)
+    def historyRows(self, day: datetime.date) -> Sequence[Mapping[str, Any]]:
+        account_name_to_id = {v: k for k, v in self.accounts.items()}
+        result = self.generateAccountSummary(self.accounts, day, day + datetime.timedelta(1))
+        return [
+            {"account_id": account_name_to_id[name],
+             "account_name": name,
+             "service": service,
+             "cost": cost}
+            for name, services in result.items()
+            for service, cost in services.items()
+        ]
+
+    def fetchPlan(self, dates: Sequence[datetime.date]) -> Mapping[tuple, Callable[[], Any]]:
+        plan = {}
+        for month in sorted({self.first_day_of_month(date) for date in dates}):
+            for query in (self.accountSummaryQuery(self.accounts),
+                          self.usageTypeSummaryQuery(self.compliance["accounts"]),
+                          self.s3StorageSummaryQuery(self.compliance["accounts"])):
+                plan[self.costAndUsageKey(query, month)] = functools.partial(self.monthlyCostAndUsage, query, month)
+            accountIds = tuple(sorted(self.resourceAccountIds(self.compliance["accounts"])))
+            plan[('cur_rows', self.cur_source, month, accountIds)] = functools.partial(self.usage_rows, month, accountIds)
+        return plan
+
+    def generateBetterReport(self, side_effects: bool = True) -> str:
+        """
+        Render the report for the report date. Unless side_effects is False, this also saves the month's usage data and
+        writes the personalized compliance emails.
+        """
+        # Get date variables. Monthly figures are for the month up to and including the report date.
+        reportDate = self.date
+        firstDayOfMonth = self.first_day_of_month(reportDate)
+        dayAfter = reportDate + datetime.timedelta(1)
 
         # Get a monthly and daily aggregation of costs. These reports are a nested dictionary in the form:
         # dictionary {account1: {service1: cost1, service2: cost2, ...}, account2: ...}
-        accountSummaryMonthly = self.generateAccountSummary(self.accounts, firstDayOfMonth, lastDayOfMonth)
-        accountSummaryDaily = self.generateAccountSummary(self.accounts, yesterday, yesterday + datetime.timedelta(1))
+        with self.profile.phase('cost_explorer'):
+            accountSummaryMonthly = self.generateAccountSummary(self.accounts, firstDayOfMonth, dayAfter)
+            accountSummaryDaily = self.generateAccountSummary(self.accounts, reportDate, dayAfter)
+
+            usageTypeSummaryMonthly = self.generateUsageTypeSummary(self.compliance["accounts"], firstDayOfMonth, dayAfter)
+            s3StorageSummaryMonthly = self.generateS3StorageSummary(self.compliance["accounts"], firstDayOfMonth, dayAfter)
 
-        usageTypeSummaryMonthly = self.generateUsageTypeSummary(self.compliance["accounts"], firstDayOfMonth,
-                                                                lastDayOfMonth)
-        s3StorageSummaryMonthly = self.generateS3StorageSummary(self.compliance["accounts"], firstDayOfMonth,
-                                                                lastDayOfMonth)
+        # Save usage data, which is answered from the Cost Explorer results fetched above
+        if side_effects and self.has_persist_config:
+            self.runSideEffect('save_usage_data', self.saveUsageData, reportDate)
+        if side_effects and self.has_history_config:
+            self.runSideEffect('save_history', self.saveHistory, reportDate)
+        with self.profile.phase('anomalies'):
+            anomalies = self.detectAnomalies(['account_name'], ['account_name', 'service'])
 
         # Generate a summary on individual resources. This requires downloading the billing CSV
-        resourceSummaryMonthlyUnsorted = self.generateResourceSummary(self.compliance["accounts"])
-        resourceSummaryMonthly = dict(
-            sorted(resourceSummaryMonthlyUnsorted.items(), key=lambda x: x[1].monthly_cost, reverse=True)[:30])
-        userCostSummaryMonthly = self.generateUserCostSummary(resourceSummaryMonthlyUnsorted,
-                                                              self.compliance["accounts"])
-        totalUserCostMonthly = sum([user_costs['Total'] for (user, user_costs) in userCostSummaryMonthly.items()])
+        with self.profile.phase('cur_download'):
+            self.usage_rows(account_ids=self.resourceAccountIds(self.compliance["accounts"]))
+        with self.profile.phase('cur_parse'):
+            # The accounts and regions the compliance scan is limited to
+            activeRegions = set()
+            resourceSummaryMonthlyUnsorted = self.generateResourceSummary(self.compliance["accounts"], activeRegions)
+        with self.profile.phase('aggregate'):
+            resourceSummaryMonthly = resourceSummaryMonthlyUnsorted.top(30)
+            userCostSummaryMonthly = self.generateUserCostSummary(resourceSummaryMonthlyUnsorted,
+                                                                  self.compliance["accounts"])
+            totalUserCostMonthly = sum([user_costs['Total'] for (user, user_costs) in userCostSummaryMonthly.items()])
 
         # This will generate personalized compliance emails for everyone with a tagged resource
-        self.generateComplianceSummary(yesterday)
+        if side_effects:
+            ownerCosts = {user: user_costs['Total'] for user, user_costs in userCostSummaryMonthly.items()}
+            self.runSideEffect('compliance_scan', self.generateComplianceSummary, reportDate, ownerCosts, resourceSummaryMonthlyUnsorted,
+                               activeRegions)
 
         # Create a list of managed accounts
         managedAccounts = [self.compliance["accounts"][k] for k in self.compliance["accounts"]]
 
-        # Create some simple aggregations, convert the strings sent over by AWS to floats
+        # Create some simple aggregations of the micro-dollar amounts
         totalsByAccountMonthly = {k: sum(accountSummaryMonthly[k].values()) for k in accountSummaryMonthly}
         totalsByAccountDaily = {k: sum(accountSummaryDaily[k].values()) for k in accountSummaryDaily}
         totalsByServiceMonthly = {k: sum(usageTypeSummaryMonthly[k].values()) for k in usageTypeSummaryMonthly}
@@ -669,36 +1163,73 @@ class AWSReport(Report):
         totalsByUnmanagedAccountDaily = {k: totalsByAccountDaily[k] for k in totalsByAccountDaily if
                                          k not in managedAccounts}
 
+        if self.export_dir is not None:
+            with self.profile.phase('export'):
+                self.exportTables({
+                    'accounts': (['account_name', 'service', 'cost_month_micros', 'cost_day_micros'], (
+                        {'account_name': account, 'service': service, 'cost_month_micros': cost,
+                         'cost_day_micros': accountSummaryDaily.get(account, {}).get(service, 0)}
+                        for account, services in accountSummaryMonthly.items()
+                        for service, cost in services.items()
+                    )),
+                    'usage_types': (['service', 'usage_type', 'cost_month_micros'], (
+                        {'service': service, 'usage_type': usageType, 'cost_month_micros': cost}
+                        for service, usageTypes in usageTypeSummaryMonthly.items()
+                        for usageType, cost in usageTypes.items()
+                    )),
+                    's3_storage': (['usage_type', 'usage_unit', 'usage_amount', 'cost_month_micros'], (
+                        {'usage_type': usageType, 'usage_unit': metrics['usageUnit'], 'usage_amount': metrics['usageAmount'],
+                         'cost_month_micros': metrics['usageCost']}
+                        for usageType, metrics in s3StorageSummaryMonthly.items()
+                    )),
+                    # Every resource, not just the most expensive ones in the email
+                    'resources': (['resource_id', 'account_name', 'region', 'service', 'owner', 'cost_month_micros'], (
+                        {'resource_id': resource.resource_arn, 'account_name': resource.account_name, 'region': resource.region,
+                         'service': resource.resource_type, 'owner': resource.email, 'cost_month_micros': resource.monthly_cost}
+                        for resource in resourceSummaryMonthlyUnsorted.values()
+                    )),
+                    'users': (['owner', 'service', 'cost_month_micros'], (
+                        {'owner': user, 'service': service, 'cost_month_micros': cost}
+                        for user, services in userCostSummaryMonthly.items()
+                        for service, cost in services.items() if service != 'Total'
+                    )),
+                })
+
         # Render the email using Jinja
-        return self.render_email(
-            yesterday,
-            self.email_recipients,
-            accountTotalsMonthly=totalsByAccountMonthly,
-            accountTotalsDaily=totalsByAccountDaily,
-            serviceTotalsMonthly=totalsByServiceMonthly,
-            serviceUsageTypesMonthly=usageTypeSummaryMonthly,
-            accountServicesMonthly=accountSummaryMonthly,
-            accountServicesDaily=accountSummaryDaily,
-            resourceSummaryMonthly=resourceSummaryMonthly,
-            s3StorageSummaryMonthly=s3StorageSummaryMonthly,
-            userCostSummaryMonthly=userCostSummaryMonthly,
-            totalUserCostMonthly=totalUserCostMonthly,
-            totalsByManagedAccountMonthly=totalsByManagedAccountMonthly,
-            totalsByManagedAccountDaily=totalsByManagedAccountDaily,
-            totalsByUnmanagedAccountMonthly=totalsByUnmanagedAccountMonthly,
-            totalsByUnmanagedAccountDaily=totalsByUnmanagedAccountDaily
-        )
+        with self.profile.phase('render'):
+            email = self.render_email(
+                reportDate,
+                self.email_recipients,
+                accountTotalsMonthly=totalsByAccountMonthly,
+                accountTotalsDaily=totalsByAccountDaily,
+                serviceTotalsMonthly=totalsByServiceMonthly,
+                serviceUsageTypesMonthly=usageTypeSummaryMonthly,
+                accountServicesMonthly=accountSummaryMonthly,
+                accountServicesDaily=accountSummaryDaily,
+                resourceSummaryMonthly=resourceSummaryMonthly,
+                s3StorageSummaryMonthly=s3StorageSummaryMonthly,
+                userCostSummaryMonthly=userCostSummaryMonthly,
+                totalUserCostMonthly=totalUserCostMonthly,
+                totalsByManagedAccountMonthly=totalsByManagedAccountMonthly,
+                totalsByManagedAccountDaily=totalsByManagedAccountDaily,
+                totalsByUnmanagedAccountMonthly=totalsByUnmanagedAccountMonthly,
+                totalsByUnmanagedAccountDaily=totalsByUnmanagedAccountDaily,
+                anomalies=anomalies
+            )
+        self.waitForUploads()
+        return email
 
 
 class GCPReport(Report):
+    DATA_DELAY_DAYS = 2
 
-    def __init__(self, config_path: str, date: datetime.date):
-        super().__init__(platform='gcp', config_path=config_path, date=date)
+    def __init__(self, config_path: str, date: datetime.date, **kwargs):
+        super().__init__(platform='gcp', config_path=config_path, date=date, **kwargs)
 
     def readTerraWorkspaces(self, path: str) -> Sequence[Mapping]:
         try:
             if path is not None:
-                workspaces = json.loads(Path(path).read_text())
+                workspaces = json.loads(clients.external_call('terra', 'read_text', lambda path: Path(path).read_text(), path))
                 if not isinstance(workspaces, list):
                     return []
                 return workspaces
@@ -709,80 +1240,330 @@ class GCPReport(Report):
     def isUcscEmail(self, email: str) -> bool:
         return email.endswith('ucsc.edu') or email.endswith('gmail.com')
 
-    def saveUsageData(self, date: datetime.date):
+    def saveUsageData(self, date: datetime.date, save_terra_workspaces: bool = True):
+        """
+        Save the month-to-date usage data. The Terra workspaces are a snapshot of their current state, so they should
+        only be saved as of the day they were retrieved.
+        """
         rows = []
         for day in self.days_of_month_up_to_and_including(date):
             results = group_by(self.doQuery(day), 'id', 'name', 'cost_today', 'raw_cost_today')
             rows += [
-                {"date": self.iso_date(day), "amount_billed": cost_today, "project_id": id, "project_name": name, "unadjusted_cost": raw_cost_today}
+                {"date": self.iso_date(day),
+                 "amount_billed": money.to_decimal_string(cost_today),
+                 "project_id": id,
+                 "project_name": name,
+                 "unadjusted_cost": money.to_decimal_string(raw_cost_today)}
                 for (id, name, cost_today, raw_cost_today) in results if cost_today > 0 or raw_cost_today > 0
             ]
         self.save_file(self.generate_billing_csv_file_name(date), self.to_csv(rows))
-        terra_workspaces = self.readTerraWorkspaces(self.terra_workspaces_path)
-        self.save_file(self.generate_terra_json_file_name(date), self.to_json(terra_workspaces))
-
-    def addCreatedByToRows(self, rows: Sequence[Mapping], terra_workspaces: Sequence[Mapping]):
-        id_to_created_by = {
+        if save_terra_workspaces:
+            terra_workspaces = self.terraWorkspaces()
+            self.save_file(self.generate_terra_json_file_name(date), self.to_json(terra_workspaces))
+
+    def historyRows(self, day: datetime.date) -> Sequence[Mapping[str, Any]]:
+        """
+        Return the cost of each project and service on the given usage day.
+
+        >>> import tempfile
+        >>> config = tempfile.NamedTemporaryFile('w', suffix='.json')
+        >>> json.dump({'gcp': {'bigquery_table': 'table'}}, config); config.flush()
+        >>> report = GCPReport(config.name, datetime.date(2020, 10, 2))
+        >>> report.cache[('bigquery', 'table', datetime.date(2020, 10, 1))] = [
+        ...     {'name': 'a', 'description': 'Compute', 'usage_date': datetime.date(2020, 10, day), 'cost': 1.5, 'raw_cost': 2.0, 'id': 'p-a'}
+        ...     for day in (1, 2, 2)
+        ... ]
+        >>> report.historyRows(datetime.date(2020, 10, 2))
+        [{'project_id': 'p-a', 'project_name': 'a', 'service': 'Compute', 'cost': 3000000, 'raw_cost': 4000000}]
+        """
+        totals = {}
+        for row in self.dailyRows(self.first_day_of_month(day)):
+            if row['usage_date'] == day:
+                key = (row['id'], row['name'], row['description'])
+                cost, raw_cost = totals.get(key, (0, 0))
+                totals[key] = (cost + money.from_dollars(row['cost']), raw_cost + money.from_dollars(row['raw_cost']))
+        return [
+            {"project_id": id,
+             "project_name": name,
+             "service": service,
+             "cost": cost,
+             "raw_cost": raw_cost}
+            for (id, name, service), (cost, raw_cost) in totals.items()
+        ]
+
+    def terraOwners(self, terra_workspaces: Sequence[Mapping]) -> Mapping[str, str]:
+        """Return the creator of the Terra workspace of each Google project."""
+        return {
             workspace['googleProject']: workspace['createdBy']
             for workspace in [mapping['workspace'] for mapping in terra_workspaces if 'workspace' in mapping]
             if 'googleProject' in workspace and 'createdBy' in workspace
         }
+
+    def addCreatedByToRows(self, rows: Sequence[Mapping], terra_workspaces: Sequence[Mapping]):
+        id_to_created_by = self.terraOwners(terra_workspaces)
         for row in rows:
             id = row['id']
             row['created_by'] = id_to_created_by[id] if id in id_to_created_by else 'Unowned'
 
-    def doQuery(self, date: datetime.date):
-        terra_workspaces = self.readTerraWorkspaces(self.terra_workspaces_path)
-        client = bigquery.Client()
-        query_month = date.strftime('%Y%m')
-        query_today = date.strftime('%Y-%m-%d')
+    def terraWorkspaces(self) -> Sequence[Mapping]:
+        return self.cached(('terra', self.terra_workspaces_path), lambda: self.readTerraWorkspaces(self.terra_workspaces_path))
+
+    def dailyRows(self, month: datetime.date) -> Sequence[Mapping]:
+        """
+        Return the cost of each project and service on every usage day of the given invoice month, in all billing
+        export tables. The tables that aren't cached yet are queried concurrently, so querying several takes about
+        as long as the slowest of them. The rows are returned in the order of the tables, whichever finishes first.
+
+        >>> import tempfile, time
+        >>> config = tempfile.NamedTemporaryFile('w', suffix='.json')
+        >>> json.dump({'gcp': {'bigquery_tables': ['slow', 'fast']}}, config); config.flush()
+        >>> report = GCPReport(config.name, datetime.date(2020, 10, 2))
+        >>> def queryDailyRows(month, table):
+        ...     time.sleep(0.2 if table == 'slow' else 0)
+        ...     print('finished', table)
+        ...     return [{'id': table}]
+        >>> report.queryDailyRows = queryDailyRows
+        >>> report.dailyRows(datetime.date(2020, 10, 1))
+        finished fast
+        finished slow
+        [{'id': 'slow'}, {'id': 'fast'}]
+        """
+        tables = self.bigquery_tables
+        missing = [table for table in tables if ('bigquery', table, month) not in self.cache]
+        if len(missing) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(missing)) as executor:
+                futures = [executor.submit(self.tableDailyRows, month, table) for table in missing]
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+        if len(tables) == 1:
+            return self.tableDailyRows(month, tables[0])
+        else:
+            return list(itertools.chain.from_iterable(self.tableDailyRows(month, table) for table in tables))
+
+    def tableDailyRows(self, month: datetime.date, table: str) -> Sequence[Mapping]:
+        return self.cached(('bigquery', table, month), lambda: self.queryDailyRows(month, table))
+
+    def queryDailyRows(self, month: datetime.date, table: str) -> Sequence[Mapping]:
+        client = clients.bigquery_client()
+        query_month = month.strftime('%Y%m')
 
         # noinspection SqlNoDataSourceInspection
         query = f'''SELECT
               project.name,
               service.description,
-              SUM(CASE WHEN DATE(usage_start_time) <= '{query_today}' THEN cost + IFNULL(creds.amount, 0) ELSE 0 END) AS cost_month,
-              SUM(CASE WHEN DATE(usage_start_time)  = '{query_today}' THEN cost + IFNULL(creds.amount, 0) ELSE 0 END) AS cost_today,
-              SUM(CASE WHEN DATE(usage_start_time) <= '{query_today}' THEN cost ELSE 0 END) as raw_cost_month,
-              SUM(CASE WHEN DATE(usage_start_time)  = '{query_today}' THEN cost ELSE 0 END) as raw_cost_today,
+              DATE(usage_start_time) AS usage_date,
+              SUM(cost + IFNULL(creds.amount, 0)) AS cost,
+              SUM(cost) AS raw_cost,
               project.id
-            FROM `{self.bigquery_table}`
+            FROM `{table}`
             LEFT JOIN UNNEST(credits) AS creds
             WHERE invoice.month = '{query_month}'
-            GROUP BY project.name, service.description, project.id
-            ORDER BY LOWER(project.name) ASC, service.description ASC, LOWER(project.id) ASC'''
+            GROUP BY project.name, service.description, project.id, usage_date'''
         query_job = client.query(query)
-        rows = list(query_job.result())
-        rows = [dict(row) for row in rows]
-        self.addCreatedByToRows(rows, terra_workspaces)
+        rows = [dict(row) for row in query_job.result()]
+        self.profile.count_call('bigquery')
+        self.profile.add_rows('bigquery', len(rows))
         return rows
 
-    def generateBetterReport(self) -> str:
-        if self.has_persist_config:
-            self.saveUsageData(self.date)
-        return self.render_email(self.date, self.email_recipients, rows=self.doQuery(self.date), cost_cutoff=self.cost_cutoff())
+    def usesDailyRows(self, side_effects: bool = True) -> bool:
+        """
+        Return whether generating the report needs the month's daily rows: saving the usage data and history, and
+        exporting all projects, need every project and service of every day.
+        """
+        return side_effects and (self.has_persist_config or self.has_history_config) or self.export_dir is not None
+
+    def rollupCutoff(self, date: datetime.date) -> Optional[int]:
+        cutoff = self.cost_cutoff(date)
+        return cutoff if cutoff > 0 else None
+
+    def costRollupKey(self, date: datetime.date) -> tuple:
+        return ('bigquery_rollup', tuple(self.bigquery_tables), date, self.rollupCutoff(date), self.terra_workspaces_path)
+
+    def costRollup(self, date: datetime.date) -> cost_rollup.CostRollup:
+        """
+        Return the rollup of the costs of the month up to the given date, without the rows costing less than the
+        cutoff of the report for that date, as queried from all billing export tables.
+
+        >>> import tempfile
+        >>> config = tempfile.NamedTemporaryFile('w', suffix='.json')
+        >>> json.dump({'gcp': {'bigquery_tables': ['one', 'two']}}, config); config.flush()
+        >>> report = GCPReport(config.name, datetime.date(2020, 10, 1))
+        >>> report.cache[('terra', None)] = [{'workspace': {'googleProject': 'p-a', 'createdBy': 'x@ucsc.edu'}}]
+        >>> def queryCostRollup(date, cutoff):
+        ...     print('FROM `one`' in cost_rollup.query(report.bigquery_tables), cutoff)
+        ...     return [{'level': 'total', 'id': None, 'name': None, 'created_by': None, 'description': None,
+        ...              'cost_month': 1.5, 'cost_today': 0.5}]
+        >>> report.queryCostRollup = queryCostRollup
+        >>> report.costRollup(datetime.date(2020, 10, 1)).total['cost_month']
+        True 1000000
+        1500000
+
+        On Fridays, nothing is left out:
+
+        >>> report.costRollup(datetime.date(2020, 10, 2)).total['cost_month']
+        True None
+        1500000
+        """
+        cutoff = self.rollupCutoff(date)
+        return cost_rollup.from_query_rows(self.cached(self.costRollupKey(date), lambda: self.queryCostRollup(date, cutoff)))
+
+    def queryCostRollup(self, date: datetime.date, cutoff: Optional[int]) -> Sequence[Mapping]:
+        from google.cloud import (
+            bigquery,
+        )
+        client = clients.bigquery_client()
+        owners = self.terraOwners(self.terraWorkspaces())
+        workspace_type = bigquery.StructQueryParameterType(bigquery.ScalarQueryParameterType('STRING', name='project_id'),
+                                                           bigquery.ScalarQueryParameterType('STRING', name='created_by'))
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ScalarQueryParameter('invoice_month', 'STRING', date.strftime('%Y%m')),
+            bigquery.ScalarQueryParameter('date', 'DATE', date),
+            bigquery.ScalarQueryParameter('cutoff', 'FLOAT64', None if cutoff is None else cutoff / money.DOLLAR),
+            bigquery.ArrayQueryParameter('workspaces', workspace_type, [
+                bigquery.StructQueryParameter(None,
+                                              bigquery.ScalarQueryParameter('project_id', 'STRING', project_id),
+                                              bigquery.ScalarQueryParameter('created_by', 'STRING', created_by))
+                for project_id, created_by in owners.items()
+            ])
+        ])
+        query_job = client.query(cost_rollup.query(self.bigquery_tables), job_config=job_config)
+        rows = [dict(row) for row in query_job.result()]
+        self.profile.count_call('bigquery')
+        self.profile.add_rows('bigquery', len(rows))
+        return rows
 
-    def cost_cutoff(self) -> float:
+    def doQuery(self, date: datetime.date):
+        """
+        Return the month-to-date and same-day cost of each project and service, sliced from the month's daily rows.
+
+        >>> import tempfile
+        >>> config = tempfile.NamedTemporaryFile('w', suffix='.json')
+        >>> json.dump({'gcp': {'bigquery_table': 'table'}}, config); config.flush()
+        >>> report = GCPReport(config.name, datetime.date(2020, 10, 2))
+        >>> def row(name, id, day, cost):
+        ...     return {'name': name, 'description': 'Compute', 'usage_date': datetime.date(2020, 10, day), 'cost': cost, 'raw_cost': cost + 1, 'id': id}
+        >>> report.cache[('terra', None)] = [{'workspace': {'googleProject': 'p-b', 'createdBy': 'x@ucsc.edu'}}]
+        >>> report.cache[('bigquery', 'table', datetime.date(2020, 10, 1))] = [
+        ...     row('b', 'p-b', 1, 1.0), row('b', 'p-b', 2, 2.0), row('b', 'p-b', 3, 4.0),
+        ...     row('A', 'p-a', 3, 8.0), row(None, None, 1, 16.0)
+        ... ]
+        >>> for r in report.doQuery(datetime.date(2020, 10, 2)):
+        ...     print(r['name'], r['cost_month'], r['cost_today'], r['raw_cost_month'], r['raw_cost_today'], r['created_by'])
+        None 16000000 0 17000000 0 Unowned
+        A 0 0 0 0 Unowned
+        b 3000000 2000000 5000000 3000000 x@ucsc.edu
+        """
+        terra_workspaces = self.terraWorkspaces()
+
+        # Slice the month's daily costs into month-to-date and same-day totals for each project and service
+        totals = {}
+        for row in self.dailyRows(self.first_day_of_month(date)):
+            key = (row['name'], row['description'], row['id'])
+            if key not in totals:
+                totals[key] = {
+                    'name': row['name'],
+                    'description': row['description'],
+                    'cost_month': 0,
+                    'cost_today': 0,
+                    'raw_cost_month': 0,
+                    'raw_cost_today': 0,
+                    'id': row['id']
+                }
+            if row['usage_date'] <= date:
+                cost = money.from_dollars(row['cost'])
+                raw_cost = money.from_dollars(row['raw_cost'])
+                totals[key]['cost_month'] += cost
+                totals[key]['raw_cost_month'] += raw_cost
+                if row['usage_date'] == date:
+                    totals[key]['cost_today'] += cost
+                    totals[key]['raw_cost_today'] += raw_cost
+
+        # Same order as ORDER BY LOWER(project.name) ASC, service.description ASC, LOWER(project.id) ASC, nulls first
+        rows = sorted(totals.values(), key=lambda row: (
+            nulls_first(row['name'] and row['name'].lower()),
+            nulls_first(row['description']),
+            nulls_first(row['id'] and row['id'].lower())
+        ))
+        self.addCreatedByToRows(rows, terra_workspaces)
+        return rows
+
+    def fetchPlan(self, dates: Sequence[datetime.date]) -> Mapping[tuple, Callable[[], Any]]:
+        plan = {('terra', self.terra_workspaces_path): self.terraWorkspaces}
+        for date in sorted(dates):
+            plan[self.costRollupKey(date)] = functools.partial(self.costRollup, date)
+        if self.usesDailyRows():
+            for month in sorted({self.first_day_of_month(date) for date in dates}):
+                for table in self.bigquery_tables:
+                    plan[('bigquery', table, month)] = functools.partial(self.tableDailyRows, month, table)
+        return plan
+
+    def generateBetterReport(self, side_effects: bool = True) -> str:
+        month = self.first_day_of_month(self.date)
+        with self.profile.phase('terra'):
+            self.terraWorkspaces()
+        # The report only displays the rows BigQuery rolls up. The daily rows of every project and service are only
+        # fetched for the usage data, history and exports, once for all of them.
+        with self.profile.phase('bigquery'):
+            costs = self.costRollup(self.date)
+            if self.usesDailyRows(side_effects):
+                self.dailyRows(month)
+        if side_effects and self.has_persist_config:
+            self.runSideEffect('save_usage_data', self.saveUsageData, self.date)
+        if side_effects and self.has_history_config:
+            self.runSideEffect('save_history', self.saveHistory, self.date)
+        with self.profile.phase('anomalies'):
+            anomalies = self.detectAnomalies(['project_id'], ['project_id', 'service'])
+        if self.export_dir is not None:
+            with self.profile.phase('export'):
+                rows = self.doQuery(self.date)
+                self.exportTables({
+                    'projects': (['project_id', 'project_name', 'service', 'created_by', 'cost_month_micros', 'cost_day_micros',
+                                  'raw_cost_month_micros', 'raw_cost_day_micros'], (
+                        {'project_id': row['id'], 'project_name': row['name'], 'service': row['description'],
+                         'created_by': row['created_by'], 'cost_month_micros': row['cost_month'],
+                         'cost_day_micros': row['cost_today'], 'raw_cost_month_micros': row['raw_cost_month'],
+                         'raw_cost_day_micros': row['raw_cost_today']}
+                        for row in rows
+                    ))
+                })
+        with self.profile.phase('render'):
+            email = self.render_email(self.date,
+                                      self.email_recipients,
+                                      costs=costs,
+                                      cost_cutoff=self.cost_cutoff(),
+                                      anomalies=anomalies)
+        self.waitForUploads()
+        return email
+
+    def cost_cutoff(self, date: Optional[datetime.date] = None) -> Union[int, float]:
         # cost cutoff is $1 on all days but friday, when it effectively does not exist
-        return float('-inf') if self.date.weekday() == 4 else 1.0
+        date = self.date if date is None else date
+        return float('-inf') if date.weekday() == 4 else money.DOLLAR
 
 
 def print_amount(amount: Union[Decimal, float, int]) -> str:
     """
+    Integer amounts are micro-dollars, as produced by the aggregations. Decimal and float amounts are dollars.
+
     >>> from decimal import Decimal
     >>> print_amount(Decimal('20.000000000000000001'))
     '$20.00'
 
     >>> print_amount(Decimal('-10'))
     '-$10.00'
+
+    >>> print_amount(12345678)
+    '$12.35'
     """
-    amount = Decimal(amount).quantize(Decimal('0.01'))
-    symbol = '-' if amount < 0 else ''
-    return f'{symbol}${abs(amount)}'
+    if not isinstance(amount, int):
+        amount = money.from_dollars(amount)
+    return money.format_amount(amount)
 
 
-def print_diff(amount: Decimal, threshold: int = 200) -> str:
+def print_diff(amount: Union[Decimal, int], threshold: int = 200) -> str:
     """
+    The threshold is in dollars. Integer amounts are micro-dollars, see print_amount.
+
     >>> from decimal import Decimal
     >>> print_diff(Decimal('100.00'))
     '$100.00'
@@ -799,9 +1580,11 @@ def print_diff(amount: Decimal, threshold: int = 200) -> str:
     >>> print_diff(Decimal('-0.02'))
     '<span class="unusual">-$0.02</span>'
     """
-    if amount > threshold or amount < 0:
+    if not isinstance(amount, int):
+        amount = money.from_dollars(amount)
+    if amount > threshold * money.DOLLAR or amount < 0:
         return f'<span class="unusual">{print_amount(amount)}</span>'
-    elif amount < Decimal('0.01'):
+    elif amount < money.CENT:
         return ''
     else:
         return print_amount(amount)
@@ -886,6 +1669,22 @@ def normalize_key(key):
     return key.lower() if isinstance(key, str) else key
 
 
+def next_month(date: datetime.date) -> datetime.date:
+    """
+    >>> next_month(datetime.date(2020, 12, 31))
+    datetime.date(2021, 1, 1)
+    """
+    return (date.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+
+def nulls_first(value) -> tuple:
+    """
+    >>> sorted(['b', None, 'a'], key=nulls_first)
+    [None, 'a', 'b']
+    """
+    return (value is not None, value if value is not None else '')
+
+
 def sort_by(rows: Iterable, key, reverse=True) -> Iterable:
     """
     >>> my_rows = [
@@ -928,6 +1727,239 @@ report_types = {
     'gcp': GCPReport
 }
 
+# Source data shared by the reports of a backfill, set in each process that renders them
+backfill_cache: MutableMapping = {}
+
+
+def date_range(start: datetime.date, end: datetime.date) -> Sequence[datetime.date]:
+    """
+    >>> date_range(datetime.date(2020, 10, 30), datetime.date(2020, 11, 1))
+    [datetime.date(2020, 10, 30), datetime.date(2020, 10, 31), datetime.date(2020, 11, 1)]
+
+    >>> date_range(datetime.date(2020, 11, 1), datetime.date(2020, 10, 30))
+    []
+    """
+    return [start + datetime.timedelta(days=offset) for offset in range((end - start).days + 1)]
+
+
+def set_backfill_cache(cache: MutableMapping) -> None:
+    global backfill_cache
+    backfill_cache = cache
+
+
+def render_backfill(report_type: str, config_path: str, date: datetime.date, output_dir: str) -> Path:
+    report = report_types[report_type](config_path, date, cache=backfill_cache)
+    path = Path(output_dir) / f'{report_type}-{report.iso_date(date)}.eml'
+    path.write_text(report.generateBetterReport(side_effects=False))
+    return path
+
+
+def backfill(report_type: str,
+             config_path: str,
+             dates: Sequence[datetime.date],
+             output_dir: str,
+             jobs: int,
+             save_usage_data: bool = False) -> Sequence[Path]:
+    """
+    Render one .eml per date into output_dir. Each source is fetched once for the whole range, and the reports are
+    rendered from slices of it in up to `jobs` processes, each of which is handed a copy of the fetched data.
+    Personalized compliance emails are never written. Usage data for past months is only rewritten if
+    save_usage_data is set, in which case it is saved once per month, as of the last date of the range in that
+    month, and without a Terra workspace snapshot. The history partitions of the range are then rewritten, too.
+    """
+    cache = {}
+    report = report_types[report_type](config_path, dates[-1], cache=cache)
+    report.prefetch(dates)
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    args = [(report_type, config_path, date, output_dir) for date in dates]
+    if jobs > 1 and len(dates) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs,
+                                                    initializer=set_backfill_cache,
+                                                    initargs=(cache,)) as executor:
+            paths = list(executor.map(render_backfill, *zip(*args)))
+    else:
+        set_backfill_cache(cache)
+        paths = [render_backfill(*arg) for arg in args]
+    if save_usage_data and report.has_persist_config:
+        last_dates = {report.first_day_of_month(date): date for date in dates}
+        for date in last_dates.values():
+            if isinstance(report, GCPReport):
+                report.saveUsageData(date, save_terra_workspaces=False)
+            else:
+                report.saveUsageData(date)
+    if save_usage_data and report.has_history_config:
+        # Every backfilled day is rewritten, not just the missing and recent ones
+        for date in dates:
+            report.saveHistoryPartition(date)
+    report.waitForUploads()
+    return paths
+
+
+def generate_resumable(report: Report, store: RunStore, resume: bool = False) -> str:
+    """
+    Generate the report, recording its inputs, completed side effects and email in the store. With resume, the latest
+    recorded run of the same report is continued instead: its email is returned if it was rendered, otherwise the
+    report is rendered from the recorded inputs, skipping the side effects that were already completed.
+
+    >>> import tempfile
+    >>> config = tempfile.NamedTemporaryFile('w', suffix='.json')
+    >>> json.dump({'gcp': {'bigquery_table': 'table'}}, config); config.flush()
+    >>> class Report(GCPReport):
+    ...     def generateBetterReport(self, side_effects=True):
+    ...         self.runSideEffect('save_usage_data', lambda: print('saved'))
+    ...         if failing: raise RuntimeError('sendmail failed')
+    ...         return print_amount(self.costRollup(self.date).total['cost_month'])
+    >>> def queryCostRollup(date, cutoff):
+    ...     print('queried')
+    ...     return [{'level': 'total', 'id': None, 'name': None, 'created_by': None, 'description': None,
+    ...              'cost_month': 1.5, 'cost_today': 0.5}]
+    >>> def report():
+    ...     report = Report(config.name, datetime.date(2020, 10, 1))
+    ...     report.queryCostRollup = queryCostRollup
+    ...     report.cache[('terra', None)] = []
+    ...     return report
+    >>> store = RunStore(tempfile.mkdtemp())
+    >>> failing = True
+    >>> generate_resumable(report(), store)
+    Traceback (most recent call last):
+    ...
+    RuntimeError: sendmail failed
+    >>> failing = False
+
+    The retry neither queries BigQuery nor saves the usage data again, and a second one just returns the email:
+
+    >>> generate_resumable(report(), store, resume=True)
+    '$1.50'
+    >>> generate_resumable(report(), store, resume=True)
+    '$1.50'
+    """
+    run = store.latest(report.platform, report.date) if resume else None
+    if run is not None and run.email is not None:
+        report.profile.count_call('resumed_email')
+        return run.email
+    if run is not None:
+        report.cache.update(run.inputs())
+    else:
+        with report.profile.phase('prefetch'):
+            report.prefetch([report.date])
+        run = store.create(report.platform, report.date, report.cache)
+    report.report_run = run
+    email = report.generateBetterReport()
+    run.set_email(email)
+    return email
+
+
+def run_all(config_path: str,
+            dates: Mapping[str, datetime.date],
+            output_dir: str,
+            profile: RunProfile,
+            **kwargs) -> Sequence[Path]:
+    """
+    Generate the report of each platform for the given date in parallel threads, writing them to output_dir as
+    <platform>-<date>.eml. The reports share one uploader and one run profile, in which the phases of each report are
+    prefixed by its platform. Keyword arguments are passed to each report.
+    """
+    reports = [report_types[platform](config_path, date, profile=profile.scoped(platform), **kwargs)
+               for platform, date in dates.items()]
+    uploader = reports[0].uploader if reports[0].has_persist_config else None
+    if uploader is not None:
+        for report in reports:
+            report.useUploader(uploader)
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(reports)) as executor:
+            emails = list(executor.map(lambda report: report.generateBetterReport(), reports))
+    finally:
+        if uploader is not None:
+            with profile.phase('wait_uploads'):
+                uploader.close()
+    paths = []
+    for report, email in zip(reports, emails):
+        path = Path(output_dir) / f'{report.platform}-{report.iso_date(report.date)}.eml'
+        path.write_text(email)
+        paths.append(path)
+    return paths
+
+
+def expand_config_paths(paths: Iterable[str]) -> Sequence[str]:
+    """
+    Return the given config files, and the .json files in the given directories, in order.
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> for name in ('b.json', 'a.json', 'notes.txt'):
+    ...     _ = (Path(directory) / name).write_text('{}')
+    >>> [Path(path).name for path in expand_config_paths([directory, 'config.json'])]
+    ['a.json', 'b.json', 'config.json']
+    """
+    expanded = []
+    for path in map(Path, paths):
+        expanded.extend(map(str, sorted(path.glob('*.json'))) if path.is_dir() else [str(path)])
+    return expanded
+
+
+def plan_fetches(reports: Iterable[Report], dates: Sequence[datetime.date]) -> Mapping[tuple, Callable[[], Any]]:
+    """
+    Return the fetches needed by all of the given reports, keeping only one of those that fetch the same data.
+
+    >>> import tempfile
+    >>> def config(table):
+    ...     file = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False)
+    ...     json.dump({'gcp': {'bigquery_table': table}}, file); file.close()
+    ...     return file.name
+    >>> reports = [GCPReport(config(table), datetime.date(2020, 10, 2)) for table in ('shared', 'shared', 'other')]
+    >>> sorted(key[:2] for key in plan_fetches(reports, [datetime.date(2020, 10, 2)]))
+    [('bigquery_rollup', ('other',)), ('bigquery_rollup', ('shared',)), ('terra', None)]
+    """
+    plan = {}
+    for report in reports:
+        for key, fetch in report.fetchPlan(dates).items():
+            plan.setdefault(key, fetch)
+    return plan
+
+
+def run_tenants(report_type: str,
+                config_paths: Sequence[str],
+                date: datetime.date,
+                output_dir: str,
+                jobs: int,
+                cache: MutableMapping,
+                profile: RunProfile,
+                export_dir: Optional[str] = None,
+                export_formats: Sequence[str] = ('csv', 'jsonl')) -> Sequence[Path]:
+    """
+    Generate the report for each of the given configs, writing them to output_dir as <config>-<type>-<date>.eml,
+    and their tables, if export_dir is given, to a subdirectory of it named after the config.
+    The source data of all reports is fetched first, each distinct source only once, and then the reports are
+    generated. Both run on the same pool of `jobs` threads. The cache should be a FetchCache, so that reports don't
+    fetch the same data concurrently.
+    """
+    reports = [
+        report_types[report_type](path,
+                                  date,
+                                  cache=cache,
+                                  profile=profile,
+                                  export_dir=None if export_dir is None else str(Path(export_dir) / Path(path).stem),
+                                  export_formats=export_formats)
+        for path in config_paths
+    ]
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        with profile.phase('prefetch'):
+            plan = plan_fetches(reports, [date])
+            profile.count_call('planned_fetches', sum(len(report.fetchPlan([date])) for report in reports))
+            profile.count_call('distinct_fetches', len(plan))
+            for future in concurrent.futures.as_completed([executor.submit(fetch) for fetch in plan.values()]):
+                future.result()
+        emails = executor.map(lambda report: report.generateBetterReport(), reports)
+        paths = []
+        for config_path, email in zip(config_paths, emails):
+            path = Path(output_dir) / f'{Path(config_path).stem}-{report_type}-{date.isoformat()}.eml'
+            path.write_text(email)
+            paths.append(path)
+    return paths
+
+
 if __name__ == '__main__':
     # https://youtrack.jetbrains.com/issue/PY-41806
     # noinspection PyTypeChecker
@@ -935,23 +1967,221 @@ if __name__ == '__main__':
                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     date_format = '%Y-%m-%d'
     parser.add_argument('report_type',
-                        choices=report_types.keys(),
-                        help='Platform to generate a report for.')
+                        choices=[*report_types.keys(), 'all'],
+                        nargs='?',
+                        help='Platform to generate a report for, or all to generate the reports of all platforms in '
+                             'parallel, written to --output-dir. Required unless --serve is given.')
     parser.add_argument('report_date',
-                        default=(datetime.datetime.now() - datetime.timedelta(days=1)).strftime(date_format),
+                        default=None,
                         nargs='?',
-                        help='YYYY-MM-DD to generate a report for. Defaults to yesterday.')
+                        help='YYYY-MM-DD to generate a report for. Defaults to the latest date whose billing data has '
+                             'usually landed, yesterday for AWS and the day before for GCP.')
     parser.add_argument('--config',
                         default=Path.cwd() / 'config.json',
                         help='Path to config.json. Default to current directory.')
     parser.add_argument('--terra-workspaces',
                         default=None,
                         help='Path to json file containing Terra workspace information.')
+    parser.add_argument('--from',
+                        dest='from_date',
+                        default=None,
+                        help='YYYY-MM-DD of the first report of a backfill. Requires --to.')
+    parser.add_argument('--to',
+                        dest='to_date',
+                        default=None,
+                        help='YYYY-MM-DD of the last report of a backfill, inclusive. Requires --from.')
+    parser.add_argument('--output-dir',
+                        default=Path.cwd() / 'backfill',
+                        help='Directory to write the .eml of each backfilled or, with --serve, scheduled report to.')
+    parser.add_argument('--jobs',
+                        type=int,
+                        default=os.cpu_count(),
+                        help='Number of processes rendering backfilled reports.')
+    parser.add_argument('--profile-dir',
+                        default=None,
+                        help='Directory to write a JSON run profile and a Prometheus textfile of the report run to.')
+    parser.add_argument('--cprofile-phase',
+                        action='append',
+                        default=[],
+                        help='Phase of the report run to profile with cProfile, e.g. cur_parse or render. '
+                             'Requires --profile-dir. May be repeated.')
+    parser.add_argument('--save-usage-data',
+                        action='store_true',
+                        help='Rewrite the saved usage data of each backfilled month.')
+    parser.add_argument('--serve',
+                        action='store_true',
+                        help='Run as a service that generates the reports given by --schedule every day, and renders '
+                             'reports on demand at http://HOST:PORT/report/<platform>/<YYYY-MM-DD>.')
+    parser.add_argument('--host',
+                        default='127.0.0.1',
+                        help='Address the service listens on.')
+    parser.add_argument('--port',
+                        type=int,
+                        default=8080,
+                        help='Port the service listens on.')
+    parser.add_argument('--schedule',
+                        action='append',
+                        default=[],
+                        help='PLATFORM=HH:MM local time the service generates a report every day, '
+                             'e.g. aws=06:00. May be repeated.')
+    parser.add_argument('--cache-size',
+                        type=int,
+                        default=2048,
+                        help='Maximum estimated size in MiB of the fetched sources, like one month of a CUR, the service '
+                             'keeps. The least recently used sources are forgotten first.')
+    parser.add_argument('--cache-ttl',
+                        type=float,
+                        default=3600,
+                        help='Seconds the service keeps a fetched source for before fetching it again.')
+    parser.add_argument('--mail-command',
+                        default=None,
+                        help='Command the .eml of each scheduled report is piped to, e.g. "/usr/sbin/sendmail -t".')
+    parser.add_argument('--fail-log',
+                        default=None,
+                        help='File the platform and date of each failed scheduled report is appended to.')
+    parser.add_argument('--configs',
+                        nargs='+',
+                        default=None,
+                        help='Config files, or directories of them, to generate the report for, each of them written '
+                             'to --output-dir. Identical requests of different configs are only made once, and '
+                             'all requests are spread over --jobs threads.')
+    parser.add_argument('--export-dir',
+                        default=None,
+                        help='Directory to write the tables the report is rendered from to, as CSV, JSON Lines or '
+                             'Parquet files with amounts in micro-dollars.')
+    parser.add_argument('--export-format',
+                        action='append',
+                        choices=exports.FORMATS,
+                        default=None,
+                        help='Format of the files written to --export-dir. Parquet requires pyarrow. May be repeated. '
+                             'Defaults to csv and jsonl.')
+    parser.add_argument('--run-store',
+                        default=None,
+                        help='Directory to record the fetched data, completed side effects and email of the report '
+                             'run in, so that it can be retried with --resume.')
+    parser.add_argument('--resume',
+                        action='store_true',
+                        help='Continue the latest run of the same report recorded in --run-store: resend its email if '
+                             'it was rendered, or render it from the recorded data, skipping completed side effects.')
+    parser.add_argument('--run-store-keep',
+                        type=int,
+                        default=7,
+                        help='Number of report dates per platform whose runs --run-store keeps. Older runs, and the data '
+                             'only they recorded, are removed after each run.')
+    recording = parser.add_mutually_exclusive_group()
+    recording.add_argument('--record',
+                           default=None,
+                           metavar='DIR',
+                           help='Record the responses of AWS, GCP and Terra to the directory, for --replay.')
+    recording.add_argument('--replay',
+                           default=None,
+                           metavar='DIR',
+                           help='Replay the responses recorded with --record to the directory instead of calling AWS, GCP '
+                                'and Terra. Nothing is uploaded.')
+    parser.add_argument('--replay-latency',
+                        type=float,
+                        default=0.0,
+                        metavar='SECONDS',
+                        help='Seconds each replayed call takes, to simulate the latency of the services.')
     arguments = parser.parse_args()
+    export_formats = arguments.export_format or ('csv', 'jsonl')
+    if arguments.report_date is None:
+        arguments.report_date = report_types.get(arguments.report_type, AWSReport).default_date(datetime.date.today()).strftime(date_format)
 
-    if arguments.report_type == "gcp":
-        arguments.report_date = (datetime.datetime.now() - datetime.timedelta(days=2)).strftime(date_format)
-
-    date = datetime.datetime.strptime(arguments.report_date, date_format).date()
-    report = report_types[arguments.report_type](arguments.config, date)
-    print(report.generateBetterReport())
+    if arguments.record is not None or arguments.replay is not None:
+        from src.recorder import (
+            Recorder,
+        )
+        clients.set_recorder(Recorder(arguments.record or arguments.replay,
+                                      replay=arguments.replay is not None,
+                                      latency=arguments.replay_latency))
+
+    if arguments.serve:
+        from src.report_service import (
+            ReportService,
+            parse_schedule,
+        )
+        schedule = dict(map(parse_schedule, arguments.schedule))
+        if not schedule.keys() <= report_types.keys():
+            parser.error(f'--schedule platforms must be one of {", ".join(report_types)}')
+        service = ReportService(report_types,
+                                arguments.config,
+                                cache=FetchCache(max_bytes=arguments.cache_size * 2 ** 20, ttl=arguments.cache_ttl),
+                                output_dir=arguments.output_dir,
+                                schedule=schedule,
+                                mail_command=arguments.mail_command,
+                                fail_log=arguments.fail_log,
+                                profile_dir=arguments.profile_dir)
+        service.serve(arguments.host, arguments.port)
+    elif arguments.report_type is None:
+        parser.error('report_type is required unless --serve is given')
+    elif (arguments.from_date is None) != (arguments.to_date is None):
+        parser.error('--from and --to must be given together')
+    elif arguments.resume and arguments.run_store is None:
+        parser.error('--resume requires --run-store')
+    elif arguments.report_type == 'all' and not (arguments.configs is None and arguments.from_date is None and arguments.run_store is None):
+        parser.error('all can not be combined with --configs, --from or --run-store')
+    elif arguments.report_type == 'all':
+        today = datetime.date.today()
+        # The given date is that of the AWS report. The GCP report is for its default date, since its data lands later.
+        dates = {'aws': datetime.datetime.strptime(arguments.report_date, date_format).date(),
+                 'gcp': GCPReport.default_date(today)}
+        profile = RunProfile(cprofile_phases=arguments.cprofile_phase,
+                             cprofile_dir=None if arguments.profile_dir is None else str(Path(arguments.profile_dir) / 'all-cprofile'))
+        for path in run_all(arguments.config,
+                            dates,
+                            arguments.output_dir,
+                            profile,
+                            export_dir=arguments.export_dir,
+                            export_formats=export_formats):
+            print(path)
+        if arguments.profile_dir is not None:
+            profile.write(arguments.profile_dir, f'all-{today.isoformat()}', platform='all')
+    elif arguments.configs is not None:
+        date = datetime.datetime.strptime(arguments.report_date, date_format).date()
+        profile = RunProfile()
+        for path in run_tenants(arguments.report_type,
+                                expand_config_paths(arguments.configs),
+                                date,
+                                arguments.output_dir,
+                                arguments.jobs,
+                                # The data of every config is needed until all reports are generated
+                                cache=FetchCache(),
+                                profile=profile,
+                                export_dir=arguments.export_dir,
+                                export_formats=export_formats):
+            print(path)
+        if arguments.profile_dir is not None:
+            profile.write(arguments.profile_dir, f'{arguments.report_type}-{date.isoformat()}', platform=arguments.report_type)
+    elif arguments.from_date is not None:
+        dates = date_range(datetime.datetime.strptime(arguments.from_date, date_format).date(),
+                           datetime.datetime.strptime(arguments.to_date, date_format).date())
+        if not dates:
+            parser.error('--from must not be after --to')
+        for path in backfill(arguments.report_type,
+                             arguments.config,
+                             dates,
+                             arguments.output_dir,
+                             arguments.jobs,
+                             save_usage_data=arguments.save_usage_data):
+            print(path)
+    else:
+        date = datetime.datetime.strptime(arguments.report_date, date_format).date()
+        base = f'{arguments.report_type}-{date.isoformat()}'
+        profile = RunProfile(cprofile_phases=arguments.cprofile_phase,
+                             cprofile_dir=None if arguments.profile_dir is None else str(Path(arguments.profile_dir) / f'{base}-cprofile'))
+        report = report_types[arguments.report_type](arguments.config,
+                                                     date,
+                                                     profile=profile,
+                                                     export_dir=arguments.export_dir,
+                                                     export_formats=export_formats)
+        if arguments.run_store is None:
+            print(report.generateBetterReport())
+        else:
+            store = RunStore(arguments.run_store)
+            try:
+                print(generate_resumable(report, store, resume=arguments.resume))
+            finally:
+                store.prune(arguments.run_store_keep)
+        if arguments.profile_dir is not None:
+            profile.write(arguments.profile_dir, base, platform=arguments.report_type)
@@ -0,0 +1,63 @@
+"""
+Fails if importing the report module is slower than a budget, or loads a cloud SDK or jinja2 before they are used.
+Each report runs in a fresh container, so import time is paid on every run.
+"""
+import argparse
+from pathlib import (
+    Path,
+)
+import subprocess
+import sys
+from typing import (
+    Mapping,
+)
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Top-level packages that only the code paths using them may import
+DEFERRED = ('boto3', 'botocore', 'google', 'jinja2', 'dateutil', 'numpy')
+
+
+def import_times(statement: str) -> Mapping[str, int]:
+    """
+    Return the cumulative import time in microseconds of each module imported by the given statement, as reported by
+    python -X importtime.
+
+    >>> modules = import_times('import report')
+    >>> sorted({module.split('.')[0] for module in modules} & set(DEFERRED))
+    []
+    >>> modules['report'] > 0
+    True
+    """
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                             cwd=str(ROOT),
+                             check=True,
+                             stderr=subprocess.PIPE,
+                             universal_newlines=True)
+    times = {}
+    for line in process.stderr.splitlines():
+        if line.startswith('import time:'):
+            _, cumulative, module = line[len('import time:'):].split('|')
+            # Skip the header line
+            if cumulative.strip().isdigit():
+                times[module.strip()] = int(cumulative)
+    return times
+
+
+def main(budget_ms: float) -> int:
+    times = import_times('import report')
+    deferred = sorted(module for module in times if module.split('.')[0] in DEFERRED)
+    total_ms = times['report'] / 1000
+    print(f'import report: {total_ms:.1f} ms (budget {budget_ms:.1f} ms)')
+    if deferred:
+        print('Imported eagerly: ' + ', '.join(deferred))
+    return 1 if deferred or total_ms > budget_ms else 0
+
+
+if __name__ == '__main__':
+    # noinspection PyTypeChecker
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--budget-ms', type=float, default=150, help='Maximum cumulative import time of report.py.')
+    arguments = parser.parse_args()
+    sys.exit(main(arguments.budget_ms))
@@ -27,26 +27,30 @@ def days_ago(days: int, date: datetime.date) -> bool:
     return (datetime.now().date() - timedelta(days=days)) >= date
 
 
-def aws_report(date: str) -> bytes:
+def run_report(report_type: str, date: str) -> bytes:
+    """
+    Run the report for the given date again, resuming the run recorded by scripts/run-report.sh for that date. If only
+    sending the email failed, the recorded email is returned without fetching or rendering anything. The Terra
+    workspaces are passed like scripts/run-report.sh does, since their path is part of the recorded inputs.
+    """
     report = subprocess.run(['docker', 'run',
                              '-v', '/root/reporting/config.json:/config.json:ro',
+                             '-v', '/root/reporting/terra-workspaces.json:/terra-workspaces.json:ro',
+                             '-v', '/root/reporting/runs/:/runs',
                              'ghcr.io/ucsc-cgp/cloud-billing-report:latest',
-                             'aws', date],
+                             report_type, date, '--terra-workspaces=/terra-workspaces.json', '--run-store=/runs', '--resume'],
                             check=True,
                             shell=False,
                             stdout=subprocess.PIPE)
     return report.stdout
 
 
+def aws_report(date: str) -> bytes:
+    return run_report('aws', date)
+
+
 def gcp_report(date: str) -> bytes:
-    report = subprocess.run(['docker', 'run',
-                             '-v', '/root/reporting/config.json:/config.json:ro',
-                             'ghcr.io/ucsc-cgp/cloud-billing-report:latest',
-                             'gcp', date],
-                            check=True,
-                            shell=False,
-                            stdout=subprocess.PIPE)
-    return report.stdout
+    return run_report('gcp', date)
 
 
 reports = {
@@ -5,10 +5,22 @@ CONFIG=/root/reporting/config.json
 TERRA_WORKSPACES=/root/reporting/terra-workspaces.json
 IMAGE=ghcr.io/ucsc-cgp/cloud-billing-report:latest
 REPORT_TYPE=$1
+# The report is for the latest day whose billing data has usually landed, see DATA_DELAY_DAYS in report.py. The date
+# is passed explicitly so that a failed run is logged, and retried by retry-failed-reports.py, for the same date.
+case ${REPORT_TYPE} in
+  gcp) REPORT_DATE=$(date -d 'today - 2day' +%Y-%m-%d) ;;
+  *) REPORT_DATE=$(date -d 'today - 1day' +%Y-%m-%d) ;;
+esac
 FAIL_LOG=/root/reporting/fail.log
 AWS_PROFILE="fill me in"
 EMAIL_TMP_FILE=/tmp/${REPORT_TYPE}.eml
 PERSONALIZED_EMAIL_DIR=/tmp/personalizedEmails
+# Run profiles (JSON and a Prometheus textfile) are written next to the .eml
+PROFILE_DIR=/tmp
+# Day-partitioned billing history, see "history" in config.json. It must be mounted at the configured path.
+HISTORY_DIR=/root/reporting/history
+# Fetched data, completed side effects and emails of each run, so scripts/retry-failed-reports.py can resume it
+RUN_STORE_DIR=/root/reporting/runs
 
 echo "Running container"
 
@@ -21,8 +33,11 @@ echo "Running container"
   -v ~/.aws/credentials:/root/.aws/credentials:ro \
   -e AWS_PROFILE=${AWS_PROFILE} \
   -v ${PERSONALIZED_EMAIL_DIR}/:/tmp/personalizedEmails \
-  ${IMAGE} ${REPORT_TYPE} --terra-workspaces=/terra-workspaces.json > ${EMAIL_TMP_FILE} && \
-  /usr/sbin/sendmail -t < ${EMAIL_TMP_FILE}) || echo "${REPORT_TYPE},$(date -d 'today - 1day' +%Y-%m-%d)" >> ${FAIL_LOG}
+  -v ${PROFILE_DIR}/:/profiles \
+  -v ${HISTORY_DIR}/:/history \
+  -v ${RUN_STORE_DIR}/:/runs \
+  ${IMAGE} ${REPORT_TYPE} ${REPORT_DATE} --terra-workspaces=/terra-workspaces.json --profile-dir=/profiles --run-store=/runs > ${EMAIL_TMP_FILE} && \
+  /usr/sbin/sendmail -t < ${EMAIL_TMP_FILE}) || echo "${REPORT_TYPE},${REPORT_DATE}" >> ${FAIL_LOG}
 
 sleep 5
 
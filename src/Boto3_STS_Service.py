@@ -1,13 +1,17 @@
 import boto3
 import os
 
+from src import (
+    clients,
+)
+
 
 class Boto3_STS_Service(object):
     def __init__(self):
-        self.session = boto3.session.Session(
-            profile_name=os.environ["AWS_PROFILE"]
-        )
-        self.sts_connection = self.session.client("sts")
+        self.sts_connection = clients.external("sts",
+                                               lambda: boto3.session.Session(profile_name=os.environ["AWS_PROFILE"]).client("sts"),
+                                               scope=os.environ.get("AWS_PROFILE"))
+        self.role_arn = None
 
         self.assume_role_object = None
         self.assume_role_credentials = None
@@ -23,6 +27,7 @@ class Boto3_STS_Service(object):
 
         # Get credentials for the assumed role
         self.assume_role_credentials = self.assume_role_object['Credentials']
+        self.role_arn = role_arn
 
     def get_boto3_session(self, region: str, client_type: str):
         # Ensure we have assumed a role (this doesn't check that the session hasn't timed out)
@@ -35,10 +40,12 @@ class Boto3_STS_Service(object):
         security_token = tmp_credentials["SessionToken"]
 
         # Start a config client
-        self.assume_role_client = boto3.client(client_type,
-                                         aws_access_key_id=tmp_access_key,
-                                         aws_secret_access_key=tmp_secret_key,
-                                         aws_session_token=security_token,
-                                         region_name=region)
+        self.assume_role_client = clients.external(client_type,
+                                                   lambda: boto3.client(client_type,
+                                                                        aws_access_key_id=tmp_access_key,
+                                                                        aws_secret_access_key=tmp_secret_key,
+                                                                        aws_session_token=security_token,
+                                                                        region_name=region),
+                                                   scope=(self.role_arn, region))
 
         return self.assume_role_client
@@ -0,0 +1,81 @@
+"""
+Flags daily costs that are far above the recent spend of the same account or project and service.
+
+The baseline of each series is the median of its daily costs over a trailing window, and its spread is the median
+absolute deviation (MAD) from that baseline, both of which are robust to the occasional spike in the window itself.
+All series are scored at once as rows of one NumPy matrix.
+"""
+import datetime
+import itertools
+from typing import (
+    Hashable,
+    Mapping,
+    NamedTuple,
+)
+
+from src import (
+    money,
+)
+
+# Scales the MAD to the standard deviation of normally distributed costs
+MAD_SCALE = 1.4826
+
+
+class Anomaly(NamedTuple):
+    amount: int
+    baseline: int
+    score: float
+
+    @property
+    def description(self) -> str:
+        """
+        >>> Anomaly(amount=5000000, baseline=1000000, score=12.5).description
+        'usually $1.00 a day, 12.5 MADs above'
+        """
+        return f'usually {money.format_amount(self.baseline)} a day, {self.score:.1f} MADs above'
+
+
+def detect(daily_costs: Mapping[Hashable, Mapping[datetime.date, int]],
+           date: datetime.date,
+           window: int = 28,
+           threshold: float = 5.0,
+           min_increase: int = 10 * money.DOLLAR,
+           min_spread: int = money.DOLLAR) -> Mapping[Hashable, Anomaly]:
+    """
+    Score the cost of each series on the given date against the median and MAD of its costs on the `window` days
+    before it. Days without a cost count as zero. A cost is flagged if it exceeds the baseline by more than
+    `threshold` spreads and by at least `min_increase` micro-dollars. The spread is at least `min_spread`, so that
+    series that barely vary aren't flagged for cents.
+
+    >>> start = datetime.date(2020, 10, 1)
+    >>> days = [start + datetime.timedelta(offset) for offset in range(29)]
+    >>> steady = {day: 10 * money.DOLLAR + offset * money.CENT for offset, day in enumerate(days)}
+    >>> spike = dict(steady)
+    >>> spike[days[-1]] = 200 * money.DOLLAR
+    >>> anomalies = detect({'steady': steady, 'spike': spike, 'new': {days[-1]: 50 * money.DOLLAR}}, days[-1])
+    >>> sorted(anomalies)
+    ['new', 'spike']
+    >>> anomalies['spike'].amount, anomalies['spike'].baseline
+    (200000000, 10135000)
+    >>> detect({}, days[-1])
+    {}
+    """
+    if not daily_costs:
+        return {}
+    import numpy as np
+    keys = list(daily_costs)
+    days = [date - datetime.timedelta(offset) for offset in range(window, -1, -1)]
+    zeros = [0] * len(days)
+    costs = np.fromiter(itertools.chain.from_iterable(map(series.get, days, zeros) for series in daily_costs.values()),
+                        dtype=np.int64,
+                        count=len(keys) * len(days)).reshape(len(keys), len(days))
+    history, today = costs[:, :-1], costs[:, -1]
+    baseline = np.median(history, axis=1)
+    spread = np.maximum(MAD_SCALE * np.median(np.abs(history - baseline[:, np.newaxis]), axis=1), min_spread)
+    increase = today - baseline
+    score = increase / spread
+    flagged = np.flatnonzero((score > threshold) & (increase >= min_increase))
+    return {
+        keys[i]: Anomaly(amount=int(today[i]), baseline=int(baseline[i]), score=float(score[i]))
+        for i in flagged
+    }
@@ -0,0 +1,77 @@
+"""
+Cloud clients shared by all reports in a process, so that a long-running process constructs each client only once.
+
+All clients of external services are created here, so that their calls can be recorded and replayed, see
+src/recorder.py.
+"""
+import threading
+from typing import (
+    Any,
+    Callable,
+    Hashable,
+    Optional,
+)
+
+_clients = {}
+_lock = threading.Lock()
+
+# Records or replays the calls of all clients created after it is set
+_recorder = None
+
+
+def set_recorder(recorder) -> None:
+    global _recorder
+    with _lock:
+        _recorder = recorder
+        _clients.clear()
+
+
+def external(service: str, create: Callable[[], Any], scope: Hashable = None) -> Any:
+    """Return the client that create() returns, or, with a recorder set, a proxy that records or replays its calls."""
+    return create() if _recorder is None else _recorder.client(service, create, scope)
+
+
+def external_call(service: str, method: str, function: Callable, *args) -> Any:
+    """Call the function, or, with a recorder set, record or replay the call."""
+    return function(*args) if _recorder is None else _recorder.call(service, method, function, *args)
+
+
+def aws_client(service: str,
+               access_key: Optional[str] = None,
+               secret_key: Optional[str] = None,
+               endpoint_url: Optional[str] = None) -> Any:
+    """
+    Return the boto3 client of the given service and credentials. boto3 clients are thread safe once constructed, but
+    constructing them from the default session is not, so that is serialized.
+    """
+    key = ('aws', service, access_key, secret_key, endpoint_url)
+    with _lock:
+        try:
+            return _clients[key]
+        except KeyError:
+            def create():
+                import boto3
+                return boto3.session.Session().client(service,
+                                                      aws_access_key_id=access_key,
+                                                      aws_secret_access_key=secret_key,
+                                                      endpoint_url=endpoint_url)
+
+            # The access key identifies the account, the secret key isn't needed to tell calls apart
+            client = _clients[key] = external(service, create, scope=(access_key, endpoint_url))
+            return client
+
+
+def bigquery_client() -> Any:
+    """Return a BigQuery client using the application default credentials."""
+    with _lock:
+        try:
+            return _clients[('bigquery',)]
+        except KeyError:
+            def create():
+                from google.cloud import (
+                    bigquery,
+                )
+                return bigquery.Client()
+
+            client = _clients[('bigquery',)] = external('bigquery', create)
+            return client
@@ -1,9 +1,14 @@
 from src.report_resource import report_resource
 
+# The CUR products of the resource types the scan queries for, which are only scanned for in the accounts and regions
+# the CUR bills these products in
+SCANNED_PRODUCTS = frozenset({"Amazon Elastic Compute Cloud", "Amazon Simple Storage Service"})
+
 
 class compliance_report():
-    def __init__(self):
-        return
+    def __init__(self, profile=None):
+        # Optional src.run_profile.RunProfile counting the requests made by the scan
+        self.profile = profile
 
     # It's really silly that I have to do this. The boto3 call should return the resource type
     # in the response dict, especially because I provide a list of resource types in the first place
@@ -33,6 +38,8 @@ class compliance_report():
 
         resource_object_list = []
         for page in resource_response_dict:  # for every page
+            if self.profile is not None:
+                self.profile.count_call('resourcegroupstaggingapi')
             for resource_dict in page["ResourceTagMappingList"]:  # for every resource on that page
                 resource_arn = resource_dict["ResourceARN"]  # get the ARN associated with the resource
                 resource = report_resource(resource_arn,
@@ -52,7 +59,10 @@ class compliance_report():
 
         return resource_object_list
 
-    def generate_full_compliance_report(self, boto3_sts_service_object, account_id_list, account_name_list, arn_list, region_list):
+    # With active_regions, a set of (account ID, region) pairs, only those regions of each account are scanned, and
+    # accounts without any are skipped without assuming their role
+    def generate_full_compliance_report(self, boto3_sts_service_object, account_id_list, account_name_list, arn_list, region_list,
+                                        active_regions=None):
         # There should be a 1:1 ratio of ARNs to accounts
         assert len(account_id_list) == len(account_name_list)
         assert len(account_name_list) == len(arn_list)
@@ -67,12 +77,19 @@ class compliance_report():
             account_id = account_id_list[i]
             account_name = account_name_list[i]
             arn = arn_list[i]
+            regions = [region for region in region_list if active_regions is None or (account_id, region) in active_regions]
+            if self.profile is not None:
+                self.profile.count_call('compliance_regions_skipped', len(region_list) - len(regions))
+            if not regions:
+                continue
 
             # assume the IAM role associated with this account
             boto3_sts_service_object.assume_new_role(arn)
+            if self.profile is not None:
+                self.profile.count_call('sts')
 
             # for every region we want to query, get all
-            for region in region_list:
+            for region in regions:
                 full_resource_list += self.get_resource_by_tags(boto3_sts_service_object, account_id, account_name, region)
 
         return full_resource_list
@@ -0,0 +1,202 @@
+"""
+The result of a compliance tag scan, kept between runs so that a run can tell which resources and owners changed.
+"""
+import datetime
+import gzip
+import hashlib
+import json
+import operator
+from pathlib import (
+    Path,
+)
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+)
+
+from src.report_resource import (
+    report_resource,
+)
+
+
+def digest(value: Any) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, separators=(',', ':')).encode()).hexdigest()[:16]
+
+
+def partition_key(account_id: str, region: str) -> str:
+    return f'{account_id}/{region}'
+
+
+def resource_record(resource: report_resource) -> Mapping[str, Any]:
+    """
+    Return what a scan found out about a src.report_resource.report_resource, and a digest of it.
+
+    >>> resource = report_resource('arn:aws:s3:::bucket', 's3:bucket', '1', 'one', 'us-west-2')
+    >>> resource.add_tag_value('Owner', 'someone@ucsc.edu'); resource.set_compliance_status()
+    >>> resource_record(resource)
+    {'arn': 'arn:aws:s3:::bucket', 'type': 's3:bucket', 'account_name': 'one', 'status': 'COMPLIANT', \
+'email': 'someone@ucsc.edu', 'tags': {'Owner': 'someone@ucsc.edu'}, 'digest': 'b13b67ad8700f0e2'}
+    """
+    record = {
+        'arn': resource.resource_arn,
+        'type': resource.resource_type,
+        'account_name': resource.account_name,
+        'status': resource.compliance_status,
+        'email': resource.email,
+        'tags': {tag: value for tag, value in resource.tag_status.items() if value is not None}
+    }
+    record['digest'] = digest(record)
+    return record
+
+
+class ComplianceDelta(NamedTuple):
+    added: Sequence[Mapping[str, Any]]
+    removed: Sequence[Mapping[str, Any]]
+    # The current records of resources whose tags or status changed
+    changed: Sequence[Mapping[str, Any]]
+    # The previous records of those resources
+    changed_from: Sequence[Mapping[str, Any]]
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+
+class ComplianceSnapshot:
+    """
+    The records of the scanned resources, by account and region, and then by ARN. Each account and region also has a
+    digest of all its records, so unchanged ones are compared in one step.
+
+    >>> def record(arn, email, status='COMPLIANT'):
+    ...     value = {'arn': arn, 'email': email, 'status': status}
+    ...     return dict(value, digest=digest(value))
+    >>> old = ComplianceSnapshot({'1/us-west-2': [record('a', 'x@ucsc.edu'), record('b', 'y@ucsc.edu')],
+    ...                           '2/us-west-2': [record('c', 'z@ucsc.edu')]},
+    ...                          owner_costs={'x@ucsc.edu': 100, 'z@ucsc.edu': 5000})
+    >>> new = ComplianceSnapshot({'1/us-west-2': [record('a', 'x@ucsc.edu'), record('b', 'w@ucsc.edu'), record('d', None)],
+    ...                           '2/us-west-2': [record('c', 'z@ucsc.edu')]},
+    ...                          owner_costs={'x@ucsc.edu': 100, 'z@ucsc.edu': 9000})
+    >>> delta = new.diff(old)
+    >>> [r['arn'] for r in delta.added], [r['arn'] for r in delta.removed], [r['arn'] for r in delta.changed]
+    (['d'], [], ['b'])
+    >>> sorted(new.changed_owners(old, cost_threshold=1000))
+    ['w@ucsc.edu', 'y@ucsc.edu', 'z@ucsc.edu']
+    >>> sorted(new.changed_owners(old, cost_threshold=10000))
+    ['w@ucsc.edu', 'y@ucsc.edu']
+
+    >>> import tempfile
+    >>> path = Path(tempfile.mkdtemp()) / 'snapshot.json.gz'
+    >>> new.full_scan_date = datetime.date(2020, 10, 1)
+    >>> new.save(path)
+    >>> bool(ComplianceSnapshot.load(path).diff(new)), ComplianceSnapshot.load(path).full_scan_date
+    (False, datetime.date(2020, 10, 1))
+    >>> ComplianceSnapshot.load(path.with_name('missing.json.gz')) is None
+    True
+    """
+
+    def __init__(self,
+                 partitions: Mapping[str, Iterable[Mapping[str, Any]]],
+                 owner_costs: Optional[Mapping[str, int]] = None,
+                 full_scan_date: Optional[datetime.date] = None):
+        self.partitions = {key: {record['arn']: record for record in records} for key, records in partitions.items()}
+        self.partition_digests = {key: digest(sorted(record['digest'] for record in records.values()))
+                                  for key, records in self.partitions.items()}
+        # Month-to-date cost of the resources of each owner, in micro-dollars
+        self.owner_costs = {} if owner_costs is None else dict(owner_costs)
+        # The date of the latest scan of all accounts and regions, whose resources the partitions of any regions
+        # skipped since were carried forward from
+        self.full_scan_date = full_scan_date
+
+    @classmethod
+    def from_resources(cls,
+                       resources: Iterable[report_resource],
+                       owner_costs: Optional[Mapping[str, int]] = None,
+                       full_scan_date: Optional[datetime.date] = None) -> 'ComplianceSnapshot':
+        partitions = {}
+        for resource in resources:
+            partitions.setdefault(partition_key(resource.account_id, resource.region), []).append(resource_record(resource))
+        return cls(partitions, owner_costs, full_scan_date)
+
+    def resources(self, account_id: str, region: str) -> List[report_resource]:
+        """
+        Return the resources recorded for the given account and region, as the scan found them.
+
+        >>> resource = report_resource('arn:aws:s3:::bucket', 's3:bucket', '1', 'one', 'us-west-2')
+        >>> resource.add_tag_value('Owner', 'someone@ucsc.edu'); resource.set_compliance_status()
+        >>> snapshot = ComplianceSnapshot.from_resources([resource])
+        >>> [resource_record(r) == resource_record(resource) for r in snapshot.resources('1', 'us-west-2')]
+        [True]
+        >>> snapshot.resources('1', 'us-east-1')
+        []
+        """
+        resources = []
+        for record in self.partitions.get(partition_key(account_id, region), {}).values():
+            resource = report_resource(record['arn'], record['type'], account_id, record['account_name'], region)
+            for tag, value in record['tags'].items():
+                resource.add_tag_value(tag, value)
+            resource.set_compliance_status(record['status'])
+            resources.append(resource)
+        return resources
+
+    def diff(self, previous: 'ComplianceSnapshot') -> ComplianceDelta:
+        added, removed, changed, changed_from = [], [], [], []
+        for key in self.partitions.keys() | previous.partitions.keys():
+            if self.partition_digests.get(key) == previous.partition_digests.get(key):
+                continue
+            current, old = self.partitions.get(key, {}), previous.partitions.get(key, {})
+            added.extend(current[arn] for arn in current.keys() - old.keys())
+            removed.extend(old[arn] for arn in old.keys() - current.keys())
+            for arn in current.keys() & old.keys():
+                if current[arn]['digest'] != old[arn]['digest']:
+                    changed.append(current[arn])
+                    changed_from.append(old[arn])
+        return ComplianceDelta(added, removed, changed, changed_from)
+
+    def changed_owners(self,
+                       previous: 'ComplianceSnapshot',
+                       cost_threshold: int,
+                       owner: Callable[[Mapping[str, Any]], Optional[str]] = operator.itemgetter('email')) -> Set[str]:
+        """
+        Return the owners of resources that were added, removed or changed since the previous snapshot, including
+        the previous owners of changed resources, and the owners whose cost changed by more than the threshold, in
+        micro-dollars. By default, the owner of a record is its email. Records without an owner are ignored.
+        """
+        delta = self.diff(previous)
+        owners = {owner(record) for records in delta for record in records} - {None}
+        for email in self.owner_costs.keys() | previous.owner_costs.keys():
+            if abs(self.owner_costs.get(email, 0) - previous.owner_costs.get(email, 0)) > cost_threshold:
+                owners.add(email)
+        return owners
+
+    def to_json(self) -> Mapping[str, Any]:
+        return {
+            'partitions': {key: list(records.values()) for key, records in self.partitions.items()},
+            'owner_costs': self.owner_costs,
+            'full_scan_date': None if self.full_scan_date is None else self.full_scan_date.isoformat()
+        }
+
+    def save(self, path: Path) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + '.tmp')
+        tmp.write_bytes(gzip.compress(json.dumps(self.to_json()).encode()))
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional['ComplianceSnapshot']:
+        """Return the snapshot saved at the given path, or None if there is none."""
+        try:
+            content = json.loads(gzip.decompress(Path(path).read_bytes()))
+        except FileNotFoundError:
+            return None
+        # Snapshots saved before regions were skipped were all of full scans, but of an unknown date
+        full_scan_date = content.get('full_scan_date')
+        return cls(content['partitions'],
+                   content['owner_costs'],
+                   None if full_scan_date is None else datetime.date.fromisoformat(full_scan_date))
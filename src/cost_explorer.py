@@ -0,0 +1,194 @@
+"""
+Requests Cost Explorer results completely, within a rate that adapts to throttling and a budget of requests per run.
+
+Every Cost Explorer request is billed, and the API throttles callers that exceed its request rate, which is shared
+by all reports using the same credentials. Requests therefore go through a rate limiter shared by all clients of the
+same credentials in a process. The limiter spaces requests further apart whenever one is throttled, and closer
+again as requests succeed, while throttled requests are retried after an exponential backoff with full jitter.
+"""
+import random
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    Hashable,
+    List,
+    Mapping,
+    Optional,
+)
+
+# Error codes of throttled requests
+THROTTLING_ERRORS = frozenset({
+    'LimitExceededException',
+    'RequestLimitExceeded',
+    'Throttling',
+    'ThrottlingException',
+    'TooManyRequestsException',
+})
+
+
+class RequestBudgetExceeded(RuntimeError):
+    pass
+
+
+def is_throttling(error: Exception) -> bool:
+    """
+    >>> class ClientError(Exception):
+    ...     response = {'Error': {'Code': 'LimitExceededException'}}
+    >>> is_throttling(ClientError()), is_throttling(ValueError())
+    (True, False)
+    """
+    response = getattr(error, 'response', None)
+    return isinstance(response, Mapping) and response.get('Error', {}).get('Code') in THROTTLING_ERRORS
+
+
+class AdaptiveRateLimiter:
+    """
+    Spaces requests at least `interval` seconds apart. The interval doubles when a request is throttled, up to
+    max_interval, and shrinks by a tenth with every successful request, down to min_interval.
+
+    >>> now = [0.0]
+    >>> limiter = AdaptiveRateLimiter(min_interval=0.2, clock=lambda: now[0], sleep=lambda s: now.__setitem__(0, now[0] + s))
+    >>> limiter.acquire(); limiter.acquire(); now[0]
+    0.2
+    >>> limiter.throttled(); limiter.interval
+    0.4
+    >>> limiter.succeeded(); round(limiter.interval, 2)
+    0.36
+    """
+
+    def __init__(self,
+                 min_interval: float = 0.2,
+                 max_interval: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.clock = clock
+        self.sleep = sleep
+        self._next = None
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Wait until the next request may be made."""
+        with self._lock:
+            now = self.clock()
+            start = now if self._next is None else max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            self.sleep(start - now)
+
+    def throttled(self) -> None:
+        with self._lock:
+            self.interval = min(self.interval * 2, self.max_interval)
+
+    def succeeded(self) -> None:
+        with self._lock:
+            self.interval = max(self.interval * 0.9, self.min_interval)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def rate_limiter(key: Hashable) -> AdaptiveRateLimiter:
+    """Return the rate limiter shared by all requests made with the credentials identified by the key."""
+    with _limiters_lock:
+        try:
+            return _limiters[key]
+        except KeyError:
+            limiter = _limiters[key] = AdaptiveRateLimiter()
+            return limiter
+
+
+class CostExplorerClient:
+    """
+    Wraps a boto3 Cost Explorer client for the requests of one report run.
+
+    >>> class ClientError(Exception):
+    ...     response = {'Error': {'Code': 'LimitExceededException'}}
+    >>> class FakeCostExplorer:
+    ...     def __init__(self):
+    ...         self.calls = 0
+    ...     def get_cost_and_usage(self, **request):
+    ...         self.calls += 1
+    ...         if self.calls == 2:
+    ...             raise ClientError()
+    ...         page = {'ResultsByTime': [request.get('NextPageToken', 'first')]}
+    ...         return dict(page, NextPageToken='second') if 'NextPageToken' not in request else page
+    >>> sleeps = []
+    >>> limiter = AdaptiveRateLimiter(min_interval=0, sleep=sleeps.append)
+    >>> client = CostExplorerClient(FakeCostExplorer(), limiter, max_requests=3, sleep=sleeps.append, jitter=lambda: 0.5)
+    >>> client.get_cost_and_usage(Granularity='DAILY'), client.requests, client.throttled, sleeps
+    (['first', 'second'], 3, 1, [0.25])
+    >>> try:
+    ...     client.get_cost_and_usage(Granularity='DAILY')
+    ... except RequestBudgetExceeded as e:
+    ...     print(e)
+    Cost Explorer request budget of 3 requests per run exceeded
+    """
+
+    def __init__(self,
+                 client: Any,
+                 limiter: AdaptiveRateLimiter,
+                 max_requests: Optional[int] = None,
+                 max_retries: int = 8,
+                 base_backoff: float = 0.5,
+                 max_backoff: float = 20.0,
+                 profile=None,
+                 sleep: Callable[[float], None] = time.sleep,
+                 jitter: Callable[[], float] = random.random):
+        self.client = client
+        self.limiter = limiter
+        # Requests, including retries, this client may make, or None for no limit
+        self.max_requests = max_requests
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.profile = profile
+        self.sleep = sleep
+        self.jitter = jitter
+        self.requests = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def _count_request(self) -> None:
+        with self._lock:
+            if self.max_requests is not None and self.requests >= self.max_requests:
+                raise RequestBudgetExceeded(f'Cost Explorer request budget of {self.max_requests} requests per run exceeded')
+            self.requests += 1
+        if self.profile is not None:
+            self.profile.count_call('ce')
+
+    def request(self, **request) -> Mapping[str, Any]:
+        """Make a single get_cost_and_usage request, retrying it while it is throttled."""
+        for attempt in range(self.max_retries + 1):
+            self._count_request()
+            self.limiter.acquire()
+            try:
+                response = self.client.get_cost_and_usage(**request)
+            except Exception as e:
+                if not is_throttling(e) or attempt == self.max_retries:
+                    raise
+                self.limiter.throttled()
+                with self._lock:
+                    self.throttled += 1
+                if self.profile is not None:
+                    self.profile.count_call('ce_throttled')
+                self.sleep(self.jitter() * min(self.max_backoff, self.base_backoff * 2 ** attempt))
+            else:
+                self.limiter.succeeded()
+                return response
+
+    def get_cost_and_usage(self, **request) -> List[Mapping[str, Any]]:
+        """Return the ResultsByTime of all pages of the results of the request."""
+        request = dict(request)
+        resultsByTime = []
+        while True:
+            response = self.request(**request)
+            resultsByTime.extend(response['ResultsByTime'])
+            if 'NextPageToken' not in response:
+                return resultsByTime
+            request['NextPageToken'] = response['NextPageToken']
@@ -0,0 +1,187 @@
+"""
+The GCP report's month-to-date and same-day costs, rolled up by project, owner and service, without the rows that
+cost less than the report's cutoff.
+
+The rollup is computed by BigQuery in a single query over the billing export tables, so the number of rows fetched
+depends on the number of rows displayed rather than on the number of projects and services billed. rollup() computes
+the same from daily rows in Python, to stand in for BigQuery where it isn't available, like in the benchmarks.
+Amounts are integer micro-dollars, see src.money.
+"""
+from typing import (
+    Any,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+)
+
+from src import (
+    money,
+)
+
+# The columns each level of the rollup is grouped by. A project has only one owner, and the rows of a project also
+# carry its name.
+LEVELS = {
+    'project': ('id', 'created_by'),
+    'project_service': ('id', 'created_by', 'description'),
+    'owner': ('created_by',),
+    'owner_service': ('created_by', 'description'),
+    'service': ('description',),
+    'total': (),
+}
+
+COLUMNS = ('level', 'id', 'name', 'created_by', 'description', 'cost_month', 'cost_today')
+
+
+def query(tables: Sequence[str]) -> str:
+    """
+    Return the query of the rollup of the given billing export tables. The query takes the parameters invoice_month,
+    like '202010', date, the report date, cutoff, in dollars, or NULL for none, and workspaces, an array of the
+    project_id and created_by of each Terra workspace.
+    """
+    costs = '\n              UNION ALL\n'.join(f'''              SELECT
+                project.id AS id,
+                project.name AS name,
+                service.description AS description,
+                DATE(usage_start_time) AS usage_date,
+                cost + IFNULL(creds.amount, 0) AS cost
+              FROM `{table}`
+              LEFT JOIN UNNEST(credits) AS creds
+              WHERE invoice.month = @invoice_month''' for table in tables)
+    # noinspection SqlNoDataSourceInspection
+    return f'''WITH costs AS (
+{costs}
+            ), owned AS (
+              SELECT costs.*, IFNULL(workspace.created_by, 'Unowned') AS created_by
+              FROM costs
+              LEFT JOIN UNNEST(@workspaces) AS workspace ON workspace.project_id = costs.id
+            )
+            SELECT
+              CASE
+                WHEN GROUPING(id) = 0 AND GROUPING(description) = 0 THEN 'project_service'
+                WHEN GROUPING(id) = 0 THEN 'project'
+                WHEN GROUPING(created_by) = 0 AND GROUPING(description) = 0 THEN 'owner_service'
+                WHEN GROUPING(created_by) = 0 THEN 'owner'
+                WHEN GROUPING(description) = 0 THEN 'service'
+                ELSE 'total'
+              END AS level,
+              id,
+              ANY_VALUE(name) AS name,
+              created_by,
+              description,
+              SUM(IF(usage_date <= @date, cost, 0)) AS cost_month,
+              SUM(IF(usage_date = @date, cost, 0)) AS cost_today
+            FROM owned
+            GROUP BY GROUPING SETS (
+              (id, created_by, description),
+              (id, created_by),
+              (created_by, description),
+              (created_by),
+              (description),
+              ()
+            )
+            HAVING level = 'total' OR @cutoff IS NULL OR cost_month >= @cutoff'''
+
+
+def from_query_rows(rows: Iterable[Mapping[str, Any]]) -> 'CostRollup':
+    """
+    Return the rollup of the rows of the query, whose costs are in dollars.
+
+    >>> costs = from_query_rows([{'level': 'total', 'id': None, 'name': None, 'created_by': None, 'description': None,
+    ...                           'cost_month': None, 'cost_today': None}])
+    >>> costs.total['cost_month'], costs.rows('project')
+    (0, [])
+    """
+    # The sums over no rows at all are NULL
+    return CostRollup([
+        dict(row, cost_month=money.from_dollars(row['cost_month'] or 0), cost_today=money.from_dollars(row['cost_today'] or 0))
+        for row in rows
+    ])
+
+
+def rollup(rows: Iterable[Mapping[str, Any]], cutoff: Optional[int]) -> 'CostRollup':
+    """
+    Return the rollup of the month-to-date and same-day costs of each project and service, as returned by
+    GCPReport.doQuery, like the query does.
+
+    >>> def row(id, owner, service, cost_month, cost_today=0):
+    ...     return {'id': id, 'name': id.upper(), 'created_by': owner, 'description': service,
+    ...             'cost_month': cost_month, 'cost_today': cost_today}
+    >>> costs = rollup([row('a', 'x@ucsc.edu', 'Compute', 3 * money.DOLLAR, money.DOLLAR),
+    ...                 row('a', 'x@ucsc.edu', 'Storage', money.CENT),
+    ...                 row('b', 'Unowned', 'Compute', 2 * money.CENT)], cutoff=money.DOLLAR)
+    >>> [(r['id'], r['name'], r['cost_month']) for r in costs.rows('project')]
+    [('a', 'A', 3010000)]
+    >>> [r['description'] for r in costs.rows('project_service', id='a')]
+    ['Compute']
+    >>> costs.total['cost_month'], costs.total['cost_today'], costs.remainder('project')
+    (3030000, 1000000, {'cost_month': 20000, 'cost_today': 0})
+
+    Without a cutoff, nothing is left out:
+
+    >>> costs = rollup([row('b', 'Unowned', 'Compute', money.CENT)], cutoff=None)
+    >>> [r['id'] for r in costs.rows('project')], costs.remainder('project')
+    (['b'], None)
+    """
+    totals = {}
+    for row in rows:
+        for level, columns in LEVELS.items():
+            key = (level, *(row[column] for column in columns))
+            total = totals.get(key)
+            if total is None:
+                total = totals[key] = {
+                    'level': level,
+                    **{column: row[column] if column in columns else None for column in COLUMNS[1:5]},
+                    'cost_month': 0,
+                    'cost_today': 0
+                }
+            if 'id' in columns and total['name'] is None:
+                total['name'] = row['name']
+            total['cost_month'] += row['cost_month']
+            total['cost_today'] += row['cost_today']
+    return CostRollup([
+        total for total in totals.values()
+        if total['level'] == 'total' or cutoff is None or total['cost_month'] >= cutoff
+    ])
+
+
+def sort_key(value: Any) -> tuple:
+    # Like report.sort_by, case-insensitive, with missing values last
+    return (value is None, value.lower() if isinstance(value, str) else '' if value is None else value)
+
+
+class CostRollup:
+    """
+    The rows of each level of the rollup, each ordered by month-to-date cost, most expensive first.
+    """
+
+    def __init__(self, rows: Iterable[Mapping[str, Any]]):
+        self.levels = {level: [] for level in LEVELS}
+        for row in rows:
+            self.levels[row['level']].append(row)
+        if not self.levels['total']:
+            self.levels['total'].append({'level': 'total', **dict.fromkeys(COLUMNS[1:5]), 'cost_month': 0, 'cost_today': 0})
+        for level, columns in LEVELS.items():
+            rows = sorted(self.levels[level], key=lambda row: [sort_key(row[column]) for column in columns])
+            self.levels[level] = sorted(rows, key=lambda row: row['cost_month'], reverse=True)
+
+    def rows(self, level: str, **conditions) -> List[Mapping[str, Any]]:
+        """Return the rows of the given level, whose columns have the given values."""
+        return [row for row in self.levels[level] if all(row[column] == value for column, value in conditions.items())]
+
+    @property
+    def total(self) -> Mapping[str, Any]:
+        return self.levels['total'][0]
+
+    def remainder(self, level: str) -> Optional[Mapping[str, int]]:
+        """
+        Return the costs of the rows of the given level that were left out for costing less than the cutoff, or None if
+        they add up to less than a cent.
+        """
+        remainder = {
+            cost: self.total[cost] - sum(row[cost] for row in self.levels[level])
+            for cost in ('cost_month', 'cost_today')
+        }
+        # Amounts summed by BigQuery differ from the sum of the rounded amounts of its rows by a few micro-dollars
+        return remainder if any(abs(amount) >= money.CENT for amount in remainder.values()) else None
@@ -0,0 +1,144 @@
+"""
+Reads the line items of a Cost and Usage Report delivered as Parquet, as rows keyed like those of a CSV CUR.
+
+Only the columns the reports use are read, and line items that are never reported on are filtered out while reading,
+so most of each file is skipped. pyarrow is only needed for Parquet CURs, so it is imported when one is read.
+"""
+from typing import (
+    Any,
+    Collection,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+)
+
+# The CSV columns the reports use, and the names of the same columns in a Parquet CUR. The two spellings of the owner
+# tag are separate columns, like in a CSV CUR. Where a Parquet CUR lower-cases tag keys, both are read as the `owner`
+# tag, which the reports fall back to.
+COLUMNS = {
+    'lineItem/LineItemType': 'line_item_line_item_type',
+    'lineItem/UsageAccountId': 'line_item_usage_account_id',
+    'lineItem/UsageStartDate': 'line_item_usage_start_date',
+    'lineItem/UsageType': 'line_item_usage_type',
+    'lineItem/BlendedCost': 'line_item_blended_cost',
+    'lineItem/LineItemDescription': 'line_item_line_item_description',
+    'lineItem/ResourceId': 'line_item_resource_id',
+    'product/ProductName': 'product_product_name',
+    'product/region': 'product_region',
+    'resourceTags/user:Owner': 'resource_tags_user_Owner',
+    'resourceTags/user:owner': 'resource_tags_user_owner',
+}
+
+# Line item types that credit or discount costs rather than incur them
+EXCLUDED_LINE_ITEM_TYPES = (
+    'BundledDiscount',
+    'Credit',
+    'Discount',
+    'DistributorDiscount',
+    'EdpDiscount',
+    'PrivateRateDiscount',
+    'Refund',
+    'SavingsPlanNegation',
+)
+
+
+def is_parquet_manifest(manifest: Mapping[str, Any]) -> bool:
+    """
+    >>> is_parquet_manifest({'contentType': 'Parquet', 'reportKeys': ['a/b-00001.snappy.parquet']})
+    True
+    >>> is_parquet_manifest({'contentType': 'text/csv', 'reportKeys': ['a/b-1.csv.gz']})
+    False
+    """
+    keys = manifest.get('reportKeys', [])
+    return manifest.get('contentType', '').lower() == 'parquet' or bool(keys) and all(key.endswith('.parquet') for key in keys)
+
+
+def filters(account_ids: Optional[Collection[str]] = None) -> List[tuple]:
+    """
+    >>> filters(['2', '1'])
+    [('line_item_line_item_type', 'not in', ['BundledDiscount', 'Credit', 'Discount', 'DistributorDiscount', 'EdpDiscount', \
+'PrivateRateDiscount', 'Refund', 'SavingsPlanNegation']), ('line_item_usage_account_id', 'in', ['1', '2'])]
+    """
+    predicates = [(COLUMNS['lineItem/LineItemType'], 'not in', list(EXCLUDED_LINE_ITEM_TYPES))]
+    if account_ids is not None:
+        predicates.append((COLUMNS['lineItem/UsageAccountId'], 'in', sorted(account_ids)))
+    return predicates
+
+
+def rows_from_columns(columns: Mapping[str, Sequence[str]]) -> List[Mapping[str, str]]:
+    """
+    Return rows keyed by CSV column name from the given Parquet columns of CSV formatted values. Columns missing from
+    the file, such as the owner tag in a CUR without any owner tags, are empty.
+
+    >>> rows_from_columns({'line_item_line_item_type': ['Usage', 'Tax'], 'line_item_blended_cost': ['0.5', '2']})[1]
+    {'lineItem/LineItemType': 'Tax', 'lineItem/UsageAccountId': '', 'lineItem/UsageStartDate': '', 'lineItem/UsageType': '', \
+'lineItem/BlendedCost': '2', 'lineItem/LineItemDescription': '', 'lineItem/ResourceId': '', 'product/ProductName': '', \
+'product/region': '', 'resourceTags/user:Owner': '', 'resourceTags/user:owner': ''}
+    """
+    length = len(next(iter(columns.values()), ()))
+    values = [columns[parquet_name] if parquet_name in columns else [''] * length for parquet_name in COLUMNS.values()]
+    return [dict(zip(COLUMNS.keys(), row)) for row in zip(*values)]
+
+
+def read_rows(paths: Iterable[str], account_ids: Optional[Collection[str]] = None) -> List[Mapping[str, str]]:
+    """
+    Return the rows of the given Parquet files that incur a cost, and, if given, belong to one of the accounts. Only
+    the columns in COLUMNS are read, and the filters are applied by the Parquet reader, which skips the row groups
+    they rule out.
+
+    >>> import datetime, tempfile
+    >>> import pyarrow as pa, pyarrow.parquet as pq
+    >>> path = f'{tempfile.mkdtemp()}/cur.parquet'
+    >>> pq.write_table(pa.table({
+    ...     'line_item_line_item_type': ['Usage', 'Credit', 'Usage'],
+    ...     'line_item_usage_account_id': ['1', '1', '2'],
+    ...     'line_item_usage_start_date': [datetime.datetime(2020, 10, 1)] * 3,
+    ...     'line_item_blended_cost': [0.5, -0.5, 2.0],
+    ...     'resource_tags_user_Owner': ['x@ucsc.edu', None, None],
+    ...     'resource_tags_user_owner': ['y@ucsc.edu', None, None],
+    ...     'pricing_unit': ['Hrs', 'Hrs', 'Hrs'],
+    ... }), path)
+    >>> read_table = pq.read_table
+    >>> def spy(path, columns, filters):
+    ...     print(columns); print(filters)
+    ...     return read_table(path, columns=columns, filters=filters)
+    >>> pq.read_table = spy
+    >>> try:
+    ...     rows = read_rows([path], account_ids=['1'])
+    ... finally:
+    ...     pq.read_table = read_table
+    ['line_item_blended_cost', 'line_item_line_item_type', 'line_item_usage_account_id', 'line_item_usage_start_date', \
+'resource_tags_user_Owner', 'resource_tags_user_owner']
+    [('line_item_line_item_type', 'not in', ['BundledDiscount', 'Credit', 'Discount', 'DistributorDiscount', 'EdpDiscount', \
+'PrivateRateDiscount', 'Refund', 'SavingsPlanNegation']), ('line_item_usage_account_id', 'in', ['1'])]
+    >>> rows
+    [{'lineItem/LineItemType': 'Usage', 'lineItem/UsageAccountId': '1', 'lineItem/UsageStartDate': '2020-10-01T00:00:00Z', \
+'lineItem/UsageType': '', 'lineItem/BlendedCost': '0.5', 'lineItem/LineItemDescription': '', 'lineItem/ResourceId': '', \
+'product/ProductName': '', 'product/region': '', 'resourceTags/user:Owner': 'x@ucsc.edu', 'resourceTags/user:owner': 'y@ucsc.edu'}]
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError('Reading a Parquet CUR requires pyarrow') from e
+    rows = []
+    for path in paths:
+        available = set(pq.read_schema(path).names)
+        table = pq.read_table(path,
+                              columns=sorted(set(COLUMNS.values()) & available),
+                              filters=filters(account_ids))
+        # Format the values the way a CSV CUR spells them while they are still in Arrow
+        columns = {}
+        for name in table.column_names:
+            column = table.column(name)
+            if pa.types.is_timestamp(column.type):
+                column = pc.strftime(column.cast(pa.timestamp('s'), safe=False), format='%Y-%m-%dT%H:%M:%SZ')
+            elif not pa.types.is_string(column.type):
+                column = column.cast(pa.string())
+            # to_numpy() converts strings to Python objects many times faster than to_pylist()
+            columns[name] = column.fill_null('').to_numpy().tolist()
+        rows.extend(rows_from_columns(columns))
+    return rows
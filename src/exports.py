@@ -0,0 +1,131 @@
+"""
+Writes the tables a report is rendered from as machine-readable files, so that dashboards can read them instead of
+scraping the email or querying the billing data again.
+
+Amounts are integer micro-dollars, see src.money, in columns whose names end in `_micros`. Each table is written in
+all requested formats in a single pass over its rows, so the rows can be a generator over data that doesn't fit in
+memory. Parquet requires pyarrow, which is imported only when a Parquet file is written.
+"""
+import csv
+import json
+from pathlib import (
+    Path,
+)
+from typing import (
+    Any,
+    Iterable,
+    List,
+    Mapping,
+    Sequence,
+)
+
+FORMATS = ('csv', 'jsonl', 'parquet')
+
+# Number of rows buffered for each Parquet row group
+PARQUET_BATCH_ROWS = 65536
+
+
+class CsvWriter:
+
+    def __init__(self, path: Path, columns: Sequence[str]):
+        self.file = path.open('w', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=columns)
+        self.writer.writeheader()
+
+    def write(self, row: Mapping[str, Any]) -> None:
+        self.writer.writerow(row)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class JsonLinesWriter:
+
+    def __init__(self, path: Path, columns: Sequence[str]):
+        self.file = path.open('w')
+
+    def write(self, row: Mapping[str, Any]) -> None:
+        self.file.write(json.dumps(row))
+        self.file.write('\n')
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ParquetWriter:
+
+    def __init__(self, path: Path, columns: Sequence[str]):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise RuntimeError('Exporting Parquet requires pyarrow') from e
+        self.pyarrow = pyarrow
+        self.path = path
+        self.columns = columns
+        self.batch: List[Mapping[str, Any]] = []
+        # Created from the first batch, whose types it infers
+        self.writer = None
+
+    def write(self, row: Mapping[str, Any]) -> None:
+        self.batch.append(row)
+        if len(self.batch) >= PARQUET_BATCH_ROWS:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.batch:
+            pa = self.pyarrow
+            if self.writer is None:
+                table = pa.Table.from_pylist(self.batch)
+                # A column that is empty in the first batch is assumed to hold strings
+                schema = pa.schema([pa.field(field.name, pa.string()) if pa.types.is_null(field.type) else field
+                                    for field in table.schema])
+                self.writer = pa.parquet.ParquetWriter(str(self.path), schema)
+            self.writer.write_table(pa.Table.from_pylist(self.batch, schema=self.writer.schema))
+            self.batch = []
+
+    def close(self) -> None:
+        self.flush()
+        if self.writer is None:
+            # Without any rows, all columns are assumed to hold strings
+            pa = self.pyarrow
+            self.writer = pa.parquet.ParquetWriter(str(self.path), pa.schema([(column, pa.string()) for column in self.columns]))
+        self.writer.close()
+
+
+writers = {
+    'csv': CsvWriter,
+    'jsonl': JsonLinesWriter,
+    'parquet': ParquetWriter,
+}
+
+
+def export(directory: str, name: str, columns: Sequence[str], rows: Iterable[Mapping[str, Any]],
+           formats: Iterable[str] = ('csv', 'jsonl')) -> Sequence[Path]:
+    """
+    Write the rows to `<name>.<format>` in the directory for each of the formats, and return the paths written.
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> rows = ({'account_name': name, 'cost_month_micros': cost} for name, cost in [('one', 1500000), ('two', 20)])
+    >>> csv_path, jsonl_path = export(directory, 'accounts', ['account_name', 'cost_month_micros'], rows)
+    >>> print(csv_path.read_text(), end='')
+    account_name,cost_month_micros
+    one,1500000
+    two,20
+    >>> print(jsonl_path.read_text(), end='')
+    {"account_name": "one", "cost_month_micros": 1500000}
+    {"account_name": "two", "cost_month_micros": 20}
+    """
+    formats = tuple(formats)
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    paths = [Path(directory) / f'{name}.{format}' for format in formats]
+    outputs = [writers[format](path, columns) for format, path in zip(formats, paths)]
+    try:
+        for row in rows:
+            for output in outputs:
+                output.write(row)
+    finally:
+        for output in outputs:
+            output.close()
+    return paths
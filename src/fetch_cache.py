@@ -0,0 +1,188 @@
+"""
+A bounded, thread-safe cache of fetched source data for reports that run in a long-lived process.
+"""
+import collections
+import pickle
+import sys
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    Hashable,
+    Iterator,
+    MutableMapping,
+    Optional,
+)
+
+# Number of elements of a long list that its size is estimated from
+SAMPLE_SIZE = 64
+
+
+def estimate_size(value: Any) -> int:
+    """
+    Return an estimate of the number of bytes the given value takes up, the length of its pickle. The size of a long
+    list or tuple, like the line items of a month's CUR, is extrapolated from that of a sample of its elements, so
+    that it isn't copied in full.
+
+    >>> estimate_size(['a' * 100] * 1000) // 1000
+    115
+    >>> estimate_size(threading.Lock()) > 0
+    True
+    """
+    if isinstance(value, (list, tuple)) and len(value) > SAMPLE_SIZE:
+        step = len(value) / SAMPLE_SIZE
+        sample = [value[int(i * step)] for i in range(SAMPLE_SIZE)]
+        # Each element is pickled on its own, so that elements repeated in the sample aren't counted only once
+        return sum(estimate_size(element) for element in sample) * len(value) // SAMPLE_SIZE
+    try:
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return sys.getsizeof(value)
+
+
+class Fetch:
+    """A fetch in progress, whose result is handed to the threads waiting for it even if it isn't cached."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.done = False
+        self.value = None
+
+
+class FetchCache(MutableMapping):
+    """
+    Keeps values whose estimated sizes add up to at most max_bytes, and at most max_entries values, evicting the least
+    recently used first. Values larger than max_bytes on their own aren't kept at all. Values older than ttl seconds
+    are forgotten, so that billing data that is still changing is fetched again.
+
+    >>> now = [0.0]
+    >>> cache = FetchCache(max_bytes=250, ttl=60, clock=lambda: now[0], sizeof=len)
+    >>> cache['a'] = 'a' * 100; cache['b'] = 'b' * 100
+    >>> len(cache['a'])
+    100
+    >>> cache['c'] = 'c' * 100
+    >>> sorted(cache), cache.size
+    (['a', 'c'], 200)
+    >>> cache['d'] = 'd' * 300
+    >>> sorted(cache), cache.size
+    (['a', 'c'], 200)
+    >>> now[0] = 61
+    >>> 'a' in cache, len(cache), cache.size
+    (False, 0, 0)
+
+    >>> cache = FetchCache(max_entries=2)
+    >>> cache['a'] = 1; cache['b'] = 2; cache['c'] = 3
+    >>> sorted(cache)
+    ['b', 'c']
+
+    Concurrent fetches of the same key are made only once. The other callers wait for and share the result, even one
+    too large to be kept:
+
+    >>> cache = FetchCache(max_bytes=250, sizeof=len)
+    >>> calls = []
+    >>> def fetch():
+    ...     calls.append(1); time.sleep(0.1); return 'x' * 300
+    >>> results = []
+    >>> threads = [threading.Thread(target=lambda: results.append(cache.get_or_fetch('key', fetch))) for _ in range(4)]
+    >>> for thread in threads: thread.start()
+    >>> for thread in threads: thread.join()
+    >>> [len(result) for result in results], len(calls), cache.fetches, cache.hits, 'key' in cache
+    ([300, 300, 300, 300], 1, 1, 3, False)
+    """
+
+    def __init__(self,
+                 max_bytes: Optional[int] = None,
+                 max_entries: Optional[int] = None,
+                 ttl: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic,
+                 sizeof: Callable[[Any], int] = estimate_size):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.sizeof = sizeof
+        # Values, the time they were stored and their estimated size, least recently used first
+        self._entries: 'collections.OrderedDict[Hashable, tuple]' = collections.OrderedDict()
+        # The sum of the estimated sizes of the values
+        self.size = 0
+        # The fetches in progress, by key
+        self._fetching = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.fetches = 0
+
+    def _expire(self) -> None:
+        if self.ttl is not None:
+            cutoff = self.clock() - self.ttl
+            for key in [key for key, (_, stored, _) in self._entries.items() if stored < cutoff]:
+                del self[key]
+
+    def __getitem__(self, key: Hashable) -> Any:
+        with self._lock:
+            self._expire()
+            value, _, _ = self._entries[key]
+            self._entries.move_to_end(key)
+            return value
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        # Estimating the size of a large value takes a while, so it is done without holding the lock
+        size = 0 if self.max_bytes is None else self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                del self[key]
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._entries[key] = (value, self.clock(), size)
+            self.size += size
+            while ((self.max_entries is not None and len(self._entries) > self.max_entries)
+                   or (self.max_bytes is not None and self.size > self.max_bytes)):
+                del self[next(iter(self._entries))]
+
+    def __delitem__(self, key: Hashable) -> None:
+        with self._lock:
+            _, _, size = self._entries.pop(key)
+            self.size -= size
+
+    def __iter__(self) -> Iterator[Hashable]:
+        with self._lock:
+            self._expire()
+            return iter(list(self._entries))
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._expire()
+            return len(self._entries)
+
+    def get_or_fetch(self, key: Hashable, fetch: Callable[[], Any]) -> Any:
+        """Return the cached value of the key, calling fetch for it unless another thread already is."""
+        while True:
+            with self._lock:
+                try:
+                    value = self[key]
+                except KeyError:
+                    pass
+                else:
+                    self.hits += 1
+                    return value
+                pending = self._fetching.get(key)
+                if pending is None:
+                    pending = self._fetching[key] = Fetch()
+                    break
+            # Another thread is fetching the key. If that fails, the key is still missing and this thread tries.
+            pending.event.wait()
+            if pending.done:
+                with self._lock:
+                    self.hits += 1
+                return pending.value
+        try:
+            value = fetch()
+            self[key] = value
+            with self._lock:
+                self.fetches += 1
+            pending.value, pending.done = value, True
+            return value
+        finally:
+            with self._lock:
+                del self._fetching[key]
+            pending.event.set()
@@ -0,0 +1,148 @@
+"""
+Daily billing history, partitioned by platform and usage day, stored locally in a compact columnar format.
+
+Each partition is a gzipped JSON object holding one array per column. String columns are dictionary encoded. Runs only
+write the partitions of days that are new or may still change, and trend reads only open the partitions in range.
+"""
+import datetime
+import gzip
+import json
+from pathlib import (
+    Path,
+)
+from typing import (
+    Any,
+    Iterable,
+    Iterator,
+    Mapping,
+    Optional,
+    Sequence,
+)
+
+PARTITION_FILE = 'part.json.gz'
+
+
+def encode_columns(rows: Sequence[Mapping[str, Any]]) -> Mapping[str, Any]:
+    """
+    >>> encode_columns([{'id': 'a', 'cost': 1}, {'id': 'b', 'cost': 2}, {'id': 'a', 'cost': 3}])
+    {'rows': 3, 'columns': {'id': {'dictionary': ['a', 'b'], 'indices': [0, 1, 0]}, 'cost': [1, 2, 3]}}
+    """
+    columns = {}
+    for name in (rows[0].keys() if rows else ()):
+        values = [row[name] for row in rows]
+        if all(isinstance(value, str) or value is None for value in values):
+            dictionary = {}
+            indices = [dictionary.setdefault(value, len(dictionary)) for value in values]
+            columns[name] = {'dictionary': list(dictionary), 'indices': indices}
+        else:
+            columns[name] = values
+    return {'rows': len(rows), 'columns': columns}
+
+
+def decode_column(column: Any) -> Sequence[Any]:
+    """
+    >>> decode_column({'dictionary': ['a', 'b'], 'indices': [0, 1, 0]}), decode_column([1, 2])
+    (['a', 'b', 'a'], [1, 2])
+    """
+    if isinstance(column, dict):
+        dictionary = column['dictionary']
+        return [dictionary[index] for index in column['indices']]
+    return column
+
+
+class HistoryStore:
+    """
+    >>> import tempfile
+    >>> store = HistoryStore(tempfile.mkdtemp())
+    >>> day = datetime.date(2020, 10, 1)
+    >>> _ = store.write_partition('aws', day, [{'account_id': '1', 'service': 'S3', 'cost': 5}])
+    >>> _ = store.write_partition('aws', day + datetime.timedelta(1), [{'account_id': '1', 'service': 'S3', 'cost': 7}])
+    >>> store.partitions('aws')
+    [datetime.date(2020, 10, 1), datetime.date(2020, 10, 2)]
+    >>> list(store.read('aws', day, day + datetime.timedelta(1)))
+    [{'date': datetime.date(2020, 10, 1), 'account_id': '1', 'service': 'S3', 'cost': 5}]
+    >>> store.read_columns('aws', day, day + datetime.timedelta(2), ['date', 'cost'])
+    {'date': [datetime.date(2020, 10, 1), datetime.date(2020, 10, 2)], 'cost': [5, 7]}
+    >>> store.daily_sums('aws', day, day + datetime.timedelta(2), keys=['account_id'], value='cost')
+    {('1',): {datetime.date(2020, 10, 1): 5, datetime.date(2020, 10, 2): 7}}
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def partition_key(self, platform: str, date: datetime.date) -> str:
+        """
+        >>> HistoryStore('/history').partition_key('gcp', datetime.date(2020, 10, 1))
+        'gcp/date=2020-10-01/part.json.gz'
+        """
+        return f'{platform}/date={date.isoformat()}/{PARTITION_FILE}'
+
+    def partition_path(self, platform: str, date: datetime.date) -> Path:
+        return self.root / self.partition_key(platform, date)
+
+    def has_partition(self, platform: str, date: datetime.date) -> bool:
+        return self.partition_path(platform, date).exists()
+
+    def partitions(self, platform: str) -> Sequence[datetime.date]:
+        return sorted(
+            datetime.date.fromisoformat(path.parent.name[len('date='):])
+            for path in (self.root / platform).glob(f'date=*/{PARTITION_FILE}')
+        )
+
+    def encode_partition(self, rows: Sequence[Mapping[str, Any]]) -> bytes:
+        # mtime=0 keeps the bytes of identical partitions identical
+        return gzip.compress(json.dumps(encode_columns(rows), separators=(',', ':')).encode(), mtime=0)
+
+    def write_partition(self, platform: str, date: datetime.date, rows: Sequence[Mapping[str, Any]]) -> bytes:
+        """Replace the partition of the given day, atomically, and return its encoded contents."""
+        path = self.partition_path(platform, date)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        content = self.encode_partition(rows)
+        tmp = path.with_name(PARTITION_FILE + '.tmp')
+        tmp.write_bytes(content)
+        tmp.replace(path)
+        return content
+
+    def read_partition(self, platform: str, date: datetime.date, columns: Optional[Iterable[str]] = None) -> Mapping[str, Sequence[Any]]:
+        path = self.partition_path(platform, date)
+        partition = json.loads(gzip.decompress(path.read_bytes()))
+        names = partition['columns'].keys() if columns is None else [name for name in columns if name != 'date']
+        decoded = {'date': [date] * partition['rows']}
+        decoded.update((name, decode_column(partition['columns'][name])) for name in names)
+        return decoded
+
+    def read_columns(self,
+                     platform: str,
+                     start: datetime.date,
+                     end: datetime.date,
+                     columns: Optional[Iterable[str]] = None) -> Mapping[str, Sequence[Any]]:
+        """Return the given columns of every row of the days in [start, end), concatenated, in order of day."""
+        columns = None if columns is None else list(columns)
+        result = {} if columns is None else {name: [] for name in columns}
+        for date in self.partitions(platform):
+            if start <= date < end:
+                for name, values in self.read_partition(platform, date, columns).items():
+                    if columns is None or name in columns:
+                        result.setdefault(name, []).extend(values)
+        return result
+
+    def read(self, platform: str, start: datetime.date, end: datetime.date) -> Iterator[Mapping[str, Any]]:
+        """Yield every row of the days in [start, end) as a mapping including the partition date."""
+        for date in self.partitions(platform):
+            if start <= date < end:
+                partition = self.read_partition(platform, date)
+                yield from (dict(zip(partition.keys(), values)) for values in zip(*partition.values()))
+
+    def daily_sums(self,
+                   platform: str,
+                   start: datetime.date,
+                   end: datetime.date,
+                   keys: Sequence[str],
+                   value: str) -> Mapping[tuple, Mapping[datetime.date, Any]]:
+        """Return the sum of a value column per day for each distinct combination of the key columns."""
+        columns = self.read_columns(platform, start, end, ['date', value, *keys])
+        sums = {}
+        for date, amount, *key in zip(columns['date'], columns[value], *(columns[name] for name in keys)):
+            days = sums.setdefault(tuple(key), {})
+            days[date] = days.get(date, 0) + amount
+        return sums
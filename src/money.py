@@ -0,0 +1,82 @@
+"""
+Amounts of money as integer micro-dollars, from parsing through aggregation to formatting. Integer sums are exact,
+cheap, and can be vectorized, unlike mixing float and Decimal.
+"""
+from decimal import (
+    Decimal,
+    ROUND_HALF_EVEN,
+)
+from typing import (
+    Union,
+)
+
+DOLLAR = 1000000
+CENT = DOLLAR // 100
+
+
+def parse(text: str) -> int:
+    """
+    Convert a decimal string of dollars, as found in the CUR and Cost Explorer responses, to micro-dollars. Digits past
+    the sixth decimal place are rounded half to even.
+
+    >>> parse('12.3456789012')
+    12345679
+    >>> parse('-0.0000005'), parse('0.0000015'), parse('0.00000050001')
+    (0, 2, 1)
+    >>> parse('7'), parse('-1.5'), parse('.25')
+    (7000000, -1500000, 250000)
+    >>> parse('1E-10'), parse('2.5e3')
+    (0, 2500000000)
+    """
+    if 'e' in text or 'E' in text:
+        return from_dollars(Decimal(text))
+    whole, _, fraction = text.partition('.')
+    micros = int(whole + fraction[:6].ljust(6, '0'))
+    rest = fraction[6:]
+    if rest:
+        first = rest[0]
+        if first > '5' or (first == '5' and (micros % 2 or rest.rstrip('0') != '5')):
+            micros += -1 if micros < 0 or text.startswith('-') else 1
+    return micros
+
+
+def from_dollars(amount: Union[Decimal, float, int]) -> int:
+    """
+    >>> from_dollars(Decimal('20.000000000000000001')), from_dollars(1.25), from_dollars(3)
+    (20000000, 1250000, 3000000)
+    """
+    if isinstance(amount, Decimal):
+        return int((amount * DOLLAR).quantize(Decimal(1), rounding=ROUND_HALF_EVEN))
+    elif isinstance(amount, float):
+        return round(amount * DOLLAR)
+    else:
+        return amount * DOLLAR
+
+
+def format_amount(micros: int) -> str:
+    """
+    Format micro-dollars rounded to cents, half to even.
+
+    >>> format_amount(20000000), format_amount(-10000000), format_amount(1234567890)
+    ('$20.00', '-$10.00', '$1234.57')
+    >>> format_amount(5000), format_amount(15000), format_amount(-5001)
+    ('$0.00', '$0.02', '-$0.01')
+    """
+    cents, remainder = divmod(abs(micros), CENT)
+    if remainder > CENT // 2 or (remainder == CENT // 2 and cents % 2):
+        cents += 1
+    symbol = '-' if micros < 0 and cents else ''
+    dollars, cents = divmod(cents, 100)
+    return f'{symbol}${dollars}.{cents:02d}'
+
+
+def to_decimal_string(micros: int) -> str:
+    """
+    Format micro-dollars exactly, as a plain decimal number of dollars.
+
+    >>> to_decimal_string(12345678), to_decimal_string(-5), to_decimal_string(0)
+    ('12.345678', '-0.000005', '0.000000')
+    """
+    sign = '-' if micros < 0 else ''
+    dollars, fraction = divmod(abs(micros), DOLLAR)
+    return f'{sign}{dollars}.{fraction:06d}'
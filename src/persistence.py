@@ -0,0 +1,166 @@
+"""
+Uploads persisted files to S3 in the background while the report continues.
+"""
+import concurrent.futures
+import gzip
+import hashlib
+import io
+import mimetypes
+import threading
+from typing import (
+    Any,
+    List,
+    Optional,
+    Union,
+)
+
+from src import (
+    clients,
+)
+from src.run_profile import (
+    RunProfile,
+)
+
+# Bodies larger than this are uploaded in parts, in parallel
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+
+
+def is_not_found(error: Exception) -> bool:
+    """
+    >>> class ClientError(Exception):
+    ...     response = {'Error': {'Code': '404'}}
+    >>> is_not_found(ClientError()), is_not_found(KeyError())
+    (True, False)
+    """
+    code = getattr(error, 'response', {}).get('Error', {}).get('Code')
+    return code in ('404', 'NoSuchKey', 'NotFound')
+
+
+class Uploader:
+    """
+    Uploads bodies gzipped, with a gzip Content-Encoding, and tagged with the SHA-256 of their uncompressed content. A body is not uploaded again
+    if the object already stored under its key has the same hash. Uploads run in a thread pool sharing one client,
+    call wait() to block until they are done and raise the first error.
+
+    >>> class ClientError(Exception):
+    ...     response = {'Error': {'Code': '404'}}
+    >>> class FakeS3:
+    ...     def __init__(self):
+    ...         self.objects = {}
+    ...     def head_object(self, Bucket, Key):
+    ...         if Key not in self.objects:
+    ...             raise ClientError()
+    ...         return {'Metadata': self.objects[Key]['ExtraArgs']['Metadata']}
+    ...     def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs, Config=None):
+    ...         self.objects[Key] = {'Body': Fileobj.read(), 'ExtraArgs': ExtraArgs}
+    >>> s3 = FakeS3()
+    >>> uploader = Uploader('bucket', client=s3)
+    >>> _ = uploader.upload('aws/2020/10/aws-2020-10.csv', 'date,amount\\n')
+    >>> _ = uploader.upload('history/aws/date=2020-10-01/part.json.gz', gzip.compress(b'{}'))
+    >>> uploader.wait()
+    >>> gzip.decompress(s3.objects['aws/2020/10/aws-2020-10.csv']['Body'])
+    b'date,amount\\n'
+    >>> s3.objects['aws/2020/10/aws-2020-10.csv']['ExtraArgs']['ContentEncoding']
+    'gzip'
+    >>> gzip.decompress(s3.objects['history/aws/date=2020-10-01/part.json.gz']['Body'])
+    b'{}'
+
+    Unchanged bodies are skipped:
+
+    >>> uploader.upload('aws/2020/10/aws-2020-10.csv', 'date,amount\\n').result()
+    False
+    >>> uploader.upload('aws/2020/10/aws-2020-10.csv', 'date,amount\\n2020-10-01,1\\n').result()
+    True
+    >>> uploader.wait()
+    >>> dict(uploader.profile.api_calls)
+    {'s3_head': 4, 's3': 3, 's3_skipped': 1}
+    """
+
+    def __init__(self,
+                 bucket: str,
+                 client: Any,
+                 transfer_config: Optional[Any] = None,
+                 max_workers: int = 4,
+                 profile: Optional[RunProfile] = None):
+        self.bucket = bucket
+        # boto3 clients are thread safe, unlike sessions and resources
+        self.client = client
+        self.transfer_config = transfer_config
+        self.profile = RunProfile() if profile is None else profile
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='upload')
+        self._futures: List[concurrent.futures.Future] = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_bucket(cls,
+                   bucket: str,
+                   access_key: str,
+                   secret_key: str,
+                   endpoint_url: Optional[str] = None,
+                   **kwargs) -> 'Uploader':
+        """
+        Return an uploader using the given credentials. Pass the endpoint_url of an S3 compatible server, like
+        moto_server or MinIO, to upload to that instead of S3.
+        """
+        from boto3.s3.transfer import (
+            TransferConfig,
+        )
+        client = clients.aws_client('s3', access_key, secret_key, endpoint_url=endpoint_url)
+        return cls(bucket,
+                   client=client,
+                   transfer_config=TransferConfig(multipart_threshold=MULTIPART_THRESHOLD),
+                   **kwargs)
+
+    def upload(self, key: str, content: Union[str, bytes]) -> concurrent.futures.Future:
+        """
+        Schedule the upload of the given content and return a future of whether it was uploaded. Content that is
+        already gzipped, by the name of its key, is stored as is.
+        """
+        body = bytes(content, 'UTF-8') if isinstance(content, str) else content
+        future = self._executor.submit(self._upload, key, body)
+        with self._lock:
+            self._futures.append(future)
+        return future
+
+    def _upload(self, key: str, body: bytes) -> bool:
+        compressed = key.endswith('.gz')
+        digest = hashlib.sha256(gzip.decompress(body) if compressed else body).hexdigest()
+        try:
+            metadata = self.client.head_object(Bucket=self.bucket, Key=key).get('Metadata', {})
+        except Exception as e:
+            if not is_not_found(e):
+                raise
+            metadata = {}
+        finally:
+            self.profile.count_call('s3_head')
+        if metadata.get('sha256') == digest:
+            self.profile.count_call('s3_skipped')
+            return False
+        if compressed:
+            # Stored as the gzip file its key names, rather than transparently decompressed by HTTP clients
+            extra_args = {'ContentType': 'application/gzip'}
+        else:
+            content_type, _ = mimetypes.guess_type(key)
+            extra_args = {'ContentEncoding': 'gzip', 'ContentType': content_type or 'application/octet-stream'}
+        extra_args['Metadata'] = {'sha256': digest}
+        fileobj = io.BytesIO(body if compressed else gzip.compress(body, mtime=0))
+        if self.transfer_config is None:
+            self.client.upload_fileobj(fileobj, self.bucket, key, ExtraArgs=extra_args)
+        else:
+            self.client.upload_fileobj(fileobj, self.bucket, key, ExtraArgs=extra_args, Config=self.transfer_config)
+        self.profile.count_call('s3')
+        return True
+
+    def wait(self) -> None:
+        """Block until all uploads scheduled so far are done, raising the error of the first that failed, if any."""
+        with self._lock:
+            futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+    def close(self) -> None:
+        """Wait for the scheduled uploads and stop the threads uploading them."""
+        try:
+            self.wait()
+        finally:
+            self._executor.shutdown()
@@ -0,0 +1,213 @@
+"""
+Records the responses of every external service a report run calls, and replays them without any network access.
+
+Runs recorded against the real AWS, GCP and Terra can then be profiled and benchmarked offline, with the latency of
+the services simulated by a fixed delay per call. Clients are wrapped by src/clients.py once a recorder is installed
+with clients.set_recorder():
+
+    <directory>/<service>/<method>/<sha256 of the scope and arguments>.pickle.gz
+
+Calls are told apart by their service, their scope, like the region and assumed role of a client, their method and
+their arguments. File objects passed to a call, like the one S3 downloads into, are replaced by the bytes written to
+them. Errors, like S3 reporting that an object doesn't exist, are recorded and raised again on replay. Writes to the
+persist bucket are made while recording, but neither recorded nor replayed. Credentials returned by STS are redacted
+before they are recorded.
+"""
+import gzip
+import hashlib
+import io
+import json
+from pathlib import (
+    Path,
+)
+import pickle
+import time
+from typing import (
+    Any,
+    Callable,
+    Hashable,
+    Iterable,
+    Mapping,
+    Sequence,
+)
+
+# Methods that write to a service rather than read from it
+WRITE_METHODS = frozenset({
+    'put_object',
+    'upload_file',
+    'upload_fileobj',
+})
+
+
+class RecordingNotFound(LookupError):
+    pass
+
+
+class RecordedJob:
+    """A BigQuery query job whose results were recorded."""
+
+    def __init__(self, rows: Sequence[Mapping[str, Any]]):
+        self.rows = rows
+
+    def result(self) -> Sequence[Mapping[str, Any]]:
+        return self.rows
+
+
+def redact_credentials(response: Mapping[str, Any]) -> Mapping[str, Any]:
+    """
+    >>> redact_credentials({'Credentials': {'AccessKeyId': 'AKIA', 'SecretAccessKey': 'secret', 'SessionToken': 'token'}})
+    {'Credentials': {'AccessKeyId': 'redacted', 'SecretAccessKey': 'redacted', 'SessionToken': 'redacted'}}
+    """
+    return dict(response, Credentials={key: 'redacted' for key in response.get('Credentials', {})})
+
+
+# Turn the response of a method into what is recorded and returned in its place
+ADAPTERS = {
+    ('bigquery', 'query'): lambda job: RecordedJob([dict(row) for row in job.result()]),
+    ('sts', 'assume_role'): redact_credentials,
+}
+
+
+def describe(value: Any) -> Any:
+    """Return what tells arguments apart that JSON can't represent, like the parameters of a BigQuery query."""
+    return value.to_api_repr() if hasattr(value, 'to_api_repr') else repr(value)
+
+
+def is_file(value: Any) -> bool:
+    return hasattr(value, 'write')
+
+
+class Recorder:
+    """
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> class S3:
+    ...     def head_object(self, Bucket, Key):
+    ...         return {'ContentLength': 3}
+    ...     def download_fileobj(self, bucket, key, fileobj):
+    ...         if key == 'missing.csv.gz':
+    ...             raise KeyError(key)
+    ...         fileobj.write(b'a,b')
+    >>> s3 = Recorder(directory).client('s3', lambda: S3(), scope='us-west-2')
+    >>> s3.head_object(Bucket='cur', Key='manifest.json')
+    {'ContentLength': 3}
+    >>> file = io.BytesIO(); s3.download_fileobj('cur', 'part-1.csv.gz', file); file.getvalue()
+    b'a,b'
+    >>> s3.download_fileobj('cur', 'missing.csv.gz', io.BytesIO())
+    Traceback (most recent call last):
+    ...
+    KeyError: 'missing.csv.gz'
+
+    Replaying never creates the client:
+
+    >>> s3 = Recorder(directory, replay=True).client('s3', None, scope='us-west-2')
+    >>> s3.head_object(Bucket='cur', Key='manifest.json')
+    {'ContentLength': 3}
+    >>> file = io.BytesIO(); s3.download_fileobj('cur', 'part-1.csv.gz', file); file.getvalue()
+    b'a,b'
+    >>> s3.download_fileobj('cur', 'missing.csv.gz', io.BytesIO())
+    Traceback (most recent call last):
+    ...
+    KeyError: 'missing.csv.gz'
+    >>> try:
+    ...     s3.head_object(Bucket='cur', Key='other.json')
+    ... except RecordingNotFound as e:
+    ...     print(e)
+    s3.head_object(Bucket='cur', Key='other.json') was not recorded
+    """
+
+    def __init__(self, directory: str, replay: bool = False, latency: float = 0.0):
+        self.directory = Path(directory)
+        self.replay = replay
+        # Seconds each replayed call takes
+        self.latency = latency
+
+    def path(self, service: str, method: str, scope: Hashable, args: Sequence, kwargs: Mapping[str, Any]) -> Path:
+        key = json.dumps([repr(scope), ['<file>' if is_file(arg) else arg for arg in args], kwargs], sort_keys=True, default=describe)
+        return self.directory / service / method / f'{hashlib.sha256(key.encode()).hexdigest()}.pickle.gz'
+
+    def call(self, service: str, method: str, function: Callable, *args, scope: Hashable = None, **kwargs) -> Any:
+        """
+        Return the recorded response of the call, or, while recording, make the call and record its response. Bytes
+        written to a file object argument and errors raised by the call are recorded and replayed, too.
+        """
+        path = self.path(service, method, scope, args, kwargs)
+        files = [arg for arg in args if is_file(arg)] + [arg for arg in kwargs.values() if is_file(arg)]
+        if self.replay:
+            try:
+                response, written, error = pickle.loads(gzip.decompress(path.read_bytes()))
+            except FileNotFoundError:
+                arguments = ', '.join([*map(repr, args), *(f'{name}={value!r}' for name, value in kwargs.items())])
+                raise RecordingNotFound(f'{service}.{method}({arguments}) was not recorded') from None
+            time.sleep(self.latency)
+        else:
+            buffers = {id(file): io.BytesIO() for file in files}
+            response, error = None, None
+            try:
+                response = function(*[buffers.get(id(arg), arg) for arg in args],
+                                    **{name: buffers.get(id(value), value) for name, value in kwargs.items()})
+            except Exception as e:
+                error = e
+            else:
+                adapter = ADAPTERS.get((service, method))
+                if adapter is not None:
+                    response = adapter(response)
+            written = [buffers[id(file)].getvalue() for file in files]
+            try:
+                recording = pickle.dumps((response, written, error))
+            except Exception:
+                # An error that can't be pickled is raised, but not recorded
+                if error is None:
+                    raise
+                raise error from None
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(path.name + '.tmp')
+            tmp.write_bytes(gzip.compress(recording, mtime=0))
+            tmp.replace(path)
+        for file, content in zip(files, written):
+            file.write(content)
+        if error is not None:
+            raise error
+        return response
+
+    def client(self, service: str, create: Callable[[], Any], scope: Hashable = None) -> Any:
+        """Return a proxy of the client that create() returns, which is only called while recording."""
+        return RecordingClient(self, service, None if self.replay else create(), scope)
+
+
+class RecordingClient:
+
+    def __init__(self, recorder: Recorder, service: str, client: Any, scope: Hashable):
+        self._recorder = recorder
+        self._service = service
+        self._client = client
+        self._scope = scope
+
+    def get_paginator(self, operation: str) -> 'RecordingPaginator':
+        return RecordingPaginator(self, operation)
+
+    def __getattr__(self, method: str) -> Callable:
+        if method in WRITE_METHODS:
+            # Writes are made while recording and skipped while replaying
+            return (lambda *args, **kwargs: None) if self._client is None else getattr(self._client, method)
+
+        def call(*args, **kwargs):
+            function = None if self._client is None else getattr(self._client, method)
+            return self._recorder.call(self._service, method, function, *args, scope=self._scope, **kwargs)
+
+        return call
+
+
+class RecordingPaginator:
+
+    def __init__(self, client: RecordingClient, operation: str):
+        self.client = client
+        self.operation = operation
+
+    def paginate(self, **kwargs) -> Iterable[Mapping[str, Any]]:
+        client = self.client
+
+        def pages():
+            return list(client._client.get_paginator(self.operation).paginate(**kwargs))
+
+        return client._recorder.call(client._service, f'{self.operation}.paginate', pages, scope=client._scope, **kwargs)
@@ -1,18 +1,77 @@
+import sys
+from types import (
+    MappingProxyType,
+)
+
+# Shared by all resources without usage types
+NO_USAGE_TYPES = MappingProxyType({})
+
+
+def normalized_resource_id(resource_id: str) -> str:
+    """
+    Return the ID a resource goes by in both the CUR and the tagging API. The CUR identifies most resources by their
+    bare ID, and some by their ARN, while the tagging API always returns ARNs.
+
+    >>> normalized_resource_id('arn:aws:ec2:us-west-2:123456789012:instance/i-0123')
+    'i-0123'
+    >>> normalized_resource_id('arn:aws:s3:::bucket'), normalized_resource_id('bucket')
+    ('bucket', 'bucket')
+    >>> normalized_resource_id('arn:aws:ec2:us-west-2::snapshot/snap-0123'), normalized_resource_id('vol-0123')
+    ('snap-0123', 'vol-0123')
+    """
+    if resource_id.startswith('arn:'):
+        resource_id = resource_id.split(':', 5)[5]
+        return resource_id.rpartition('/')[2]
+    else:
+        return resource_id
+
+
 class report_resource:
+    """
+    A billed or tagged AWS resource. A large CUR creates hundreds of thousands of these, so instances have no __dict__,
+    the strings they share with other resources are interned, and the tag values and usage types are only allocated
+    once a resource has any.
+
+    >>> resource = report_resource('i-0123', 'Amazon Elastic Compute Cloud', '', 'account', 'us-west-2')
+    >>> dict(resource.usage_types), resource.get_tag_status()
+    ({}, {'Owner': None, 'owner': None, 'noncompliant-maid-service': None})
+    >>> resource.add_tag_value('owner', 'someone@ucsc.edu')
+    >>> resource.add_usage_type('BoxUsage', 2)
+    >>> resource.add_usage_type('BoxUsage', 3)
+    >>> resource.usage_types, resource.get_email()
+    ({'BoxUsage': 5}, 'someone@ucsc.edu')
+    >>> resource.tag_status['owner']
+    'someone@ucsc.edu'
+    """
+
+    # The tags recorded for each resource, in the order their values are stored in
+    TAGS = ("Owner", "owner", "noncompliant-maid-service")
+
+    __slots__ = (
+        'resource_arn',
+        'resource_type',
+        'account_id',
+        'account_name',
+        'region',
+        '_usage_types',
+        'compliance_status',
+        '_tag_values',
+        'email',
+        'is_shared',
+        'daily_cost',
+        'monthly_cost',
+        'url',
+    )
 
     def __init__(self, resource_arn: str, resource_type: str, account_id: str, account_name: str, region: str):
         self.resource_arn = resource_arn
-        self.resource_type = resource_type
-        self.account_id = account_id
-        self.account_name = account_name
-        self.region = region
-        self.usage_types = {}
+        self.resource_type = sys.intern(resource_type)
+        self.account_id = sys.intern(account_id)
+        self.account_name = sys.intern(account_name)
+        self.region = sys.intern(region)
+        self._usage_types = None
         self.compliance_status = None
-        self.tag_status = {
-            "Owner": None,
-            "owner": None,
-            "noncompliant-maid-service": None
-        }
+        self._tag_values = None
         self.email = None
         self.is_shared = False
 
@@ -21,9 +80,23 @@ class report_resource:
 
         self.url = None
 
+    @property
+    def usage_types(self):
+        return NO_USAGE_TYPES if self._usage_types is None else self._usage_types
+
+    @property
+    def tag_status(self):
+        values = self._tag_values or (None,) * len(self.TAGS)
+        return dict(zip(self.TAGS, values))
+
+    def get_tag_value(self, tag: str):
+        return None if self._tag_values is None else self._tag_values[self.TAGS.index(tag)]
+
     def add_usage_type(self, usage_type, amount):
-        self.usage_types.setdefault(usage_type, 0)
-        self.usage_types[usage_type] += amount
+        if self._usage_types is None:
+            self._usage_types = {}
+        usage_type = sys.intern(usage_type)
+        self._usage_types[usage_type] = self._usage_types.get(usage_type, 0) + amount
 
     # sets the resource url if possible, otherwise just links to the dashboard
     def set_resource_url(self):
@@ -45,16 +118,18 @@ class report_resource:
     def set_compliance_status(self, compliance_status=None):
         if compliance_status is not None:
             self.compliance_status = compliance_status
-        elif self.tag_status["noncompliant-maid-service"] is not None:
+        elif self.get_tag_value("noncompliant-maid-service") is not None:
             self.compliance_status = "NON_COMPLIANT"
         else:
             self.compliance_status = "COMPLIANT"
 
     # Add a resource tag to the list of tags of this resource
     def add_tag_value(self, tag: str, tag_value: str):
-        assert tag in self.tag_status
+        assert tag in self.TAGS
 
-        self.tag_status[tag] = tag_value
+        if self._tag_values is None:
+            self._tag_values = [None] * len(self.TAGS)
+        self._tag_values[self.TAGS.index(tag)] = tag_value
         if tag == "Owner" or tag == "owner":
             self.set_email_if_valid(tag_value)
 
@@ -69,13 +144,14 @@ class report_resource:
         elif "shared" in tag_value.lower():
             self.is_shared = True
 
-    def set_daily_cost(self, val: float):
+    # Costs are in micro-dollars, see src.money
+    def set_daily_cost(self, val: int):
         # if the daily cost is already set, we shouldn't be setting it again
         assert self.daily_cost == 0
         self.daily_cost = val
 
     # Since the monthly cost is an aggregate of multiple days, add every value passed
-    def add_to_monthly_cost(self, val: float):
+    def add_to_monthly_cost(self, val: int):
         self.monthly_cost += val
 
     def get_resource_arn(self):
@@ -0,0 +1,182 @@
+"""
+Runs reports from a long-lived process: on a daily schedule, and on demand over HTTP.
+
+Clients, compiled templates and fetched source data are kept between runs, see src/clients.py and
+src/fetch_cache.py, so a report only pays for the data that changed since the last one.
+"""
+import datetime
+import http.server
+from pathlib import (
+    Path,
+)
+import re
+import sched
+import shlex
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from typing import (
+    Callable,
+    Mapping,
+    MutableMapping,
+    Optional,
+)
+
+from src.run_profile import (
+    RunProfile,
+)
+
+
+def parse_schedule(value: str) -> tuple:
+    """
+    >>> parse_schedule('aws=06:00'), parse_schedule('gcp=17:30')
+    (('aws', datetime.time(6, 0)), ('gcp', datetime.time(17, 30)))
+    """
+    platform, _, at = value.partition('=')
+    return platform, datetime.time.fromisoformat(at)
+
+
+def next_run(at: datetime.time, now: datetime.datetime) -> datetime.datetime:
+    """
+    >>> next_run(datetime.time(6), datetime.datetime(2020, 10, 1, 5, 59))
+    datetime.datetime(2020, 10, 1, 6, 0)
+    >>> next_run(datetime.time(6), datetime.datetime(2020, 10, 1, 6, 0))
+    datetime.datetime(2020, 10, 2, 6, 0)
+    """
+    run = datetime.datetime.combine(now.date(), at)
+    return run if run > now else run + datetime.timedelta(1)
+
+
+class ReportService:
+    """
+    >>> import tempfile, urllib.request
+    >>> class Report:
+    ...     def __init__(self, config_path, date, cache, profile=None):
+    ...         self.date = date
+    ...     def generateBetterReport(self, side_effects=True):
+    ...         return f'report for {self.date} with side effects {side_effects}'
+    >>> Report.default_date = staticmethod(lambda today: today - datetime.timedelta(1))
+    >>> service = ReportService({'aws': Report}, 'config.json', cache={}, output_dir=tempfile.mkdtemp())
+    >>> service.run('aws', datetime.date(2020, 10, 2)).read_text()
+    'report for 2020-10-01 with side effects True'
+
+    >>> server = service.start_server('127.0.0.1', 0)
+    >>> url = f'http://127.0.0.1:{server.server_port}'
+    >>> urllib.request.urlopen(f'{url}/report/aws/2020-10-05').read()
+    b'report for 2020-10-05 with side effects False'
+    >>> urllib.request.urlopen(f'{url}/report/azure/2020-10-05')
+    Traceback (most recent call last):
+    ...
+    urllib.error.HTTPError: HTTP Error 404: Not Found
+    >>> server.shutdown(); server.server_close()
+    """
+
+    def __init__(self,
+                 report_types: Mapping[str, Callable],
+                 config_path: str,
+                 cache: MutableMapping,
+                 output_dir: str,
+                 schedule: Mapping[str, datetime.time] = None,
+                 mail_command: Optional[str] = None,
+                 fail_log: Optional[str] = None,
+                 profile_dir: Optional[str] = None):
+        self.report_types = report_types
+        self.config_path = config_path
+        # Shared by all reports of the service
+        self.cache = cache
+        self.output_dir = Path(output_dir)
+        self.schedule = {} if schedule is None else schedule
+        # Command that the .eml of each scheduled report is piped to, e.g. `/usr/sbin/sendmail -t`
+        self.mail_command = mail_command
+        self.fail_log = fail_log
+        self.profile_dir = profile_dir
+        self.scheduler = sched.scheduler(time.time, time.sleep)
+
+    def render(self, platform: str, date: datetime.date) -> str:
+        """Render the report without saving usage data or writing personalized emails."""
+        report = self.report_types[platform](self.config_path, date, cache=self.cache)
+        return report.generateBetterReport(side_effects=False)
+
+    def run(self, platform: str, today: datetime.date) -> Path:
+        """Generate the report that is due today, write its .eml to the output directory and mail it."""
+        report_type = self.report_types[platform]
+        date = report_type.default_date(today)
+        profile = RunProfile()
+        report = report_type(self.config_path, date, cache=self.cache, profile=profile)
+        email = report.generateBetterReport()
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        path = self.output_dir / f'{platform}-{date.isoformat()}.eml'
+        path.write_text(email)
+        if self.mail_command is not None:
+            subprocess.run(shlex.split(self.mail_command), input=email, universal_newlines=True, check=True)
+        if self.profile_dir is not None:
+            profile.write(self.profile_dir, f'{platform}-{date.isoformat()}', platform=platform)
+        return path
+
+    def run_scheduled(self, platform: str) -> None:
+        today = datetime.date.today()
+        try:
+            self.run(platform, today)
+        except Exception:
+            traceback.print_exc(file=sys.stderr)
+            if self.fail_log is not None:
+                # Same format as scripts/run-report.sh, so that scripts/retry-failed-reports.py picks it up
+                date = self.report_types[platform].default_date(today)
+                with open(self.fail_log, 'a') as fail_log:
+                    fail_log.write(f'{platform},{date.isoformat()}\n')
+        finally:
+            self.schedule_next(platform)
+
+    def schedule_next(self, platform: str) -> None:
+        run = next_run(self.schedule[platform], datetime.datetime.now())
+        self.scheduler.enterabs(run.timestamp(), 0, self.run_scheduled, (platform,))
+
+    def handler(self) -> type:
+        service = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                match = re.fullmatch(r'/report/(\w+)/(\d{4}-\d{2}-\d{2})', self.path)
+                if match is None or match.group(1) not in service.report_types:
+                    self.send_error(404)
+                    return
+                try:
+                    date = datetime.date.fromisoformat(match.group(2))
+                except ValueError:
+                    self.send_error(400, 'Invalid date')
+                    return
+                try:
+                    body = service.render(match.group(1), date).encode()
+                except Exception as e:
+                    traceback.print_exc(file=sys.stderr)
+                    self.send_error(500, type(e).__name__)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'message/rfc822')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def start_server(self, host: str, port: int) -> http.server.ThreadingHTTPServer:
+        server = http.server.ThreadingHTTPServer((host, port), self.handler())
+        threading.Thread(target=server.serve_forever, name='http', daemon=True).start()
+        return server
+
+    def serve(self, host: str, port: int) -> None:
+        """Serve reports over HTTP and run the scheduled reports until interrupted."""
+        server = self.start_server(host, port)
+        try:
+            for platform in self.schedule:
+                self.schedule_next(platform)
+            while True:
+                self.scheduler.run()
+                # Without a schedule, only serve HTTP
+                time.sleep(60)
+        finally:
+            server.shutdown()
+            server.server_close()
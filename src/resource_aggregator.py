@@ -0,0 +1,185 @@
+"""
+Month-to-date costs of CUR resources, aggregated within a bound on the number of resources kept in memory.
+
+Accounts with millions of distinct resources, like snapshots or Lambda functions, would otherwise need all of them in
+memory at once. Once the bound is reached, the partial aggregates are merged into a SQLite database in a temporary
+directory, and the resources are read back from there one at a time.
+"""
+import heapq
+import json
+import operator
+import sqlite3
+import tempfile
+from typing import (
+    Callable,
+    Hashable,
+    Iterator,
+    Mapping,
+    Optional,
+    Tuple,
+)
+import weakref
+
+from src.report_resource import (
+    report_resource,
+)
+
+SCHEMA = (
+    'CREATE TABLE resources (key TEXT PRIMARY KEY, arn TEXT, type TEXT, account_name TEXT, region TEXT, '
+    'owner TEXT, owner_lower TEXT, monthly_cost INTEGER)',
+    'CREATE TABLE usage_types (key TEXT, usage_type TEXT, amount INTEGER, PRIMARY KEY (key, usage_type))',
+)
+
+# Tags are kept from the latest line item that has them, like report_resource.add_tag_value does in memory
+MERGE_RESOURCE = (
+    'INSERT INTO resources VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET '
+    'owner = coalesce(excluded.owner, owner), owner_lower = coalesce(excluded.owner_lower, owner_lower), '
+    'monthly_cost = monthly_cost + excluded.monthly_cost'
+)
+
+MERGE_USAGE_TYPE = (
+    'INSERT INTO usage_types VALUES (?, ?, ?) ON CONFLICT (key, usage_type) DO UPDATE SET '
+    'amount = amount + excluded.amount'
+)
+
+
+def encode_key(key: Hashable) -> str:
+    return json.dumps(key)
+
+
+def decode_key(text: str) -> Hashable:
+    key = json.loads(text)
+    return tuple(key) if isinstance(key, list) else key
+
+
+class ResourceAggregator(Mapping):
+    """
+    A mapping of resource keys to report_resource instances, as built by AWSReport.generateResourceSummary. Resources
+    keyed by their resource ID get a console URL, those keyed by a tuple are pseudo-resources that have none.
+
+    >>> aggregator = ResourceAggregator(max_resources=2)
+    >>> def add(key, cost, owner=None):
+    ...     resource = aggregator.get_or_create(key, lambda: report_resource(key, 'Amazon Simple Storage Service', '',
+    ...                                                                      'one', 'us-west-2'))
+    ...     if owner is not None:
+    ...         resource.add_tag_value('Owner', owner)
+    ...     resource.add_to_monthly_cost(cost)
+    ...     resource.add_usage_type('TimedStorage-ByteHrs', cost)
+    >>> add('a', 1); add('b', 2, 'someone@ucsc.edu'); add('c', 4); add('a', 8); add('d', 16)
+    >>> aggregator.spills
+    2
+    >>> {key: (r.monthly_cost, r.email, dict(r.usage_types)) for key, r in aggregator.items()}
+    {'a': (9, None, {'TimedStorage-ByteHrs': 9}), 'b': (2, 'someone@ucsc.edu', {'TimedStorage-ByteHrs': 2}), \
+'c': (4, None, {'TimedStorage-ByteHrs': 4}), 'd': (16, None, {'TimedStorage-ByteHrs': 16})}
+    >>> len(aggregator), aggregator['a'].url
+    (4, 'https://s3.console.aws.amazon.com/s3/buckets/a?region=us-west-2&tab=objects')
+    >>> list(aggregator.top(2))
+    ['d', 'a']
+    """
+
+    def __init__(self, max_resources: Optional[int] = None, spill_dir: Optional[str] = None, profile=None):
+        # The number of resources kept in memory before they are spilled, or None to keep all of them in memory
+        self.max_resources = max_resources
+        self.spill_dir = spill_dir
+        self.profile = profile
+        self._resources = {}
+        self._db = None
+        self.spills = 0
+
+    def get_or_create(self, key: Hashable, create: Callable[[], report_resource]) -> report_resource:
+        """
+        Return the in-memory aggregate of the resource with the given key, creating it if there is none. Costs and
+        usage added to it are added to those of any earlier aggregate of the same resource that was spilled.
+        """
+        resource = self._resources.get(key)
+        if resource is None:
+            if self.max_resources is not None and len(self._resources) >= self.max_resources:
+                self.spill()
+            resource = self._resources[key] = create()
+        return resource
+
+    def spill(self) -> None:
+        """Merge the resources in memory into those on disk."""
+        if not self._resources:
+            return
+        if self._db is None:
+            directory = tempfile.TemporaryDirectory(dir=self.spill_dir)
+            self._db = sqlite3.connect(f'{directory.name}/resources.sqlite3', check_same_thread=False)
+            # Closing the connection before removing the directory lets the latter succeed on any platform
+            weakref.finalize(self, lambda db, directory: (db.close(), directory.cleanup()), self._db, directory)
+            for statement in SCHEMA:
+                self._db.execute(statement)
+        with self._db:
+            self._db.executemany(MERGE_RESOURCE, (
+                (encode_key(key), r.resource_arn, r.resource_type, r.account_name, r.region,
+                 r.get_tag_value('Owner'), r.get_tag_value('owner'), r.monthly_cost)
+                for key, r in self._resources.items()
+            ))
+            self._db.executemany(MERGE_USAGE_TYPE, (
+                (encode_key(key), usage_type, amount)
+                for key, r in self._resources.items()
+                for usage_type, amount in r.usage_types.items()
+            ))
+        if self.profile is not None:
+            self.profile.count_call('resource_spill')
+            self.profile.add_rows('resource_spill', len(self._resources))
+        self._resources = {}
+        self.spills += 1
+
+    def _resource(self, key: Hashable, row: tuple, usage_types: Mapping[str, int]) -> report_resource:
+        arn, resource_type, account_name, region, owner, owner_lower, monthly_cost = row
+        resource = report_resource(arn, resource_type, '', account_name, region)
+        if isinstance(key, str):
+            resource.set_resource_url()
+        if owner:
+            resource.add_tag_value('Owner', owner)
+        elif owner_lower:
+            resource.add_tag_value('owner', owner_lower)
+        resource.add_to_monthly_cost(monthly_cost)
+        for usage_type, amount in usage_types.items():
+            resource.add_usage_type(usage_type, amount)
+        return resource
+
+    def items(self) -> Iterator[Tuple[Hashable, report_resource]]:
+        if self._db is None:
+            yield from self._resources.items()
+            return
+        self.spill()
+        resources = self._db.execute('SELECT key, arn, type, account_name, region, owner, owner_lower, monthly_cost '
+                                     'FROM resources ORDER BY key')
+        usage_types = self._db.execute('SELECT key, usage_type, amount FROM usage_types ORDER BY key')
+        usage_type = next(usage_types, None)
+        # Both queries are ordered by key, so the usage types of each resource are read while walking the resources
+        for key, *row in resources:
+            amounts = {}
+            while usage_type is not None and usage_type[0] == key:
+                amounts[usage_type[1]] = usage_type[2]
+                usage_type = next(usage_types, None)
+            yield decode_key(key), self._resource(decode_key(key), row, amounts)
+
+    def values(self) -> Iterator[report_resource]:
+        return map(operator.itemgetter(1), self.items())
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return map(operator.itemgetter(0), self.items())
+
+    def __len__(self) -> int:
+        if self._db is None:
+            return len(self._resources)
+        self.spill()
+        return self._db.execute('SELECT count(*) FROM resources').fetchone()[0]
+
+    def __getitem__(self, key: Hashable) -> report_resource:
+        if self._db is None:
+            return self._resources[key]
+        self.spill()
+        row = self._db.execute('SELECT arn, type, account_name, region, owner, owner_lower, monthly_cost '
+                               'FROM resources WHERE key = ?', (encode_key(key),)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        usage_types = self._db.execute('SELECT usage_type, amount FROM usage_types WHERE key = ?', (encode_key(key),))
+        return self._resource(key, row, dict(usage_types))
+
+    def top(self, n: int) -> Mapping[Hashable, report_resource]:
+        """Return the n most expensive resources, most expensive first, keeping no more than n of them at a time."""
+        return dict(heapq.nlargest(n, self.items(), key=lambda item: item[1].monthly_cost))
@@ -0,0 +1,171 @@
+"""
+Timings and counters of a single report run, written as JSON and as a Prometheus textfile.
+"""
+import collections
+import contextlib
+import cProfile
+import json
+from pathlib import (
+    Path,
+)
+import threading
+import time
+from typing import (
+    ContextManager,
+    Iterable,
+    Iterator,
+    Mapping,
+    Optional,
+)
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+class RunProfile:
+
+    def __init__(self, cprofile_phases: Iterable[str] = (), cprofile_dir: Optional[str] = None):
+        self.phases = collections.OrderedDict()
+        self.api_calls = collections.Counter()
+        self.rows = collections.Counter()
+        self.bytes_downloaded = 0
+        # Phases to run under cProfile, and where to dump their stats
+        self.cprofile_phases = set(cprofile_phases)
+        self.cprofile_dir = cprofile_dir
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Time the enclosed block. Time spent in a phase of the same name is added up.
+
+        >>> profile = RunProfile()
+        >>> with profile.phase('render'):
+        ...     pass
+        >>> list(profile.phases)
+        ['render']
+        """
+        profiler = cProfile.Profile() if name in self.cprofile_phases else None
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                directory = Path(self.cprofile_dir or '.')
+                directory.mkdir(parents=True, exist_ok=True)
+                profiler.dump_stats(str(directory / f'{name}.prof'))
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def count_call(self, service: str, calls: int = 1) -> None:
+        with self._lock:
+            self.api_calls[service] += calls
+
+    def add_rows(self, source: str, rows: int) -> None:
+        with self._lock:
+            self.rows[source] += rows
+
+    def add_bytes(self, downloaded: int) -> None:
+        with self._lock:
+            self.bytes_downloaded += downloaded
+
+    def peak_rss_bytes(self) -> Optional[int]:
+        if resource is None:
+            return None
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def to_dict(self) -> Mapping:
+        return {
+            'phase_seconds': dict(self.phases),
+            'api_calls': dict(self.api_calls),
+            'rows': dict(self.rows),
+            'bytes_downloaded': self.bytes_downloaded,
+            'peak_rss_bytes': self.peak_rss_bytes()
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self, **labels: str) -> str:
+        """
+        Return the profile in the Prometheus text exposition format, as read by the node exporter's textfile collector.
+
+        >>> profile = RunProfile()
+        >>> profile.count_call('ce', 3)
+        >>> profile.add_rows('cur', 10)
+        >>> print(profile.to_prometheus(platform='aws'))  # doctest: +ELLIPSIS
+        # HELP billing_report_phase_seconds Wall time spent in each phase of the report run.
+        # TYPE billing_report_phase_seconds gauge
+        # HELP billing_report_api_calls Number of requests made to each cloud API.
+        # TYPE billing_report_api_calls gauge
+        billing_report_api_calls{platform="aws",service="ce"} 3
+        # HELP billing_report_rows Number of billing rows processed from each source.
+        # TYPE billing_report_rows gauge
+        billing_report_rows{platform="aws",source="cur"} 10
+        # HELP billing_report_bytes_downloaded Number of bytes of billing data downloaded.
+        # TYPE billing_report_bytes_downloaded gauge
+        billing_report_bytes_downloaded{platform="aws"} 0
+        ...
+        """
+        def metric(name: str, help: str, values: Mapping[Optional[str], float], label: Optional[str] = None) -> Iterator[str]:
+            yield f'# HELP billing_report_{name} {help}'
+            yield f'# TYPE billing_report_{name} gauge'
+            for key, value in values.items():
+                all_labels = dict(labels, **({label: key} if label is not None else {}))
+                rendered = ','.join(f'{k}="{v}"' for k, v in all_labels.items())
+                yield f'billing_report_{name}{{{rendered}}} {value}'
+
+        lines = [
+            *metric('phase_seconds', 'Wall time spent in each phase of the report run.', self.phases, 'phase'),
+            *metric('api_calls', 'Number of requests made to each cloud API.', self.api_calls, 'service'),
+            *metric('rows', 'Number of billing rows processed from each source.', self.rows, 'source'),
+            *metric('bytes_downloaded', 'Number of bytes of billing data downloaded.', {None: self.bytes_downloaded}),
+        ]
+        peak_rss = self.peak_rss_bytes()
+        if peak_rss is not None:
+            lines += metric('peak_rss_bytes', 'Peak resident set size of the report process.', {None: peak_rss})
+        return '\n'.join(lines) + '\n'
+
+    def write(self, directory: str, base: str, **labels: str) -> None:
+        """Write <base>.profile.json and <base>.prom into the given directory."""
+        path = Path(directory)
+        path.mkdir(parents=True, exist_ok=True)
+        (path / f'{base}.profile.json').write_text(self.to_json())
+        # Write the textfile atomically, so the collector never reads a partial file
+        prom = path / f'{base}.prom'
+        tmp = prom.with_suffix('.prom.tmp')
+        tmp.write_text(self.to_prometheus(**labels))
+        tmp.replace(prom)
+
+    def scoped(self, prefix: str) -> 'ScopedProfile':
+        return ScopedProfile(self, prefix)
+
+
+class ScopedProfile:
+    """
+    The profile of one of several reports run concurrently that share a RunProfile. Their phases overlap in time, so
+    the phases of each report are recorded as <prefix>.<phase>. All counters are shared.
+
+    >>> profile = RunProfile()
+    >>> with profile.scoped('aws').phase('render'):
+    ...     profile.scoped('aws').count_call('ce')
+    >>> list(profile.phases), dict(profile.api_calls)
+    (['aws.render'], {'ce': 1})
+    """
+
+    def __init__(self, profile: RunProfile, prefix: str):
+        self.profile = profile
+        self.prefix = prefix
+
+    def phase(self, name: str) -> ContextManager[None]:
+        return self.profile.phase(f'{self.prefix}.{name}')
+
+    def __getattr__(self, name: str):
+        return getattr(self.profile, name)
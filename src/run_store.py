@@ -0,0 +1,202 @@
+"""
+A local record of report runs, so that a failed run can be retried without fetching or rendering again.
+
+Each run records the source data it fetched, the side effects it completed, like saving usage data or writing the
+personalized emails, and the rendered email. Once the email is rendered, a retry only needs the email, so the fetched
+data is no longer recorded for that run. The fetched data and the email are stored once per distinct content, under
+the SHA-256 of their pickle, so that retries and runs of the same month share them:
+
+    objects/<sha256>                       gzipped pickle of a fetched source, or of the email
+    runs/<platform>-<date>/<inputs>.json   the run of a report on the given inputs
+    runs/<platform>-<date>/latest          the <inputs> of the latest run of that report
+
+The inputs of a run are identified by the SHA-256 of the cache keys of its sources and their hashes. Pickles are only
+read back from the store's own directory, which must not be writable by anyone who can't run reports anyway. Only the
+runs of the last few report dates of each platform are kept, see RunStore.prune.
+"""
+import datetime
+import gzip
+import hashlib
+import json
+from pathlib import (
+    Path,
+)
+import pickle
+import shutil
+import time
+from typing import (
+    Any,
+    Hashable,
+    Mapping,
+    Optional,
+)
+
+
+def write_atomically(path: Path, content: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_bytes(content)
+    tmp.replace(path)
+
+
+class ReportRun:
+    """The record of a run of a report on given inputs, updated as the run progresses."""
+
+    def __init__(self, store: 'RunStore', path: Path, record: Mapping[str, Any]):
+        self.store = store
+        self.path = path
+        self.record = record
+
+    @property
+    def input_hash(self) -> str:
+        return self.path.stem
+
+    @property
+    def email(self) -> Optional[str]:
+        email = self.record.get('email')
+        return None if email is None else self.store.get(email)
+
+    def inputs(self) -> Mapping[Hashable, Any]:
+        """Return the fetched sources of this run by their cache key."""
+        return {pickle.loads(bytes.fromhex(key)): self.store.get(digest) for key, digest in self.record['inputs']}
+
+    def is_done(self, phase: str) -> bool:
+        return phase in self.record['done']
+
+    def done(self, phase: str) -> None:
+        self.record['done'].append(phase)
+        self.save()
+
+    def set_email(self, email: str) -> None:
+        self.record['email'] = self.store.put(email)
+        # Resuming a run whose email was rendered just returns the email
+        self.record['inputs'] = []
+        self.save()
+
+    def save(self) -> None:
+        write_atomically(self.path, json.dumps(self.record, indent=2).encode())
+
+
+class RunStore:
+    """
+    >>> import tempfile
+    >>> store = RunStore(tempfile.mkdtemp())
+    >>> date = datetime.date(2020, 10, 1)
+    >>> store.latest('aws', date) is None
+    True
+    >>> run = store.create('aws', date, {('ce', 'query', date): [{'Amount': '1.5'}]})
+    >>> run.done('save_usage_data')
+    >>> retry = store.latest('aws', date)
+    >>> retry.input_hash == run.input_hash, retry.is_done('save_usage_data'), retry.is_done('compliance_scan')
+    (True, True, False)
+    >>> retry.inputs(), retry.email
+    ({('ce', 'query', datetime.date(2020, 10, 1)): [{'Amount': '1.5'}]}, None)
+    >>> retry.set_email('Subject: AWS Report')
+    >>> store.latest('aws', date).email, store.latest('aws', date).inputs()
+    ('Subject: AWS Report', {})
+
+    The same inputs are stored once:
+
+    >>> _ = store.create('aws', datetime.date(2020, 10, 2), {('ce', 'query', date): [{'Amount': '1.5'}]})
+    >>> len(list((store.root / 'objects').iterdir()))
+    2
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def put(self, value: Any) -> str:
+        content = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.root / 'objects' / digest
+        if path.exists():
+            # Tell prune() that the object is in use again
+            path.touch()
+        else:
+            # A fixed mtime keeps the gzip of equal content equal
+            write_atomically(path, gzip.compress(content, mtime=0))
+        return digest
+
+    def get(self, digest: str) -> Any:
+        return pickle.loads(gzip.decompress((self.root / 'objects' / digest).read_bytes()))
+
+    def runs_dir(self, platform: str, date: datetime.date) -> Path:
+        return self.root / 'runs' / f'{platform}-{date.isoformat()}'
+
+    def create(self, platform: str, date: datetime.date, inputs: Mapping[Hashable, Any]) -> ReportRun:
+        """Record a new run of the report for the given platform and date on the given sources, by cache key."""
+        # Cache keys are tuples of strings, dates and numbers, which pickle the same every time
+        pairs = sorted((pickle.dumps(key, protocol=4).hex(), self.put(value)) for key, value in inputs.items())
+        input_hash = hashlib.sha256(json.dumps(pairs).encode()).hexdigest()
+        directory = self.runs_dir(platform, date)
+        path = directory / f'{input_hash}.json'
+        if path.exists():
+            run = ReportRun(self, path, json.loads(path.read_text()))
+        else:
+            run = ReportRun(self, path, {'inputs': pairs, 'done': [], 'email': None})
+            run.save()
+        write_atomically(directory / 'latest', input_hash.encode())
+        return run
+
+    def latest(self, platform: str, date: datetime.date) -> Optional[ReportRun]:
+        """Return the latest run of the report for the given platform and date, if any."""
+        directory = self.runs_dir(platform, date)
+        try:
+            input_hash = (directory / 'latest').read_text()
+        except FileNotFoundError:
+            return None
+        path = directory / f'{input_hash}.json'
+        return ReportRun(self, path, json.loads(path.read_text()))
+
+    def prune(self, keep: int, grace: float = 3600) -> None:
+        """
+        Remove the runs of all but the last `keep` report dates of each platform, the runs that a later run of the same
+        report superseded, and the objects that no remaining run refers to. Objects stored in the last `grace` seconds
+        are kept, since a run in progress may not have recorded them yet.
+
+        >>> import tempfile
+        >>> store = RunStore(tempfile.mkdtemp())
+        >>> for day in (1, 2, 3):
+        ...     date = datetime.date(2020, 10, day)
+        ...     _ = store.create('aws', date, {('ce', date): day})
+        ...     _ = store.create('gcp', date, {('bigquery', date): day * 10})
+        >>> _ = store.create('aws', date, {('ce', date): 4})
+        >>> store.latest('aws', date).set_email('Subject: AWS Report')
+        >>> store.prune(keep=2, grace=0)
+        >>> sorted(path.name for path in (store.root / 'runs').iterdir())
+        ['aws-2020-10-02', 'aws-2020-10-03', 'gcp-2020-10-02', 'gcp-2020-10-03']
+        >>> len(list(store.runs_dir('aws', date).glob('*.json')))
+        1
+
+        The inputs of aws-2020-10-02 and gcp-2020-10-02 and 03, and the email of aws-2020-10-03 remain:
+
+        >>> len(list((store.root / 'objects').iterdir()))
+        4
+        """
+        runs = self.root / 'runs'
+        by_platform = {}
+        for directory in sorted(runs.iterdir()) if runs.exists() else ():
+            platform, _, _ = directory.name.partition('-')
+            by_platform.setdefault(platform, []).append(directory)
+        referenced = set()
+        for directories in by_platform.values():
+            for directory in directories[:-keep] if keep > 0 else directories:
+                shutil.rmtree(directory)
+            for directory in directories[-keep:] if keep > 0 else ():
+                try:
+                    latest = (directory / 'latest').read_text()
+                except FileNotFoundError:
+                    latest = None
+                for path in directory.glob('*.json'):
+                    if path.stem == latest:
+                        record = json.loads(path.read_text())
+                        referenced.update(digest for _, digest in record['inputs'])
+                        if record['email'] is not None:
+                            referenced.add(record['email'])
+                    else:
+                        path.unlink()
+        objects = self.root / 'objects'
+        cutoff = time.time() - grace
+        for path in objects.iterdir() if objects.exists() else ():
+            if path.name not in referenced and path.stat().st_mtime < cutoff:
+                path.unlink()
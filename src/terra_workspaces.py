@@ -0,0 +1,200 @@
+"""
+Fetches the Terra workspaces the report attributes Google projects to, keeping only the project and creator of each.
+
+The workspaces are requested with only those fields, and the response is parsed one workspace at a time as it is read,
+so neither the attributes of a workspace, which may be confidential, nor the whole response are ever held in memory.
+The result is written as a JSON array in the format GCPReport.readTerraWorkspaces reads:
+
+    [{"workspace": {"googleProject": "...", "createdBy": "..."}}, ...]
+
+The ETag and Last-Modified of the response are kept in a sidecar file next to it, `<path>.meta.json`, and sent with
+the next request, so that the workspaces are only downloaded again once they changed.
+"""
+import argparse
+import codecs
+import json
+import os
+from pathlib import (
+    Path,
+)
+import re
+import subprocess
+from typing import (
+    Iterable,
+    Iterator,
+    Mapping,
+    Optional,
+)
+import urllib.error
+import urllib.parse
+import urllib.request
+
+URL = 'https://api.firecloud.org/api/workspaces'
+
+FIELDS = ('googleProject', 'createdBy')
+
+# Bytes read from the response at a time
+CHUNK_SIZE = 65536
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+def iter_array(chunks: Iterable[str]) -> Iterator[object]:
+    """
+    Yield the elements of the JSON array of objects whose text is split into the given chunks.
+
+    >>> list(iter_array(['[{"a": [1', ', 2]}, ', '{"b": "}"}', ']']))
+    [{'a': [1, 2]}, {'b': '}'}]
+    >>> list(iter_array([' [ ] ']))
+    []
+    >>> list(iter_array(['[{"a": 1}, {"b"']))
+    Traceback (most recent call last):
+    ...
+    ValueError: Incomplete JSON array
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    start = False
+    end = False
+    for chunk in chunks:
+        # The elements are decoded at an index into the buffer, which is only trimmed once per chunk, to the element
+        # that is still incomplete
+        buffer += chunk
+        index = 0
+        while not end:
+            index = WHITESPACE.match(buffer, index).end()
+            if index == len(buffer):
+                break
+            if not start:
+                if buffer[index] != '[':
+                    raise ValueError('Expected a JSON array')
+                start = True
+                index += 1
+            elif buffer[index] == ',':
+                index += 1
+            elif buffer[index] == ']':
+                end = True
+            else:
+                try:
+                    element, index = decoder.raw_decode(buffer, index)
+                except json.JSONDecodeError:
+                    # An object is only complete once its closing brace was read
+                    break
+                yield element
+        buffer = buffer[index:]
+    if not end:
+        raise ValueError('Incomplete JSON array')
+
+
+def trim(workspaces: Iterable[Mapping]) -> Iterator[Mapping]:
+    """
+    >>> list(trim([{'workspace': {'googleProject': 'p', 'createdBy': 'x@ucsc.edu', 'attributes': {'secret': 1}}},
+    ...            {'accessLevel': 'READER'}]))
+    [{'workspace': {'googleProject': 'p', 'createdBy': 'x@ucsc.edu'}}]
+    """
+    for mapping in workspaces:
+        workspace = mapping.get('workspace') if isinstance(mapping, Mapping) else None
+        if isinstance(workspace, Mapping):
+            yield {'workspace': {field: workspace[field] for field in FIELDS if field in workspace}}
+
+
+def read_chunks(response, size: int = CHUNK_SIZE) -> Iterator[str]:
+    charset = response.headers.get_content_charset() or 'utf-8'
+    decoder = codecs.getincrementaldecoder(charset)()
+    while True:
+        data = response.read(size)
+        if not data:
+            break
+        yield decoder.decode(data)
+    yield decoder.decode(b'', final=True)
+
+
+def meta_path(path: Path) -> Path:
+    return path.with_name(path.name + '.meta.json')
+
+
+def fetch(path: str, token: str, url: str = URL, timeout: float = 60.0) -> bool:
+    """
+    Write the workspaces to the given path, unless they didn't change since they were last written there. Return
+    whether they were written.
+
+    >>> import http.server, tempfile, threading
+    >>> body = json.dumps([{'workspace': {'googleProject': 'p-a', 'createdBy': 'x@ucsc.edu', 'attributes': {'a': 1}}},
+    ...                    {'workspace': {'googleProject': 'p-b', 'createdBy': 'y@ucsc.edu'}}]).encode()
+    >>> requests = []
+    >>> class Terra(http.server.BaseHTTPRequestHandler):
+    ...     def do_GET(self):
+    ...         requests.append((self.path, self.headers['Authorization'], self.headers['If-None-Match']))
+    ...         if self.headers['If-None-Match'] == '"v1"':
+    ...             self.send_response(304); self.end_headers()
+    ...         else:
+    ...             self.send_response(200); self.send_header('ETag', '"v1"'); self.end_headers(); self.wfile.write(body)
+    ...     def log_message(self, *args):
+    ...         pass
+    >>> server = http.server.HTTPServer(('127.0.0.1', 0), Terra)
+    >>> threading.Thread(target=server.serve_forever, daemon=True).start()
+    >>> url = f'http://127.0.0.1:{server.server_port}/api/workspaces'
+    >>> path = Path(tempfile.mkdtemp()) / 'terra-workspaces.json'
+    >>> fetch(str(path), 'token', url), fetch(str(path), 'token', url)
+    (True, False)
+    >>> json.loads(path.read_text())
+    [{'workspace': {'googleProject': 'p-a', 'createdBy': 'x@ucsc.edu'}}, {'workspace': {'googleProject': 'p-b', 'createdBy': 'y@ucsc.edu'}}]
+    >>> requests
+    [('/api/workspaces?fields=workspace.googleProject%2Cworkspace.createdBy', 'Bearer token', None), \
+('/api/workspaces?fields=workspace.googleProject%2Cworkspace.createdBy', 'Bearer token', '"v1"')]
+    >>> server.shutdown(); server.server_close()
+    """
+    path = Path(path)
+    meta = {}
+    if path.exists():
+        try:
+            meta = json.loads(meta_path(path).read_text())
+        except (OSError, ValueError):
+            pass
+    headers = {'Accept': 'application/json', 'Authorization': f'Bearer {token}'}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+    query = urllib.parse.urlencode({'fields': ','.join(f'workspace.{field}' for field in FIELDS)})
+    request = urllib.request.Request(f'{url}?{query}', headers=headers)
+    try:
+        response = urllib.request.urlopen(request, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return False
+        raise
+    with response:
+        tmp = path.with_name(path.name + '.tmp')
+        with tmp.open('w') as file:
+            file.write('[')
+            for i, workspace in enumerate(trim(iter_array(read_chunks(response)))):
+                file.write(',\n' if i else '\n')
+                file.write(json.dumps(workspace, separators=(',', ':')))
+            file.write('\n]\n')
+        tmp.replace(path)
+        meta = {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+    meta_path(path).write_text(json.dumps(meta))
+    return True
+
+
+def access_token() -> str:
+    """Return the access token of the user gcloud is authenticated as."""
+    return subprocess.run(['gcloud', 'auth', 'print-access-token'],
+                          check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout.strip()
+
+
+def main(argv: Optional[Iterable[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Write the project and creator of each Terra workspace the gcloud user '
+                                                 'has access to to a file, unless they did not change since.')
+    parser.add_argument('path', help='The file to write the workspaces to, with --terra-workspaces of report.py.')
+    parser.add_argument('--url', default=URL, help='The workspaces endpoint of the Terra API.')
+    arguments = parser.parse_args(argv)
+    # TERRA_ACCESS_TOKEN spares running gcloud, and keeps the token off the command line
+    token = os.environ.get('TERRA_ACCESS_TOKEN') or access_token()
+    written = fetch(arguments.path, token, arguments.url)
+    print(f'{arguments.path} {"updated" if written else "unchanged"}')
+
+
+if __name__ == '__main__':
+    main()